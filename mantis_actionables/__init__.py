@@ -1,5 +1,7 @@
 __version__ = '0.3.0'
 
+default_app_config = 'mantis_actionables.apps.MantisActionablesConfig'
+
 import re
 
 from dingos import DINGOS_MANTIS_ACTIONABLES_CONTEXT_TAG_REGEX
@@ -48,6 +50,142 @@ MANTIS_ACTIONABLES_CONTEXT_TAG_REGEX = DINGOS_MANTIS_ACTIONABLES_CONTEXT_TAG_REG
 
 MANTIS_ACTIONABLES_STATUS_UPDATE_FUNCTION_PATH = ""
 
+MANTIS_ACTIONABLES_STATUS_BATCH_UPDATE_FUNCTION_PATH = ""
+
 MANTIS_ACTIONABLES_SRC_META_DATA_FUNCTION_PATH = ""
 
+# Settings for incremental imports (``extract_actionables --since-last-run``):
+# the lease taken by an import run expires after the given number of seconds
+# unless it is renewed (which happens after each imported report); reports
+# created up to the given number of seconds before the high-water mark are
+# considered again, to catch reports whose transaction committed late.
+
+MANTIS_ACTIONABLES_IMPORT_LEASE_SECONDS = 900
+
+MANTIS_ACTIONABLES_IMPORT_WATERMARK_OVERLAP_SECONDS = 3600
+
+# Number of times an incremental import tries to import a report that fails;
+# until then, the high-water mark is not advanced beyond the report.
+
+MANTIS_ACTIONABLES_IMPORT_MAX_ATTEMPTS = 3
+
+# Maximal number of reports handed to one worker at a time by parallel imports
+
+MANTIS_ACTIONABLES_PARALLEL_IMPORT_CHUNK_SIZE = 20
+
+# Number of rows imported (and committed) together by the bulk importers
+# (e.g., the CrowdStrike CSV import)
+
+MANTIS_ACTIONABLES_BULK_IMPORT_CHUNK_SIZE = 1000
+
+# Tables that do not ask for exact counts count at most this many rows
+
+MANTIS_ACTIONABLES_DATATABLE_COUNT_LIMIT = 10000
+
+# Number of seconds for which counts and page boundaries of a table
+# query are cached (0 switches caching off)
+
+MANTIS_ACTIONABLES_DATATABLE_CACHE_SECONDS = 300
+
+# Backend for the indexed search of observable values, report names and
+# import info names: dotted path to a subclass of
+# ``mantis_actionables.core.search.SearchBackend``; if empty, the backend
+# is chosen according to the database vendor.
+
+MANTIS_ACTIONABLES_SEARCH_BACKEND = ""
+
+# Types of singleton observables whose values are addresses, networks or
+# address ranges and are kept in the IP range index
+
+MANTIS_ACTIONABLES_IP_RANGE_TYPES = ['IP', 'IP_Block']
+
+# Types of singleton observables whose domains are kept in the domain
+# suffix index, mapped to the function extracting the domain from the
+# value ('fqdn', 'url' or 'email'; see ``mantis_actionables.core.domains``)
+
+MANTIS_ACTIONABLES_DOMAIN_TYPES = {'FQDN': 'fqdn',
+                                   'URL': 'url',
+                                   'Email_Address': 'email'}
+
+# Path of the compiled lookup artifact of the active observables (command
+# ``compile_lookup_artifact``; see ``mantis_actionables.core.lookup_artifact``)
+
+MANTIS_ACTIONABLES_LOOKUP_ARTIFACT_PATH = ""
+
+# Bulk lookup endpoint: maximal number of values per request and number
+# of values resolved per query (each value is looked up in up to three
+# spellings, which has to stay below the parameter limit of the database)
+
+MANTIS_ACTIONABLES_BULK_LOOKUP_MAX_VALUES = 100000
+
+MANTIS_ACTIONABLES_BULK_LOOKUP_CHUNK_SIZE = 300
+
+# Tokens with which non-browser clients (e.g., SOAR platforms or sensors)
+# authenticate against the bulk lookup and export endpoints, mapped to the
+# name of the user they act as; a client sends the header
+# ``Authorization: Token <token>``.
+
+MANTIS_ACTIONABLES_API_TOKENS = {}
+
+# Blocklists exported by the export endpoints and the command
+# ``export_feed``: name of the export -> types of singleton observables
+# (the IDS signatures are exported as ``ids``)
+
+MANTIS_ACTIONABLES_EXPORT_KINDS = {'ip': ['IP', 'IP_Block'],
+                                   'fqdn': ['FQDN'],
+                                   'url': ['URL'],
+                                   'hash': ['Hash']}
+
+# Indicator feeds that can be imported with the bulk importer (command
+# ``import_feed``); see ``mantis_actionables.core.feeds.Feed`` for the
+# keys of a feed definition.
+
+MANTIS_ACTIONABLES_FEEDS = {
+    'crowdstrike': {
+        'format': 'csv',
+        'namespace': {'uri': 'crowdstrike.com',
+                      'name': 'Crowdstrike'},
+        'columns': {'date': 'date',
+                    'indicator': 'indicator',
+                    'type': 'type',
+                    'actor': 'actor',
+                    'report': 'report',
+                    'domaintype': 'domaintype'},
+        'date_format': '%Y-%m-%d',
+        'list_separator': '|',
+        'empty_values': ['unknown', 'none'],
+        'types': {
+            'binary_string': ('Binary_String', ''),
+            'domain': ('FQDN', ''),
+            'email_address': ('Email_Address', ''),
+            'email_subject': ('Email_Subject', ''),
+            'event_name': ('Event_Name', ''),
+            'file_mapping': ('File_Mapping', ''),
+            'file_name': ('Filename', ''),
+            'file_path': ('Filepath', ''),
+            'hash_md5': ('Hash', 'MD5'),
+            'hash_sha1': ('Hash', 'SHA1'),
+            'hash_sha256': ('Hash', 'SHA256'),
+            'ip_address': ('IP', '', 'ip_address_version'),
+            'ip_address_block': ('IP_Block', '', 'ip_network_version'),
+            'mutex_name': ('Mutex_Name', ''),
+            'password': ('Password', ''),
+            'persona_name': ('Persona_Name', ''),
+            'registry': ('Registry', 'Key'),
+            'service_name': ('Service_Name', ''),
+            'url': ('URL', ''),
+            'user_agent': ('User_Agent', ''),
+            'username': ('Username', ''),
+            'x509_serial': ('x509', 'Serial'),
+            'x509_subject': ('x509', 'CN'),
+        },
+        'tlp': 'amber',
+        'origin': 'partner',
+        'processing': 'manually',
+        'import_info_names': {'actor': 'Crowdstrike indicators of %(date)s associated with Threat Actor "%(name)s"',
+                              'report': 'Crowdstrike indicators of %(date)s referencing report "%(name)s"'},
+        'import_info_description': 'Autogenerated via crowdstrike csv import',
+    },
+}
+
 
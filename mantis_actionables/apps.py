@@ -0,0 +1,36 @@
+# Copyright (c) Siemens AG, 2015
+#
+# This file is part of MANTIS.  MANTIS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either version 2
+# of the License, or(at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+from importlib import import_module
+
+from django.apps import AppConfig
+
+
+class MantisActionablesConfig(AppConfig):
+    name = 'mantis_actionables'
+
+    # Modules that connect signal receivers (keeping the search, IP range
+    # and domain indexes up to date) and register datatable filter operators
+    # when they are imported
+
+    REGISTERING_MODULES = ['core.search', 'core.ip_ranges', 'core.domains']
+
+    def ready(self):
+        # Import them here, so that the receivers and operators are in place
+        # in every process (web server, management commands, Celery workers)
+        for module_name in self.REGISTERING_MODULES:
+            import_module('%s.%s' % (self.name, module_name))
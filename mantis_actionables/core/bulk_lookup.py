@@ -0,0 +1,239 @@
+# Copyright (c) Siemens AG, 2015
+#
+# This file is part of MANTIS.  MANTIS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either version 2
+# of the License, or(at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+"""
+Bulk lookup of indicator values: which of a list of (possibly pasted and
+defanged) values are known as singleton observables, and with which
+status, TLP, tags and number of sources.
+
+The values are normalized and resolved in chunks, with one ``IN`` query
+for the observables and one query each for their active stati and their
+source counts per chunk; the results are produced as a stream of
+records, so that a response can be written while the lookup proceeds.
+"""
+
+import csv
+import json
+import logging
+
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Q, Count
+from django.utils.encoding import force_text
+
+from mantis_actionables import MANTIS_ACTIONABLES_BULK_LOOKUP_CHUNK_SIZE
+from mantis_actionables.models import SingletonObservable, Status2X, Status, Source
+
+from mantis_actionables.core.observables import chunks
+
+logger = logging.getLogger(__name__)
+
+
+# Common ways of defanging indicators in reports and tickets
+
+REFANG_REPLACEMENTS = (('[.]', '.'),
+                       ('(.)', '.'),
+                       ('[dot]', '.'),
+                       ('[:]', ':'),
+                       ('[@]', '@'),
+                       ('[at]', '@'))
+
+REFANG_SCHEMES = (('hxxps://', 'https://'),
+                  ('hxxp://', 'http://'),
+                  ('fxp://', 'ftp://'))
+
+RECORD_FIELDS = ('query',
+                 'found',
+                 'id',
+                 'type',
+                 'subtype',
+                 'value',
+                 'active',
+                 'false_positive',
+                 'priority',
+                 'confidence',
+                 'processing',
+                 'most_permissive_tlp',
+                 'most_restrictive_tlp',
+                 'active_from',
+                 'active_to',
+                 'tags',
+                 'sources')
+
+PRIORITY_MAP = dict(Status.PRIORITY_KIND)
+
+
+class BulkLookupError(ValueError):
+    pass
+
+
+def normalize_value(value):
+    """
+    Strip whitespace and quotes from a value and undo common defanging
+    (``evil[.]com``, ``hxxp://``).
+    """
+    value = force_text(value).strip().strip('"\'<>').strip()
+    for (defanged, fanged) in REFANG_REPLACEMENTS:
+        value = value.replace(defanged, fanged)
+    for (defanged, fanged) in REFANG_SCHEMES:
+        if value.lower().startswith(defanged):
+            value = fanged + value[len(defanged):]
+    return value
+
+
+def value_candidates(value):
+    """
+    Values as which the normalized value may be stored: as given, in lower and
+    in upper case (hashes and domains are imported in either case).
+    """
+    return set([value, value.lower(), value.upper()])
+
+
+def parse_queries(items, default_type=None):
+    """
+    Turn the items of a lookup request into triples ``(query, type name,
+    normalized value)``; an item is a value, a pair ``[type, value]`` or a
+    dictionary with the keys ``value`` and (optionally) ``type``. Empty
+    values are dropped.
+    """
+    queries = []
+    for item in items:
+        type_name = default_type
+        if isinstance(item, dict):
+            (value, type_name) = (item.get('value'), item.get('type') or default_type)
+        elif isinstance(item, (list, tuple)) and len(item) == 2:
+            (type_name, value) = item
+        else:
+            value = item
+        if value is None or isinstance(value, (dict, list, tuple)):
+            raise BulkLookupError("Cannot read value from %r" % (item,))
+        normalized = normalize_value(value)
+        if normalized:
+            queries.append((force_text(value), type_name or None, normalized))
+    return queries
+
+
+def lookup_chunk(queries, content_type):
+    """
+    Resolve a chunk of queries; yields one record per pair of query and
+    matching observable and one record with ``found`` set to False for
+    each query without match.
+    """
+    candidates_by_type = {}
+    for (query, type_name, normalized) in queries:
+        candidates_by_type.setdefault(type_name, set()).update(value_candidates(normalized))
+
+    condition = Q()
+    for (type_name, candidates) in candidates_by_type.items():
+        if type_name:
+            condition |= Q(type__name=type_name, value__in=candidates)
+        else:
+            condition |= Q(value__in=candidates)
+
+    observables = {}
+    for row in SingletonObservable.objects.filter(condition)\
+                                          .values_list('pk', 'type__name', 'subtype__name', 'value',
+                                                       'actionable_tags_cache'):
+        observables.setdefault(row[3].lower(), []).append(row)
+
+    pks = [row[0] for rows in observables.values() for row in rows]
+    stati = {}
+    source_counts = {}
+    if pks:
+        for row in Status2X.objects.filter(content_type=content_type, object_id__in=pks, active=True)\
+                                   .values_list('object_id',
+                                                'status__active',
+                                                'status__false_positive',
+                                                'status__priority',
+                                                'status__max_confidence',
+                                                'status__best_processing',
+                                                'status__most_permissive_tlp',
+                                                'status__most_restrictive_tlp',
+                                                'status__active_from',
+                                                'status__active_to'):
+            stati[row[0]] = row[1:]
+        source_counts = dict(Source.objects.filter(content_type=content_type, object_id__in=pks)\
+                                           .values_list('object_id')\
+                                           .annotate(Count('pk'))\
+                                           .order_by())
+
+    for (query, type_name, normalized) in queries:
+        matches = [row for row in observables.get(normalized.lower(), [])
+                   if not type_name or row[1] == type_name]
+        if not matches:
+            yield {'query': query, 'found': False}
+            continue
+        for (pk, match_type, match_subtype, value, tags) in matches:
+            record = {'query': query,
+                      'found': True,
+                      'id': pk,
+                      'type': match_type,
+                      'subtype': match_subtype,
+                      'value': value,
+                      'tags': [tag for tag in tags.split(',') if tag],
+                      'sources': source_counts.get(pk, 0)}
+            status = stati.get(pk)
+            if status:
+                (active, false_positive, priority, confidence, processing,
+                 most_permissive_tlp, most_restrictive_tlp, active_from, active_to) = status
+                record.update({'active': active and not false_positive,
+                               'false_positive': bool(false_positive),
+                               'priority': PRIORITY_MAP.get(priority),
+                               'confidence': Status.CONFIDENCE_MAP.get(confidence),
+                               'processing': Status.PROCESSING_MAP.get(processing),
+                               'most_permissive_tlp': Status.TLP_MAP.get(most_permissive_tlp),
+                               'most_restrictive_tlp': Status.TLP_MAP.get(most_restrictive_tlp),
+                               'active_from': active_from.isoformat(),
+                               'active_to': active_to.isoformat()})
+            yield record
+
+
+def bulk_lookup(queries, found_only=False, chunk_size=None):
+    """
+    Look up the given queries (as returned by ``parse_queries``); yields the
+    records in the order of the queries.
+    """
+    content_type = ContentType.objects.get_for_model(SingletonObservable)
+    for chunk in chunks(queries, chunk_size or MANTIS_ACTIONABLES_BULK_LOOKUP_CHUNK_SIZE):
+        for record in lookup_chunk(chunk, content_type):
+            if record['found'] or not found_only:
+                yield record
+
+
+def json_stream(records):
+    """
+    Write the records as JSON list, one record per line.
+    """
+    separator = '[\n'
+    for record in records:
+        yield separator + json.dumps(record)
+        separator = ',\n'
+    yield ']\n' if separator != '[\n' else '[]\n'
+
+
+class _Echo(object):
+    def write(self, value):
+        return value
+
+
+def csv_stream(records):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(RECORD_FIELDS)
+    for record in records:
+        if isinstance(record.get('tags'), list):
+            record['tags'] = ','.join(record['tags'])
+        yield writer.writerow([force_text(record[field]).encode('utf-8') if record.get(field) is not None else ''
+                               for field in RECORD_FIELDS])
@@ -0,0 +1,266 @@
+# Copyright (c) Siemens AG, 2015
+#
+# This file is part of MANTIS.  MANTIS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either version 2
+# of the License, or(at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+"""
+Helpers for ``datatable_query``: counting with a limit or by estimate,
+keyset (seek) pagination, and the cache that carries counts and page
+boundaries from one draw of a table to the next.
+"""
+
+import re
+import hashlib
+import logging
+
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Q, Max
+
+from mantis_actionables import MANTIS_ACTIONABLES_DATATABLE_COUNT_LIMIT, MANTIS_ACTIONABLES_DATATABLE_CACHE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'mantis_actionables:dt'
+
+# Number of page boundaries remembered per query
+
+MAX_BOUNDARIES = 1000
+
+
+def query_key(q):
+    """
+    Key identifying a query (with its filters and ordering) in the cache.
+    """
+    try:
+        sql, params = q.query.sql_with_params()
+    except Exception:
+        # e.g., EmptyResultSet
+        return None
+    return hashlib.sha1(("%s:%s" % (sql, params)).encode('utf-8')).hexdigest()
+
+
+def cached(kind, key, func):
+    if key is None or not MANTIS_ACTIONABLES_DATATABLE_CACHE_SECONDS:
+        return func()
+    cache_key = '%s:%s:%s' % (KEY_PREFIX, kind, key)
+    value = cache.get(cache_key)
+    if value is None:
+        value = func()
+        cache.set(cache_key, value, MANTIS_ACTIONABLES_DATATABLE_CACHE_SECONDS)
+    return value
+
+
+def capped_count(q, limit=None):
+    """
+    Count the rows of a query, but stop counting after ``limit`` (default:
+    ``MANTIS_ACTIONABLES_DATATABLE_COUNT_LIMIT``) rows; returns a pair of
+    the count and a flag indicating whether the limit has been exceeded.
+    """
+    limit = limit or MANTIS_ACTIONABLES_DATATABLE_COUNT_LIMIT
+    count = q.order_by()[:limit + 1].count()
+    if count > limit:
+        return limit, True
+    return count, False
+
+
+ESTIMATE_RE = re.compile(r'rows=(\d+)')
+
+
+def estimated_count(q):
+    """
+    Estimate the number of rows of a query from the plan of the query
+    planner (PostgreSQL only); returns None if no estimate is available.
+    """
+    connection = connections[q.db]
+    if connection.vendor != 'postgresql':
+        return None
+    try:
+        sql, params = q.order_by().query.sql_with_params()
+    except Exception:
+        return None
+    cursor = connection.cursor()
+    try:
+        cursor.execute('EXPLAIN ' + sql, params)
+        plan = cursor.fetchone()
+    finally:
+        cursor.close()
+    match = ESTIMATE_RE.search(plan[0]) if plan else None
+    if not match:
+        return None
+    return int(match.group(1))
+
+
+def count(q, mode):
+    """
+    Count the rows of a query according to ``mode``:
+
+    - ``True``: exact count;
+    - ``'estimate'``: estimate of the query planner (capped count where
+      no estimate is available);
+    - anything else: count capped at ``MANTIS_ACTIONABLES_DATATABLE_COUNT_LIMIT``.
+
+    Returns a pair of the count and None (exact count), ``'capped'`` (the count
+    limit has been exceeded) or ``'estimated'``. Counts are cached.
+    """
+    key = query_key(q)
+    if mode is True:
+        return cached('count', key, lambda: q.count()), None
+    if mode == 'estimate':
+        estimate = cached('estimate', key, lambda: estimated_count(q))
+        if estimate is not None:
+            return estimate, 'estimated'
+    (capped, exceeded) = cached('capped', key, lambda: capped_count(q))
+    return capped, 'capped' if exceeded else None
+
+
+# Filter operators: a search term of the form ``<operator>:<argument>`` in a
+# column for which the table spec allows the operator (key ``operators``,
+# mapping column lookups to lists of operator names) is turned into a Q object
+# by the function registered for the operator; it is called with the column
+# lookup and the argument and returns None if it cannot handle the argument.
+
+FILTER_OPERATORS = {}
+
+
+def register_filter_operator(name, func):
+    FILTER_OPERATORS[name] = func
+
+
+def operator_q(lookup, term, allowed):
+    """
+    Return the Q object for a search term that uses one of the ``allowed``
+    filter operators, or None if the term does not use an operator.
+    """
+    if not allowed or not ':' in term:
+        return None
+    name, argument = term.split(':', 1)
+    name = name.strip().lower()
+    if not name in allowed or not name in FILTER_OPERATORS:
+        return None
+    return FILTER_OPERATORS[name](lookup, argument.strip())
+
+
+def nulls_sort_high(using):
+    """
+    Do NULLs sort after all other values in ascending order on the given
+    database (as on PostgreSQL and Oracle) or before them (as on SQLite and MySQL)?
+    """
+    return connections[using].vendor in ('postgresql', 'oracle')
+
+
+def seek_q(order_cols, boundary, nulls_high=True):
+    """
+    Build a Q object that selects the rows following the row with the
+    values ``boundary`` in the ordering given by ``order_cols`` (a list
+    of pairs of lookup and a flag for descending order). Rows with NULL
+    in a column follow the other rows if NULLs sort after the other values
+    in the direction of the column (see ``nulls_sort_high``) and precede
+    them otherwise.
+    """
+    query = None
+    for i, (col, descending) in enumerate(order_cols):
+        nulls_follow = nulls_high != descending
+        if boundary[i] is None:
+            if nulls_follow:
+                # Nothing follows NULL in this column
+                continue
+            term = Q(**{'%s__isnull' % col: False})
+        else:
+            term = Q(**{'%s__%s' % (col, 'lt' if descending else 'gt'): boundary[i]})
+            if nulls_follow:
+                term |= Q(**{'%s__isnull' % col: True})
+        for (prev_col, prev_descending), prev_value in zip(order_cols[:i], boundary[:i]):
+            if prev_value is None:
+                term &= Q(**{'%s__isnull' % prev_col: True})
+            else:
+                term &= Q(**{prev_col: prev_value})
+        query = term if query is None else query | term
+    if query is None:
+        # The boundary is the last row there can be
+        return Q(pk__in=[])
+    return query
+
+
+def data_version(model):
+    """
+    Version of the rows of a model for keying page boundaries: the highest
+    primary key, which changes whenever rows are added.
+    """
+    return model.objects.aggregate(Max('pk'))['pk__max']
+
+
+class PageBoundaries(object):
+    """
+    The sort key values of the last row of each page served for a query,
+    kept in the cache, so that later pages can be fetched by seeking
+    behind the boundary rather than by skipping rows with OFFSET.
+
+    Boundaries are positions in the result, which move when rows are
+    added; they are therefore kept per ``version`` of the data (see
+    ``data_version``).
+    """
+
+    def __init__(self, key, version=None):
+        self.key = key
+        self.cache_key = '%s:boundaries:%s:%s' % (KEY_PREFIX, key, version) if key else None
+        self.boundaries = None
+
+    def _load(self):
+        if self.boundaries is None:
+            self.boundaries = {}
+            if self.cache_key and MANTIS_ACTIONABLES_DATATABLE_CACHE_SECONDS:
+                self.boundaries = cache.get(self.cache_key) or {}
+        return self.boundaries
+
+    def nearest(self, start):
+        """
+        Return the nearest known boundary at or before ``start`` as a pair
+        of the position and the sort key values (or ``(0, None)``).
+        """
+        boundaries = self._load()
+        positions = [x for x in boundaries.keys() if x <= start]
+        if not positions:
+            return 0, None
+        position = max(positions)
+        return position, boundaries[position]
+
+    def remember(self, position, values):
+        if not self.cache_key or not MANTIS_ACTIONABLES_DATATABLE_CACHE_SECONDS:
+            return
+        boundaries = self._load()
+        if len(boundaries) >= MAX_BOUNDARIES:
+            return
+        boundaries[position] = tuple(values)
+        cache.set(self.cache_key, boundaries, MANTIS_ACTIONABLES_DATATABLE_CACHE_SECONDS)
+
+    def walk(self, keys, position, boundary, start, step):
+        """
+        Walk the sort key values ``keys`` of the rows following the
+        boundary at ``position`` up to ``start``, remembering the
+        boundaries of the pages of ``step`` rows ending at ``start`` on
+        the way. Return the position and the values of the last row
+        walked.
+        """
+        boundaries = self._load()
+        for position, values in enumerate(keys, position + 1):
+            boundary = tuple(values)
+            # Keep room for the boundary at ``start``, which is the one
+            # needed right away.
+            if position == start or ((start - position) % step == 0 and len(boundaries) < MAX_BOUNDARIES - 1):
+                boundaries[position] = boundary
+        if self.cache_key and MANTIS_ACTIONABLES_DATATABLE_CACHE_SECONDS:
+            cache.set(self.cache_key, boundaries, MANTIS_ACTIONABLES_DATATABLE_CACHE_SECONDS)
+        return position, boundary
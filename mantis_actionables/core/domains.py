@@ -0,0 +1,165 @@
+# Copyright (c) Siemens AG, 2015
+#
+# This file is part of MANTIS.  MANTIS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either version 2
+# of the License, or(at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+"""
+Suffix index of the domains of FQDN, URL and email address observables.
+
+The domain of each observable of one of the types in
+``MANTIS_ACTIONABLES_DOMAIN_TYPES`` (the FQDN itself, the host of a URL,
+the domain of an email address) is written into ``DomainSuffix`` with
+reversed labels when the observable is created (and by the
+``rebuild_domain_index`` command). The observables under a domain then
+share a prefix of the reversed domain and are found with a prefix scan; the
+query is available as the datatable filter operator ``subdomain:<domain>``.
+"""
+
+import logging
+import urlparse
+
+import ipaddr
+
+from django.db.models import Q
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from mantis_actionables import MANTIS_ACTIONABLES_DOMAIN_TYPES
+from mantis_actionables.models import SingletonObservable, DomainSuffix
+
+from mantis_actionables.core.datatables import register_filter_operator
+from mantis_actionables.core.observables import add_index_entries
+
+logger = logging.getLogger(__name__)
+
+
+def fqdn_domain(value):
+    return value
+
+
+def url_domain(value):
+    if not '://' in value:
+        value = 'http://' + value
+    try:
+        return urlparse.urlsplit(value).hostname
+    except ValueError:
+        return None
+
+
+def email_domain(value):
+    if not '@' in value:
+        return None
+    return value.rsplit('@', 1)[1]
+
+
+# Functions that can be named in MANTIS_ACTIONABLES_DOMAIN_TYPES
+# to extract the domain from the value of an observable
+
+DOMAIN_FUNCTIONS = {
+    'fqdn': fqdn_domain,
+    'url': url_domain,
+    'email': email_domain,
+}
+
+
+def normalize_domain(domain):
+    """
+    Bring a domain into the form in which it is indexed (lower case, without
+    trailing dot); returns None for values that are not domain names.
+    """
+    if not domain:
+        return None
+    domain = domain.strip().rstrip('.').lower()
+    if not domain or len(domain) > 255:
+        return None
+    labels = domain.split('.')
+    if '' in labels or any(' ' in label for label in labels):
+        return None
+    try:
+        ipaddr.IPAddress(domain)
+        return None
+    except ValueError:
+        pass
+    return domain
+
+
+def reverse_domain(domain):
+    """
+    ``sub.evil.example`` -> ``example.evil.sub``
+    """
+    return '.'.join(reversed(domain.split('.')))
+
+
+def observable_domain(type_name, value):
+    function_name = MANTIS_ACTIONABLES_DOMAIN_TYPES.get(type_name)
+    if not function_name:
+        return None
+    return normalize_domain(DOMAIN_FUNCTIONS[function_name](value.strip()))
+
+
+def index_domains(observables):
+    """
+    Write the reversed domains of the given observables, a list of triples
+    ``(pk, type name, value)``, into the suffix index; observables of other
+    types, observables without domain and observables that are already in
+    the index are skipped.
+    """
+    domains = {}
+    for (pk, type_name, value) in observables:
+        domain = observable_domain(type_name, value)
+        if domain:
+            domains[pk] = {'reversed_domain': reverse_domain(domain)}
+    return add_index_entries(DomainSuffix, domains)
+
+
+@receiver(post_save, sender=SingletonObservable)
+def index_singleton_observable(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        index_domains([(instance.pk, instance.type.name, instance.value)])
+
+
+def subdomain_q(domain, include_self=True, prefix=''):
+    """
+    Q object selecting the observables (reached via ``prefix``) whose domain
+    lies under ``domain`` (or is ``domain`` itself, if ``include_self`` is set);
+    raises ValueError if ``domain`` is not a domain name.
+    """
+    normalized = normalize_domain(domain.lstrip('*').lstrip('.'))
+    if not normalized:
+        raise ValueError("%s is not a domain name" % domain)
+    reversed_domain = reverse_domain(normalized)
+    lookup = '%sdomain_suffix__reversed_domain' % prefix
+    # A prefix match (LIKE 'x.%') rather than a range: comparisons of '.'
+    # and '/' depend on the collation of the database, LIKE does not, and
+    # can use the pattern index that Django creates on PostgreSQL
+    query = Q(**{'%s__startswith' % lookup: reversed_domain + '.'})
+    if include_self:
+        query |= Q(**{lookup: reversed_domain})
+    return query
+
+
+def observables_under(domain, include_self=True):
+    return SingletonObservable.objects.filter(subdomain_q(domain, include_self=include_self))
+
+
+def subdomain_operator(lookup, argument):
+    prefix = lookup.rsplit('__', 1)[0] + '__' if '__' in lookup else ''
+    try:
+        return subdomain_q(argument, prefix=prefix)
+    except ValueError:
+        return None
+
+
+register_filter_operator('subdomain', subdomain_operator)
@@ -0,0 +1,205 @@
+# Copyright (c) Siemens AG, 2015
+#
+# This file is part of MANTIS.  MANTIS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either version 2
+# of the License, or(at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import logging
+
+from json import dumps
+
+from django.db import transaction, IntegrityError
+
+from mantis_actionables.models import STIX_Entity, EntityType
+
+from mantis_actionables.core.lru import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class STIXEntityResolver(object):
+    """
+    Resolve the relationship nodes found by the exporters (Indicators,
+    Campaigns, ThreatActors, ...) into STIX_Entity objects.
+
+    The essence of a node is cached per InfoObject (i.e., per revision of
+    the identifier) across the results of an import and across imports
+    carried out by the same process, so the graph traversal in
+    ``extract_essence`` is carried out only once per revision.
+
+    The entities themselves are always read from the database (with one
+    query per call), since other processes may have changed them; new
+    entities are created with a single ``bulk_create`` and only entities
+    whose essence differs are updated.
+    """
+
+    CACHE_SIZE = 50000
+
+    def __init__(self, cache_size=None):
+        cache_size = cache_size or STIXEntityResolver.CACHE_SIZE
+        # iobject pk -> essence (as JSON string, '' if the node has no essence)
+        self.essence_cache = LRUCache(max_size=cache_size)
+
+    def get_essence(self, node, graph):
+        # Imported here to avoid a circular import
+        from mantis_actionables.mantis_import import extract_essence
+
+        iobject_pk = node['iobject'].pk
+        essence = self.essence_cache.get(iobject_pk)
+        if essence is None:
+            essence = extract_essence(node, graph)
+            essence = dumps(essence) if essence else ''
+            self.essence_cache.set(iobject_pk, essence)
+        return essence
+
+    def resolve(self, nodes, graph):
+        """
+        Take an iterable of relationship nodes from ``graph`` and return a dictionary
+        mapping the identifier pk of each node with non-empty essence to its STIX_Entity.
+        """
+
+        wanted = {}
+        for node in nodes:
+            if node['identifier_pk'] in wanted:
+                continue
+            essence = self.get_essence(node, graph)
+            if not essence:
+                continue
+            entity_type = EntityType.cached_objects.get_or_create(name=node['iobject_type'])[0]
+            wanted[node['identifier_pk']] = (entity_type.pk, essence)
+
+        if not wanted:
+            return {}
+        return self._write_entities(wanted)
+
+    def _entity(self, identifier_pk, entity_pk, entity_type_pk, essence):
+        return STIX_Entity(pk=entity_pk,
+                           entity_type_id=entity_type_pk,
+                           iobject_identifier_id=identifier_pk,
+                           non_iobject_identifier='',
+                           essence=essence)
+
+    def _fetch_existing(self, identifier_pks):
+        return dict((x[0], x[1:]) for x in STIX_Entity.objects.filter(iobject_identifier_id__in=identifier_pks,
+                                                                      non_iobject_identifier='')\
+                                                              .values_list('iobject_identifier_id',
+                                                                           'pk',
+                                                                           'entity_type_id',
+                                                                           'essence'))
+
+    def _write_entities(self, missing):
+        existing = self._fetch_existing(missing.keys())
+
+        result = {}
+        to_create = []
+        for identifier_pk, (entity_type_pk, essence) in missing.items():
+            if identifier_pk not in existing:
+                to_create.append(identifier_pk)
+                continue
+            (entity_pk, old_entity_type_pk, old_essence) = existing[identifier_pk]
+            if (old_entity_type_pk, old_essence) != (entity_type_pk, essence):
+                if not STIX_Entity.objects.filter(pk=entity_pk).update(entity_type=entity_type_pk,
+                                                                       essence=essence):
+                    # Deleted in the meantime
+                    to_create.append(identifier_pk)
+                    continue
+            result[identifier_pk] = self._entity(identifier_pk, entity_pk, entity_type_pk, essence)
+
+        if to_create:
+            try:
+                with transaction.atomic():
+                    STIX_Entity.objects.bulk_create([STIX_Entity(iobject_identifier_id=identifier_pk,
+                                                                 non_iobject_identifier='',
+                                                                 entity_type_id=missing[identifier_pk][0],
+                                                                 essence=missing[identifier_pk][1])
+                                                     for identifier_pk in to_create])
+            except IntegrityError:
+                # Somebody else has created some of the entities in the meantime
+                logger.info("Concurrent creation of STIX entities detected, resolving one by one")
+                for identifier_pk in to_create:
+                    (entity_type_pk, essence) = missing[identifier_pk]
+                    entity, created = STIX_Entity.objects.get_or_create(iobject_identifier_id=identifier_pk,
+                                                                        non_iobject_identifier='',
+                                                                        defaults={'essence': essence,
+                                                                                  'entity_type_id': entity_type_pk})
+                    if not created:
+                        STIX_Entity.objects.filter(pk=entity.pk).update(entity_type=entity_type_pk,
+                                                                        essence=essence)
+                    result[identifier_pk] = self._entity(identifier_pk, entity.pk, entity_type_pk, essence)
+            else:
+                # bulk_create does not give us the primary keys, so we ask for them.
+                for identifier_pk, (entity_pk, entity_type_pk, essence) in self._fetch_existing(to_create).items():
+                    result[identifier_pk] = self._entity(identifier_pk, entity_pk, entity_type_pk, essence)
+
+        return result
+
+    def resolve_non_iobject_entities(self, specs):
+        """
+        Get or create STIX_Entity objects that do not correspond to an InfoObject
+        (e.g., threat actors named in a partner feed).
+
+        ``specs`` maps the ``non_iobject_identifier`` of each entity to a pair
+        ``(entity type pk, essence)`` used when the entity has to be created;
+        existing entities are not changed. Returns a dictionary mapping each
+        ``non_iobject_identifier`` to its STIX_Entity.
+        """
+        missing = list(specs.keys())
+        if not missing:
+            return {}
+
+        def fetch(identifiers):
+            return STIX_Entity.objects.filter(iobject_identifier__isnull=True,
+                                              non_iobject_identifier__in=identifiers)
+
+        existing = dict((x.non_iobject_identifier, x) for x in fetch(missing))
+        to_create = [x for x in missing if x not in existing]
+
+        if to_create:
+            try:
+                with transaction.atomic():
+                    STIX_Entity.objects.bulk_create([STIX_Entity(iobject_identifier_id=None,
+                                                                 non_iobject_identifier=identifier,
+                                                                 entity_type_id=specs[identifier][0],
+                                                                 essence=specs[identifier][1])
+                                                     for identifier in to_create])
+            except IntegrityError:
+                # Somebody else has created some of the entities in the meantime (the
+                # uniqueness of non-iobject identifiers is enforced by a partial index)
+                logger.info("Concurrent creation of STIX entities detected, resolving one by one")
+                for identifier in to_create:
+                    existing[identifier] = STIX_Entity.objects.get_or_create(iobject_identifier_id=None,
+                                                                             non_iobject_identifier=identifier,
+                                                                             defaults={'entity_type_id': specs[identifier][0],
+                                                                                       'essence': specs[identifier][1]})[0]
+            else:
+                existing.update((x.non_iobject_identifier, x) for x in fetch(to_create))
+
+        return existing
+
+    def clear(self):
+        self.essence_cache.clear()
+
+
+# Resolver shared by the importers; its essence cache carries hits across
+# reports in long-running workers.
+
+stix_entity_resolver = STIXEntityResolver()
+
+
+def resolve_stix_entities(nodes, graph):
+    """
+    Resolve relationship nodes into STIX_Entity objects using the shared
+    resolver; see ``STIXEntityResolver.resolve``.
+    """
+    return stix_entity_resolver.resolve(nodes, graph)
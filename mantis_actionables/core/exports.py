@@ -0,0 +1,224 @@
+# Copyright (c) Siemens AG, 2015
+#
+# This file is part of MANTIS.  MANTIS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either version 2
+# of the License, or(at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+"""
+Streaming exports of the active observables: blocklists per kind of
+indicator (one value per line or CSV) and bundles of the IDS signatures
+attached to active observables.
+
+An observable is exported if its active Status2X refers to a status that
+is active, not marked as false positive and active at the time of the
+export (see ``mantis_actionables.core.lookup_compiler.active_observables``).
+The rows are read with a server-side cursor (on PostgreSQL) in batches of
+``FETCH_SIZE``, so that the memory required does not grow with the size
+of the feed.
+"""
+
+import csv
+import uuid
+import hashlib
+import logging
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections, transaction, router
+from django.db.models import Max, Count
+from django.utils import timezone
+from django.utils.encoding import force_text
+
+from mantis_actionables import MANTIS_ACTIONABLES_EXPORT_KINDS
+from mantis_actionables.models import SingletonObservable, Status, Status2X, IDSSignatureRevision, \
+    TaggedActionableItem, ActionableTaggingHistory
+
+from mantis_actionables.core.lookup_compiler import active_observables
+
+logger = logging.getLogger(__name__)
+
+FETCH_SIZE = 2000
+
+FORMATS = ('txt', 'csv', 'rules')
+
+CSV_COLUMNS = ('value',
+               'type',
+               'subtype',
+               'tlp',
+               'confidence',
+               'priority',
+               'active_to',
+               'tags')
+
+PRIORITY_MAP = dict(Status.PRIORITY_KIND)
+
+
+class ExportError(ValueError):
+    pass
+
+
+def check_export(kind, output_format):
+    if output_format not in FORMATS:
+        raise ExportError("Unknown format %s" % output_format)
+    if kind == 'ids':
+        if output_format != 'rules':
+            raise ExportError("IDS signatures can only be exported as rules")
+    elif kind not in MANTIS_ACTIONABLES_EXPORT_KINDS:
+        raise ExportError("Unknown export %s" % kind)
+
+
+def export_queryset(kind, now, subtype=None):
+    queryset = active_observables(now)
+    if kind in MANTIS_ACTIONABLES_EXPORT_KINDS:
+        queryset = queryset.filter(type__name__in=MANTIS_ACTIONABLES_EXPORT_KINDS[kind])
+    if subtype:
+        queryset = queryset.filter(subtype__name=subtype)
+    return queryset.order_by('pk')
+
+
+def stream_rows(queryset, fetch_size=FETCH_SIZE):
+    """
+    Yield the rows of a ``values_list`` queryset, reading them with a
+    server-side cursor on PostgreSQL and with ``fetchmany`` elsewhere.
+    """
+    using = router.db_for_read(queryset.model)
+    connection = connections[using]
+    (sql, params) = queryset.query.sql_with_params()
+    with transaction.atomic(using=using):
+        if connection.vendor == 'postgresql':
+            connection.ensure_connection()
+            # Named cursors are kept on the server until the transaction ends
+            cursor = connection.connection.cursor(name='mantis_export_%s' % uuid.uuid4().hex)
+            cursor.itersize = fetch_size
+        else:
+            cursor = connection.cursor()
+        try:
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+        finally:
+            cursor.close()
+
+
+def distinct_pks(rows):
+    """
+    Drop the repetitions of rows ordered by pk (the first column), which
+    occur if an observable has several active stati.
+    """
+    last_pk = None
+    for row in rows:
+        if row[0] != last_pk:
+            last_pk = row[0]
+            yield row
+
+
+def export_lines(kind, output_format, subtype=None, now=None):
+    """
+    Generate the lines (byte strings) of the export ``kind`` in the given
+    format: ``txt`` (one value per line), ``csv`` or ``rules`` (the IDS
+    signatures of the observables, each signature once).
+    """
+    check_export(kind, output_format)
+    now = now or timezone.now()
+    queryset = export_queryset(kind, now, subtype=subtype)
+
+    if output_format == 'txt':
+        for (pk, value) in distinct_pks(stream_rows(queryset.values_list('pk', 'value'))):
+            yield value.encode('utf-8') + '\n'
+
+    elif output_format == 'csv':
+        buffer = LineBuffer()
+        writer = csv.writer(buffer)
+        writer.writerow(CSV_COLUMNS)
+        yield buffer.pop()
+        rows = queryset.values_list('pk',
+                                    'value',
+                                    'type__name',
+                                    'subtype__name',
+                                    'status_thru__status__most_restrictive_tlp',
+                                    'status_thru__status__max_confidence',
+                                    'status_thru__status__priority',
+                                    'status_thru__status__active_to',
+                                    'actionable_tags_cache')
+        for (pk, value, type_name, subtype_name, tlp, confidence, priority, active_to, tags) in \
+                distinct_pks(stream_rows(rows)):
+            writer.writerow([force_text(x).encode('utf-8') for x in (value,
+                                                                     type_name,
+                                                                     subtype_name,
+                                                                     Status.TLP_MAP.get(tlp),
+                                                                     Status.CONFIDENCE_MAP.get(confidence),
+                                                                     PRIORITY_MAP.get(priority),
+                                                                     active_to.isoformat(),
+                                                                     tags)])
+            yield buffer.pop()
+
+    else:
+        # Signatures are streamed ordered by observable; a signature shared by
+        # several observables is written once
+        seen = set()
+        rows = queryset.filter(ids_signature__isnull=False).values_list('pk', 'ids_signature_id',
+                                                                          'ids_signature__content')
+        for (pk, signature_pk, content) in distinct_pks(stream_rows(rows)):
+            if signature_pk in seen or not content.strip():
+                continue
+            seen.add(signature_pk)
+            yield content.strip().encode('utf-8') + '\n'
+
+
+class LineBuffer(object):
+    """
+    File-like object collecting the output of a csv writer.
+    """
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, value):
+        self.parts.append(value)
+
+    def pop(self):
+        value = ''.join(self.parts)
+        self.parts = []
+        return value
+
+
+def export_etag(kind, output_format, subtype=None, now=None):
+    """
+    ETag of an export: changes whenever a status is assigned to an
+    observable, an activity window opens or closes, an observable is
+    deleted, (for CSV exports) an observable is tagged or untagged or (for
+    IDS bundles) a signature is revised.
+    """
+    now = now or timezone.now()
+    content_type = ContentType.objects.get_for_model(SingletonObservable)
+    status2x = Status2X.objects.filter(content_type=content_type).aggregate(Max('pk'), Max('timestamp'))
+    window = (Status.objects.filter(active_from__lte=now).aggregate(Max('active_from'))['active_from__max'],
+              Status.objects.filter(active_to__lt=now).aggregate(Max('active_to'))['active_to__max'])
+    # Deletions leave no trace but in the number of observables
+    observables = SingletonObservable.objects.aggregate(Count('pk'), Max('pk'))
+    parts = [kind, output_format, subtype or '', status2x['pk__max'], status2x['timestamp__max']] + list(window) + \
+            [observables['pk__count'], observables['pk__max']]
+    if output_format == 'csv':
+        # The tags are written by ActionableTag.bulk_action (with history) and
+        # by the tag maintenance commands (which only change the tagged items)
+        tagged_items = TaggedActionableItem.objects.filter(content_type=content_type).aggregate(Count('pk'), Max('pk'))
+        parts.extend([ActionableTaggingHistory.objects.aggregate(Max('pk'))['pk__max'],
+                      tagged_items['pk__count'],
+                      tagged_items['pk__max']])
+    if output_format == 'rules':
+        parts.append(IDSSignatureRevision.objects.aggregate(Max('pk'))['pk__max'])
+    return hashlib.sha1(force_text(parts).encode('utf-8')).hexdigest()
@@ -0,0 +1,879 @@
+# Copyright (c) Siemens AG, 2015
+#
+# This file is part of MANTIS.  MANTIS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either version 2
+# of the License, or(at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+"""
+Import of indicator feeds (CSV or JSON-lines files) provided by partners.
+
+A feed is described declaratively in ``MANTIS_ACTIONABLES_FEEDS``: which
+columns carry the date, indicator, type, actors, reports and domain type
+of a row, how the feed's types map onto the types and subtypes of
+singleton observables, and with which namespace, TLP, origin and processing
+the imported indicators are recorded.
+
+All feeds share the same import path: the file is read as a stream,
+rows are grouped into chunks that are resolved with bulk queries and
+committed together with the byte offset reached, so that an interrupted
+import can be resumed. Each actor and each report of a day becomes an
+``ImportInfo`` of type ``TYPE_BULK_IMPORT``.
+"""
+
+import logging
+
+import os
+import csv
+import uuid
+import socket
+import datetime
+import multiprocessing
+import ipaddr
+import hashlib
+import json
+import pytz
+from django.db import transaction, connections
+from django.db.models import Q
+from django.contrib.contenttypes.models import ContentType
+from django.utils.dateparse import parse_datetime
+from django.utils.encoding import force_bytes, force_text
+
+from dingos.models import IdentifierNameSpace
+from mantis_actionables import MANTIS_ACTIONABLES_FEEDS, MANTIS_ACTIONABLES_BULK_IMPORT_CHUNK_SIZE, \
+    MANTIS_ACTIONABLES_IMPORT_LEASE_SECONDS
+from mantis_actionables.status_management import update_status_batch, status_pk_cache
+from mantis_actionables.core.observables import chunks, normalize_triple, resolve_singleton_observables,\
+    singleton_observable_resolver
+from mantis_actionables.core.entities import stix_entity_resolver
+from mantis_actionables.core.import_infos import ImportInfoResolver
+from mantis_actionables.models import Action, ImportInfo, SingletonObservable, Source, EntityType, ImportWatermark
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE_SINGLETON_OBSERVABLE = ContentType.objects.get_for_model(SingletonObservable)
+
+
+def ip_address_version(value):
+    try:
+        ip = ipaddr.IPAddress(value)
+        if ip.version == 4 or ip.version == 6:
+            return 'v%s' % ip.version
+    except:
+        pass
+    return None
+
+
+def ip_network_version(value):
+    try:
+        ip_block = ipaddr.IPNetwork(value)
+        if ip_block.version == 4 or ip_block.version == 6:
+            return 'v%s' % ip_block.version
+    except:
+        pass
+    return None
+
+
+# Functions that can be named in the type mapping of a feed to derive
+# the subtype of an observable from its value
+
+SUBTYPE_FUNCTIONS = {
+    'ip_address_version': ip_address_version,
+    'ip_network_version': ip_network_version,
+}
+
+
+class Feed(object):
+    """
+    A feed as described by an entry of ``MANTIS_ACTIONABLES_FEEDS``:
+
+    - ``format``: ``csv`` (with a header line) or ``jsonl`` (one JSON object per line);
+    - ``columns``: the columns (or keys) of the fields ``date``, ``indicator``,
+      ``type``, ``actor``, ``report`` and (optionally) ``domaintype``;
+    - ``date_format``: format of the date column (ISO 8601 if not given);
+    - ``list_separator`` and ``empty_values``: how the actor and report columns
+      are split and which values are ignored;
+    - ``types``: maps the types of the feed to pairs ``(type, subtype)`` or triples
+      ``(type, subtype, function)``, where ``function`` names an entry of
+      ``SUBTYPE_FUNCTIONS`` that derives the subtype from the indicator; rows
+      of other types are invalid;
+    - ``namespace``: ``uri`` and ``name`` of the namespace of the import infos;
+    - ``tlp``, ``origin`` and ``processing``: recorded for the sources, given by
+      name (e.g., ``amber``, ``partner``, ``manually``);
+    - ``import_info_names``: name templates for the import infos of actors and
+      reports (with the placeholders ``date`` and ``name``);
+    - ``import_info_description``: description of the import infos;
+    - ``default_report``: report to which rows without actor and report are
+      attributed; if not given, such rows are skipped.
+    """
+
+    DEFAULTS = {
+        'format': 'csv',
+        'columns': {'date': 'date',
+                    'indicator': 'indicator',
+                    'type': 'type',
+                    'actor': 'actor',
+                    'report': 'report'},
+        'date_format': None,
+        'list_separator': '|',
+        'empty_values': ['unknown', 'none'],
+        'empty_domaintypes': ['None', 'Unknown'],
+        'tlp': 'amber',
+        'origin': 'partner',
+        'processing': 'manually',
+        'import_info_names': {'actor': 'Indicators of %(date)s associated with Threat Actor "%(name)s"',
+                              'report': 'Indicators of %(date)s referencing report "%(name)s"'},
+        'default_report': None,
+    }
+
+    def __init__(self, name, definition):
+        self.name = name
+        config = dict(Feed.DEFAULTS)
+        config.update(definition)
+
+        self.format = config['format']
+        if self.format not in ('csv', 'jsonl'):
+            raise ValueError("Feed %s: unknown format %s" % (name, self.format))
+        self.columns = config['columns']
+        self.date_format = config['date_format']
+        self.list_separator = config['list_separator']
+        self.empty_values = [x.lower() for x in config['empty_values']]
+        self.empty_domaintypes = config['empty_domaintypes']
+        self.namespace_uri = config['namespace']['uri']
+        self.namespace_name = config['namespace'].get('name', self.namespace_uri)
+        self.tlp = Source.TLP_RMAP[config['tlp'].lower()]
+        self.origin = getattr(Source, 'ORIGIN_%s' % config['origin'].upper())
+        self.processing = getattr(Source, 'PROCESSED_%s' % config['processing'].upper())
+        self.import_info_names = config['import_info_names']
+        self.import_info_description = config.get('import_info_description',
+                                                  'Autogenerated via %s feed import' % name)
+        self.default_report = config['default_report']
+
+        self.types = {}
+        for feed_type, mapping in config['types'].items():
+            subtype_function = SUBTYPE_FUNCTIONS[mapping[2]] if len(mapping) > 2 else None
+            self.types[feed_type] = (mapping[0], mapping[1], subtype_function)
+
+    def get_namespace(self):
+        namespace, _ = IdentifierNameSpace.objects.get_or_create(
+            uri=self.namespace_uri,
+            defaults={
+                'name': self.namespace_name
+            }
+        )
+        return namespace
+
+    def create_action(self):
+        action, _ = Action.objects.get_or_create(comment='%s on %s' % (self.import_info_description,
+                                                                        datetime.datetime.now().strftime('%c')))
+        return action
+
+    def watermark_name(self, path, partition=None, partitions=None):
+        """
+        Name of the ImportWatermark that records the progress of importing the
+        given file (or one of its partitions); it changes if the file is modified.
+        """
+        stat = os.stat(path)
+        digest = hashlib.sha1('%s:%s:%s:%s' % (self.name,
+                                               os.path.abspath(path),
+                                               stat.st_size,
+                                               stat.st_mtime)).hexdigest()
+        name = '%s-%s' % (self.name[:11], digest[:20])
+        if partitions:
+            name = '%s-%sof%s' % (name, partition, partitions)
+        return name
+
+    def shared_objects_watermark_name(self, path):
+        """
+        Name of the ImportWatermark that records that the objects shared by the
+        partitions of an import of the given file have been created (see
+        ``prepare_feed_partitions``). It is kept apart from the watermark of
+        the file, whose position is the offset up to which ``import_feed``
+        has imported the file.
+        """
+        return '%s-shared' % self.watermark_name(path)
+
+    def data_offset(self, path):
+        """
+        Byte offset of the first row of the file (following the header of CSV files).
+        """
+        if self.format != 'csv':
+            return 0
+        with open(path, 'rb') as handle:
+            handle.readline()
+            return handle.tell()
+
+    def entity_identifier(self, kind, value):
+        return '{%s}%s-%s' % (self.namespace_uri, kind, value)
+
+    def import_info_name(self, kind, name, date):
+        return self.import_info_names[kind] % {'date': date, 'name': name}
+
+    def _split(self, value):
+        if not value:
+            return []
+        if not isinstance(value, list):
+            value = value.split(self.list_separator)
+        return [x for x in value if x.strip() and x.lower() not in self.empty_values]
+
+    def _parse_date(self, value):
+        if self.date_format:
+            date = datetime.datetime.strptime(value, self.date_format)
+        else:
+            date = parse_datetime(value)
+            if date is None:
+                date = datetime.datetime.strptime(value, '%Y-%m-%d')
+        if date.tzinfo is None:
+            date = date.replace(tzinfo=pytz.timezone('Etc/GMT+0'))
+        return date
+
+    def parse(self, raw):
+        """
+        Turn a raw row of the feed into a row with the keys ``date``, ``indicator``,
+        ``type``, ``subtype``, ``actor``, ``report`` and ``domaintype``.
+
+        Returns a pair ``(row, valid_row)``, where rows of unknown types are
+        invalid, or None if the row is to be skipped.
+        """
+        columns = self.columns
+        row = {'indicator': raw.get(columns['indicator']),
+               'type': raw.get(columns['type']),
+               'subtype': '',
+               'actor': self._split(raw.get(columns['actor'])),
+               'report': self._split(raw.get(columns['report'])),
+               'domaintype': raw.get(columns['domaintype']) if 'domaintype' in columns else None}
+
+        if row['domaintype'] in self.empty_domaintypes:
+            row['domaintype'] = None
+
+        # skip entry if there is no actor and no report
+        if not row['actor'] and not row['report']:
+            if not self.default_report:
+                return None
+            row['report'] = [self.default_report]
+
+        row['date'] = self._parse_date(raw.get(columns['date']))
+
+        # row is invalid because type is unkown
+        if not row['type'] in self.types:
+            return row, False
+
+        (type_name, subtype_name, subtype_function) = self.types[row['type']]
+        if subtype_function:
+            subtype_name = subtype_function(row['indicator']) or subtype_name
+        row['type'] = type_name
+        row['subtype'] = subtype_name
+
+        return row, True
+
+    def read(self, path, printing=False, start_offset=0):
+        """
+        Read the file in a single pass, starting at the byte offset ``start_offset``
+        (which must be the start of a row, as returned by an earlier run),
+        and yield triples ``(row, valid_row, offset)``, where ``offset`` is the
+        byte offset of the end of the row.
+        """
+        bytes_total = os.path.getsize(path) or 1
+
+        with open(path, 'rb') as handle:
+            # The lines are read with readline (rather than by iterating over
+            # the file), so that tell() yields the offset up to which the
+            # file has been consumed.
+            lines = iter(handle.readline, '')
+            if self.format == 'csv':
+                raw_rows = csv.DictReader(lines)
+                # read the header
+                raw_rows.fieldnames
+            else:
+                raw_rows = (json.loads(line) for line in lines if line.strip())
+            if start_offset > handle.tell():
+                handle.seek(start_offset)
+
+            procent = -1
+            for raw in raw_rows:
+                offset = handle.tell()
+
+                # print progress in procent
+                current_procent = int(round(float(offset) / bytes_total * 100))
+                if procent != current_procent:
+                    procent = current_procent
+                    if printing:
+                        print '%s%% processed (%i bytes)' % (procent, offset)
+
+                parsed = self.parse(raw)
+                if parsed is None:
+                    continue
+                row, valid_row = parsed
+                yield row, valid_row, offset
+
+    def partition(self, row, partitions):
+        """
+        Determine the partition of a row from its type and indicator, so that
+        all rows for the same observable end up in the same partition.
+        """
+        digest = hashlib.md5(force_bytes(u'%s|%s' % (force_text(row['type']), force_text(row['indicator'])))).hexdigest()
+        return int(digest[:8], 16) % partitions
+
+
+def get_feed(name):
+    if name not in MANTIS_ACTIONABLES_FEEDS:
+        raise ValueError("Unknown feed %s; known feeds are %s" % (name, ", ".join(sorted(MANTIS_ACTIONABLES_FEEDS.keys()))))
+    return Feed(name, MANTIS_ACTIONABLES_FEEDS[name])
+
+
+def acquire_watermark(name):
+    """
+    Acquire the lease on the watermark ``name``; returns the watermark (None
+    if the lease is held by somebody else) and the duration of the lease.
+    """
+    lease_duration = datetime.timedelta(seconds=MANTIS_ACTIONABLES_IMPORT_LEASE_SECONDS)
+    lease_holder = "%s:%s:%s" % (socket.gethostname(), os.getpid(), uuid.uuid4().hex)
+    return ImportWatermark.acquire_lease(name, lease_holder, lease_duration), lease_duration
+
+
+def get_latest_import_date(namespace):
+    # get timestamp of last import (latest ImportInfo obj)
+    latest_import_info = ImportInfo.objects\
+        .filter(namespace=namespace)\
+        .filter(Q(type=ImportInfo.TYPE_BULK_IMPORT))\
+        .order_by('-create_timestamp')[0:1]
+    if latest_import_info:
+        return latest_import_info[0].create_timestamp#.date()
+    return None
+
+
+def import_feed(feed, path, printing=False, chunk_size=None, resume=True, workers=None):
+    """
+    Import a file of the given feed (a ``Feed`` or the name of one).
+
+    The file is read once as a stream; rows are grouped into chunks of
+    ``chunk_size`` rows (default: ``MANTIS_ACTIONABLES_BULK_IMPORT_CHUNK_SIZE``)
+    and all objects required by a chunk (observables, STIX entities, import
+    infos, sources and stati) are resolved with bulk queries. Before, all
+    import infos and entities of the file are created in one bulk pass.
+
+    Each chunk is committed in its own transaction together with the byte offset
+    up to which the file has been imported. If ``resume`` is set, an import
+    of the same file that was interrupted continues after the last committed chunk.
+    A lease prevents two runs from importing the same file at the same time.
+
+    If ``workers`` is greater than one, the import is carried out by that
+    many processes; see ``import_feed_in_parallel``.
+
+    Returns the invalid rows (at most ``FeedImporter.INVALID_ROWS_LIMIT``).
+    """
+    if not isinstance(feed, Feed):
+        feed = get_feed(feed)
+
+    if workers and workers > 1:
+        return import_feed_in_parallel(feed,
+                                       path,
+                                       workers,
+                                       printing=printing,
+                                       chunk_size=chunk_size,
+                                       resume=resume)
+
+    namespace = feed.get_namespace()
+
+    # create a new action for this import
+    action = feed.create_action()
+
+    watermark, lease_duration = acquire_watermark(feed.watermark_name(path))
+    if not watermark:
+        logger.error("File %s is being imported by another process" % path)
+        return []
+
+    try:
+        if resume and watermark.position:
+            # The import infos created by the interrupted run must not
+            # be taken as marking the latest import: we use the date
+            # determined when the import was started.
+            logger.info("Resuming import of %s at byte offset %s" % (path, watermark.position))
+            latest_import_date = watermark.high_water_mark
+        else:
+            watermark.position = 0
+            latest_import_date = get_latest_import_date(namespace)
+            ImportWatermark.objects.filter(pk=watermark.pk).update(position=0,
+                                                                   high_water_mark=latest_import_date)
+
+        importer = FeedImporter(feed, namespace, action, latest_import_date)
+
+        if not watermark.position:
+            # all import infos (and entities) of the file are created in one bulk
+            # pass, so that the chunks find them in memory; once they are committed,
+            # the import counts as started.
+            with transaction.atomic():
+                importer.create_shared_objects(path)
+                if not watermark.checkpoint(feed.data_offset(path), lease_duration):
+                    raise RuntimeError("Lost lease for the import of %s" % path)
+
+        importer.import_file(path, watermark, lease_duration, chunk_size=chunk_size, printing=printing)
+    finally:
+        watermark.release_lease()
+
+    logger.info("Imported %s: %s singleton observables added, %s lines skipped, %s invalid lines" % (path,
+                                                                                                     importer.lines_added,
+                                                                                                     importer.lines_skipped,
+                                                                                                     importer.invalid_line_count))
+
+    return importer.invalid_lines
+
+
+def prepare_feed_partitions(feed, path, partitions, resume=True, printing=False):
+    """
+    Prepare the import of a file in ``partitions`` partitions:
+    the objects shared between partitions (the STIX entities for actors and domain
+    types and the import infos for actors and reports) are created up front, so
+    that the partitions never compete for creating them.
+
+    The date of the latest earlier import (rows up to this date are skipped)
+    is stored with the watermark of the shared objects (see
+    ``Feed.shared_objects_watermark_name``), so that resumed partitions use
+    the same date.
+
+    Returns a dictionary with the arguments shared by all partitions
+    (``latest_import_date`` and ``action_pk``) or None if the file is
+    being imported by somebody else.
+    """
+    if not isinstance(feed, Feed):
+        feed = get_feed(feed)
+
+    namespace = feed.get_namespace()
+
+    action = feed.create_action()
+
+    watermark, lease_duration = acquire_watermark(feed.shared_objects_watermark_name(path))
+    if not watermark:
+        logger.error("File %s is being imported by another process" % path)
+        return None
+
+    try:
+        if resume and watermark.position:
+            logger.info("Shared objects for %s have already been created" % path)
+            latest_import_date = watermark.high_water_mark
+        else:
+            latest_import_date = get_latest_import_date(namespace)
+            ImportWatermark.objects.filter(pk=watermark.pk).update(position=0,
+                                                                   high_water_mark=latest_import_date)
+
+            importer = FeedImporter(feed, namespace, action, latest_import_date)
+
+            with transaction.atomic():
+                importer.create_shared_objects(path, printing=printing)
+                # a position marks that the shared objects have been created
+                if not watermark.checkpoint(os.path.getsize(path), lease_duration):
+                    raise RuntimeError("Lost lease for the import of %s" % path)
+    finally:
+        watermark.release_lease()
+
+    return {'latest_import_date': latest_import_date,
+            'action_pk': action.pk}
+
+
+def import_feed_partition(feed_name, path, partition, partitions, latest_import_date, action_pk,
+                          chunk_size=None, resume=True):
+    """
+    Import the rows of the file that belong to the given partition
+    (see ``Feed.partition``); each partition keeps track of its progress
+    with a watermark of its own.
+
+    Errors are not raised but reported in the result, a dictionary with
+    the keys ``partition``, ``lines_added``, ``lines_skipped``,
+    ``invalid_lines``, ``invalid_line_count`` and ``error``.
+    """
+    result = {'partition': partition,
+              'lines_added': 0,
+              'lines_skipped': 0,
+              'invalid_lines': [],
+              'invalid_line_count': 0,
+              'error': None}
+
+    try:
+        feed = get_feed(feed_name)
+        watermark, lease_duration = acquire_watermark(feed.watermark_name(path, partition, partitions))
+        if not watermark:
+            raise RuntimeError("Partition %s of %s is being imported by another process" % (partition, path))
+
+        try:
+            if not resume:
+                watermark.position = 0
+            importer = FeedImporter(feed,
+                                    feed.get_namespace(),
+                                    Action.objects.get(pk=action_pk),
+                                    latest_import_date)
+            importer.import_file(path, watermark, lease_duration,
+                                 chunk_size=chunk_size,
+                                 partition=partition,
+                                 partitions=partitions)
+        finally:
+            watermark.release_lease()
+
+        result['lines_added'] = importer.lines_added
+        result['lines_skipped'] = importer.lines_skipped
+        result['invalid_lines'] = importer.invalid_lines
+        result['invalid_line_count'] = importer.invalid_line_count
+    except Exception as e:
+        logger.exception("Import of partition %s of %s failed" % (partition, path))
+        result['error'] = "%s: %s" % (e.__class__.__name__, e)
+
+    return result
+
+
+def _import_feed_partition_star(args):
+    return import_feed_partition(*args)
+
+
+def merge_feed_results(path, results):
+    """
+    Merge the results of the partitions of an import (see ``import_feed_partition``).
+    """
+    merged = {'lines_added': 0,
+              'lines_skipped': 0,
+              'invalid_lines': [],
+              'invalid_line_count': 0,
+              'errors': {}}
+    for result in results:
+        merged['lines_added'] += result['lines_added']
+        merged['lines_skipped'] += result['lines_skipped']
+        merged['invalid_lines'].extend(result['invalid_lines'])
+        merged['invalid_line_count'] += result['invalid_line_count']
+        if result['error']:
+            merged['errors'][result['partition']] = result['error']
+    del merged['invalid_lines'][FeedImporter.INVALID_ROWS_LIMIT:]
+
+    logger.info("Imported %s: %s singleton observables added, %s lines skipped, %s invalid lines" % (path,
+                                                                                                     merged['lines_added'],
+                                                                                                     merged['lines_skipped'],
+                                                                                                     merged['invalid_line_count']))
+    if merged['errors']:
+        logger.error("Import of %s of %s partitions of %s failed: %s" % (len(merged['errors']),
+                                                                         len(results),
+                                                                         path,
+                                                                         merged['errors']))
+    return merged
+
+
+def import_feed_in_parallel(feed, path, workers, printing=False, chunk_size=None, resume=True):
+    """
+    Import a file with a local pool of ``workers`` processes:
+
+    - the shared objects are created in a pre-pass (see ``prepare_feed_partitions``);
+    - the rows are partitioned by a hash of type and indicator, so that each
+      singleton observable (and its sources and stati) is owned by exactly one worker;
+    - the statistics and invalid lines of the workers are merged at the end.
+
+    An interrupted import can be resumed with the same number of workers.
+
+    Returns the invalid rows; raises a RuntimeError if a partition failed.
+    """
+    if not isinstance(feed, Feed):
+        feed = get_feed(feed)
+
+    job = prepare_feed_partitions(feed, path, workers, resume=resume, printing=printing)
+    if job is None:
+        return []
+
+    # The forked processes must not share the database connection of
+    # this process; each of them opens a connection of its own.
+    for connection in connections.all():
+        connection.close()
+    pool = multiprocessing.Pool(processes=workers)
+    try:
+        results = pool.map(_import_feed_partition_star,
+                           [(feed.name, path, partition, workers, job['latest_import_date'], job['action_pk'], chunk_size, resume)
+                            for partition in range(workers)])
+    finally:
+        pool.close()
+        pool.join()
+
+    merged = merge_feed_results(path, results)
+    if merged['errors']:
+        raise RuntimeError("Import of %s failed for partitions %s" % (path, sorted(merged['errors'].keys())))
+
+    return merged['invalid_lines']
+
+
+class FeedImporter(object):
+    """
+    Import chunks of parsed rows (as produced by ``Feed.read``),
+    resolving all objects required by a chunk with bulk queries.
+
+    Maps from actors, domain types and import infos to the database objects
+    are kept for the whole import, so that each of these objects is looked up and
+    linked only once.
+    """
+
+    # Invalid rows are counted, but only the first ones are kept
+    INVALID_ROWS_LIMIT = 10000
+
+    def __init__(self, feed, namespace, action, latest_import_date=None):
+        self.feed = feed
+        self.namespace = namespace
+        self.action = action
+        self.latest_import_date = latest_import_date
+
+        self.ta_entity_type = EntityType.cached_objects.get_or_create(name="ThreatActor")[0]
+        self.generic_entity_type = EntityType.cached_objects.get_or_create(name="Generic")[0]
+
+        self.import_infos = ImportInfoResolver(namespace, action, feed.import_info_description)
+
+        self.lines_added = 0
+        self.lines_skipped = 0
+        self.invalid_lines = []
+        self.invalid_line_count = 0
+
+    def clear_caches(self):
+        self.import_infos.clear()
+        singleton_observable_resolver.clear()
+        stix_entity_resolver.clear()
+        status_pk_cache.clear()
+
+    def import_file(self, path, watermark, lease_duration, chunk_size=None, printing=False,
+                    partition=None, partitions=None):
+        """
+        Import the file chunk by chunk, starting at the position of the (leased)
+        watermark; each chunk is committed together with the new position.
+        If ``partitions`` is given, only the rows of the given partition are imported.
+        """
+        if not chunk_size:
+            chunk_size = MANTIS_ACTIONABLES_BULK_IMPORT_CHUNK_SIZE
+
+        row_triples = self.feed.read(path, printing, start_offset=watermark.position)
+        if partitions:
+            row_triples = (x for x in row_triples if self.feed.partition(x[0], partitions) == partition)
+
+        try:
+            for row_chunk in chunks(row_triples, chunk_size):
+                with transaction.atomic():
+                    self.import_chunk([(row, valid_row) for (row, valid_row, offset) in row_chunk])
+                    if not watermark.checkpoint(row_chunk[-1][2], lease_duration):
+                        raise RuntimeError("Lost lease for the import of %s" % path)
+        except Exception:
+            # The objects created in the failed chunk have been rolled back:
+            # the caches must not hand them out anymore.
+            self.clear_caches()
+            raise
+
+    def is_outdated(self, row):
+        # rows older then latest_import are skipped
+        return self.latest_import_date and row['date'] <= self.latest_import_date
+
+    def select_rows(self, row_chunk):
+        """
+        Return the valid rows of the chunk that are newer than the latest import
+        and count the others.
+        """
+        rows = []
+        for row, valid_row in row_chunk:
+            # invalid lines will be returned at the end, a line is invalid if the type is not in the whitelist
+            if not valid_row:
+                self.invalid_line_count += 1
+                if len(self.invalid_lines) < FeedImporter.INVALID_ROWS_LIMIT:
+                    self.invalid_lines.append(row)
+                continue
+
+            if self.is_outdated(row):
+                self.lines_skipped += 1
+                continue
+
+            rows.append(row)
+        return rows
+
+    def create_shared_objects(self, path, start_offset=0, printing=False):
+        """
+        Read the file (from ``start_offset`` on) and create the STIX entities and
+        import infos required by its rows in one bulk pass.
+        """
+        entity_specs = {}
+        import_info_specs = {}
+        for row_chunk in chunks(self.feed.read(path, printing, start_offset=start_offset),
+                                MANTIS_ACTIONABLES_BULK_IMPORT_CHUNK_SIZE):
+            self.collect_specs([row for (row, valid_row, offset) in row_chunk if valid_row and not self.is_outdated(row)],
+                               entity_specs,
+                               import_info_specs)
+
+        self.resolve_shared_objects(entity_specs, import_info_specs)
+
+        logger.info("Resolved shared objects for %s: %s entities, %s import infos" % (path,
+                                                                                      len(entity_specs),
+                                                                                      len(import_info_specs)))
+
+    def collect_specs(self, rows, entity_specs, import_info_specs):
+        """
+        Collect the STIX entities (for actors and domain types) and import infos
+        (for actors and reports) required by the rows into ``entity_specs`` and
+        ``import_info_specs`` (see ``resolve_shared_objects``).
+
+        Returns for each row a pair of the uids of its import infos and the
+        identifiers of its related entities.
+        """
+        feed = self.feed
+        row_specs = []
+        for row in rows:
+            dt_identifier = None
+            entity_identifiers = []
+
+            domaintype = row.get('domaintype')
+            if domaintype:
+                dt_identifier = feed.entity_identifier('DomainType', domaintype)
+                entity_specs[dt_identifier] = (self.generic_entity_type.pk,
+                                               json.dumps({'domaintype':domaintype}))
+                entity_identifiers.append(dt_identifier)
+
+            # import infos for actors and reports, each with the entities to be linked to it
+            import_info_uids = []
+
+            for actor in row['actor']:
+                ta_identifier = feed.entity_identifier('ThreatActor', actor)
+                entity_specs[ta_identifier] = (self.ta_entity_type.pk,
+                                               json.dumps({'identities':actor}))
+                entity_identifiers.append(ta_identifier)
+
+                uid = self.import_infos.uid(actor, ImportInfo.TYPE_BULK_IMPORT, row['date'])
+                spec = import_info_specs.setdefault(uid, {'create_timestamp': row['date'],
+                                                          'type': ImportInfo.TYPE_BULK_IMPORT,
+                                                          'name': feed.import_info_name('actor', actor, row['date']),
+                                                          'entities': set()})
+                spec['entities'].add(ta_identifier)
+                if dt_identifier:
+                    spec['entities'].add(dt_identifier)
+                import_info_uids.append(uid)
+
+            for report in row['report']:
+                uid = self.import_infos.uid(report, ImportInfo.TYPE_BULK_IMPORT, row['date'])
+                spec = import_info_specs.setdefault(uid, {'create_timestamp': row['date'],
+                                                          'type': ImportInfo.TYPE_BULK_IMPORT,
+                                                          'name': feed.import_info_name('report', report, row['date']),
+                                                          'entities': set()})
+                if dt_identifier:
+                    spec['entities'].add(dt_identifier)
+                import_info_uids.append(uid)
+
+            row_specs.append((import_info_uids, entity_identifiers))
+
+        return row_specs
+
+    def resolve_shared_objects(self, entity_specs, import_info_specs):
+        """
+        Get or create the STIX entities and import infos collected by ``collect_specs``
+        and link the entities to the import infos; returns a dictionary mapping
+        the entity identifiers to the STIX_Entity objects and a dictionary mapping
+        the import info uids to the pks of the import infos.
+        """
+        entity_map = stix_entity_resolver.resolve_non_iobject_entities(entity_specs)
+
+        for spec in import_info_specs.values():
+            spec['entities'] = set(entity_map[identifier].pk for identifier in spec['entities'])
+
+        return entity_map, self.import_infos.resolve(import_info_specs)
+
+    def import_chunk(self, row_chunk):
+
+        rows = self.select_rows(row_chunk)
+
+        if not rows:
+            return
+
+        # resolve (or create) the singleton observables of all rows in the chunk at once
+        created_triples = set()
+        triple2observable_pk = resolve_singleton_observables([(row['type'],row['subtype'],row['indicator']) for row in rows],
+                                                             created_triples=created_triples)
+
+        # resolve (or create) the STIX entities for actors and domain types and the import infos
+
+        entity_specs = {}
+        import_info_specs = {}
+        row_specs = self.collect_specs(rows, entity_specs, import_info_specs)
+        entity_map, uid2import_info_pk = self.resolve_shared_objects(entity_specs, import_info_specs)
+
+        # create a generic Source relation between the SingletonObservable and each ImportInfo obj
+
+        source_specs = {}
+        for row, (import_info_uids, entity_identifiers) in zip(rows, row_specs):
+            observable_triple = normalize_triple((row['type'],row['subtype'],row['indicator']))
+
+            # an indicator may occur several times in a chunk: only the first occurrence
+            # counts as creation
+            if observable_triple in created_triples:
+                self.lines_added += 1
+                created_triples.discard(observable_triple)
+
+            observable_pk = triple2observable_pk[observable_triple]
+            for uid in import_info_uids:
+                entry = source_specs.setdefault((observable_pk, uid2import_info_pk[uid]), {})
+                for identifier in entity_identifiers:
+                    entity = entity_map[identifier]
+                    entry[entity.pk] = entity
+
+        sources = self.resolve_sources(source_specs.keys())
+
+        self.link_source_entities(dict((sources[key].pk, entities.keys()) for (key, entities) in source_specs.items()))
+
+        # status updates are carried out for the whole chunk at once
+        update_status_batch([(observable_pk, sources[(observable_pk, import_info_pk)], entities.values())
+                             for ((observable_pk, import_info_pk), entities) in source_specs.items()],
+                            action=self.action,
+                            user=None)
+
+    def resolve_sources(self, keys):
+        """
+        Get or create the sources for the given (observable pk, ImportInfo pk) pairs;
+        returns a dictionary mapping each pair to a Source object carrying the
+        information needed for status derivation.
+        """
+        keys = set(keys)
+
+        def fetch():
+            return dict(((x[1], x[2]), Source(pk=x[0],
+                                              content_type=CONTENT_TYPE_SINGLETON_OBSERVABLE,
+                                              object_id=x[1],
+                                              import_info_id=x[2],
+                                              tlp=x[3],
+                                              processing=x[4],
+                                              origin=x[5]))
+                        for x in Source.objects.filter(content_type=CONTENT_TYPE_SINGLETON_OBSERVABLE,
+                                                       object_id__in=set(x[0] for x in keys),
+                                                       import_info_id__in=set(x[1] for x in keys))\
+                                               .values_list('pk','object_id','import_info_id','tlp','processing','origin')
+                        if (x[1], x[2]) in keys)
+
+        sources = fetch()
+        to_create = keys.difference(sources.keys())
+
+        if to_create:
+            Source.objects.bulk_create([Source(object_id=observable_pk,
+                                               content_type=CONTENT_TYPE_SINGLETON_OBSERVABLE,
+                                               import_info_id=import_info_pk,
+                                               processing=self.feed.processing,
+                                               origin=self.feed.origin,
+                                               tlp=self.feed.tlp)
+                                        for (observable_pk, import_info_pk) in to_create])
+            sources = fetch()
+            logger.debug("Created %s source objects" % len(to_create))
+
+        return sources
+
+    def link_source_entities(self, source2entity_pks):
+        """
+        Link the sources (given as dictionary mapping source pks to entity pks)
+        with their related STIX entities, writing only missing links.
+        """
+        through = Source.related_stix_entities.through
+        wanted_links = set((source_pk, entity_pk) for (source_pk, entity_pks) in source2entity_pks.items()
+                           for entity_pk in entity_pks)
+        if not wanted_links:
+            return
+        existing_links = set(through.objects.filter(source_id__in=source2entity_pks.keys())\
+                                            .values_list('source_id','stix_entity_id'))
+        through.objects.bulk_create([through(source_id=source_pk, stix_entity_id=entity_pk)
+                                     for (source_pk, entity_pk) in wanted_links.difference(existing_links)])
@@ -0,0 +1,147 @@
+# Copyright (c) Siemens AG, 2015
+#
+# This file is part of MANTIS.  MANTIS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either version 2
+# of the License, or(at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import logging
+import hashlib
+
+from django.conf import settings
+from django.utils.encoding import force_bytes, force_text
+
+from mantis_actionables.models import ImportInfo
+from mantis_actionables.core.search import index_objects
+
+logger = logging.getLogger(__name__)
+
+
+def import_info_uid(referenced_name, import_info_type, create_date, namespace):
+    return hashlib.sha256(force_bytes(
+        u'%s_%s_%s_%s_%s' % (
+            import_info_type,
+            namespace.uri,
+            create_date.strftime('%x'),
+            force_text(referenced_name),
+            settings.SECRET_KEY,  # use as salt
+        )
+    )).hexdigest()
+
+
+class ImportInfoResolver(object):
+    """
+    Resolve the ImportInfo objects of a bulk import (e.g., one per actor and
+    day in a partner feed) into primary keys.
+
+    A resolver lives as long as one import; it keeps
+
+    - the uids calculated for (referenced name, type, day) triples, so that
+      the salted hash is calculated only once per import info;
+    - the primary keys of the import infos resolved so far;
+    - the links between import infos and STIX entities written so far.
+
+    Import infos that are not known yet are fetched with one query and the
+    missing ones are created with a single ``bulk_create``; links to STIX entities
+    are written once per import info and entity, no matter how many rows
+    refer to them.
+    """
+
+    def __init__(self, namespace, action, description):
+        self.namespace = namespace
+        self.action = action
+        self.description = description
+
+        # (referenced name, type, day) -> uid
+        self.uid_cache = {}
+        # uid -> ImportInfo pk
+        self.import_info_map = {}
+        # (ImportInfo pk, STIX_Entity pk) pairs known to be linked
+        self.entity_links = set()
+
+    def uid(self, referenced_name, import_info_type, create_date):
+        key = (referenced_name, import_info_type, create_date.strftime('%x'))
+        uid = self.uid_cache.get(key)
+        if uid is None:
+            uid = import_info_uid(referenced_name, import_info_type, create_date, self.namespace)
+            self.uid_cache[key] = uid
+        return uid
+
+    def _fetch_existing(self, uids):
+        return dict(ImportInfo.objects.filter(namespace=self.namespace,
+                                              uid__in=uids).values_list('uid','pk'))
+
+    def resolve(self, specs):
+        """
+        Get or create the import infos described by ``specs``, a dictionary mapping
+        uids to dictionaries with the keys ``create_timestamp``, ``type``, ``name``
+        (used for creation) and ``entities`` (the pks of the STIX entities to be
+        linked to the import info).
+
+        Returns a dictionary mapping the uids to the pks of the import infos.
+        """
+        missing = [uid for uid in specs.keys() if uid not in self.import_info_map]
+
+        if missing:
+            existing = self._fetch_existing(missing)
+            to_create = [uid for uid in missing if uid not in existing]
+
+            if to_create:
+                ImportInfo.objects.bulk_create([ImportInfo(uid=uid,
+                                                           namespace=self.namespace,
+                                                           creating_action=self.action,
+                                                           create_timestamp=specs[uid]['create_timestamp'],
+                                                           type=specs[uid]['type'],
+                                                           name=specs[uid]['name'],
+                                                           description=self.description)
+                                                for uid in to_create])
+                # bulk_create does not give us the primary keys, so we ask for them.
+                created = self._fetch_existing(to_create)
+                index_objects('import_info', created.values())
+                existing.update(created)
+                logger.debug("Created %s import infos" % len(to_create))
+
+            self.import_info_map.update(existing)
+
+        # link the entities: each link is written only once per import
+
+        wanted_links = set()
+        for uid, spec in specs.items():
+            for entity_pk in spec.get('entities', ()):
+                wanted_links.add((self.import_info_map[uid], entity_pk))
+        wanted_links.difference_update(self.entity_links)
+
+        if wanted_links:
+            through = ImportInfo.related_stix_entities.through
+            existing_links = set(through.objects.filter(importinfo_id__in=set(x[0] for x in wanted_links),
+                                                        stix_entity_id__in=set(x[1] for x in wanted_links))\
+                                                .values_list('importinfo_id','stix_entity_id'))
+            through.objects.bulk_create([through(importinfo_id=import_info_pk, stix_entity_id=entity_pk)
+                                         for (import_info_pk, entity_pk) in wanted_links.difference(existing_links)])
+            self.entity_links.update(wanted_links)
+
+        return dict((uid, self.import_info_map[uid]) for uid in specs.keys())
+
+    def get_or_create(self, referenced_name, import_info_type, create_date, name=None, entities=()):
+        """
+        Resolve a single import info; returns its pk.
+        """
+        uid = self.uid(referenced_name, import_info_type, create_date)
+        return self.resolve({uid: {'create_timestamp': create_date,
+                                   'type': import_info_type,
+                                   'name': name,
+                                   'entities': set(entity.pk for entity in entities)}})[uid]
+
+    def clear(self):
+        self.import_info_map.clear()
+        self.entity_links.clear()
@@ -0,0 +1,151 @@
+# Copyright (c) Siemens AG, 2015
+#
+# This file is part of MANTIS.  MANTIS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either version 2
+# of the License, or(at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+"""
+Range index of IP and IP block observables.
+
+The address range of each observable of one of the types in
+``MANTIS_ACTIONABLES_IP_RANGE_TYPES`` is written into ``IPRange`` when the
+observable is created (and by the ``rebuild_ip_range_index`` command), so
+that the observables within a network, the observables containing an address
+or network and the observables overlapping a network can be found with
+range scans. The queries are available as the datatable filter operators
+``in:<network>``, ``contains:<address or network>`` and ``overlaps:<network>``.
+"""
+
+import logging
+
+import ipaddr
+
+from django.db.models import Q
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from mantis_actionables import MANTIS_ACTIONABLES_IP_RANGE_TYPES
+from mantis_actionables.models import SingletonObservable, IPRange
+
+from mantis_actionables.core.datatables import register_filter_operator
+from mantis_actionables.core.observables import add_index_entries
+
+logger = logging.getLogger(__name__)
+
+
+def encode_address(number):
+    return '%032x' % number
+
+
+def parse_ip_range(value):
+    """
+    Parse an address (``10.1.2.3``), a network (``10.1.0.0/16``) or a
+    range (``10.1.0.0-10.1.0.255``) into a triple ``(version, start, end)``
+    with start and end address as integers; returns None if the value cannot
+    be parsed.
+    """
+    value = value.strip()
+    try:
+        if '-' in value and not '/' in value:
+            (start, end) = [ipaddr.IPAddress(x.strip()) for x in value.split('-', 1)]
+            if start.version != end.version or start > end:
+                return None
+            return (start.version, int(start), int(end))
+        network = ipaddr.IPNetwork(value)
+    except ValueError:
+        return None
+    return (network.version, int(network.network), int(network.broadcast))
+
+
+def index_ip_ranges(observables):
+    """
+    Write the address ranges of the given observables, a list of triples
+    ``(pk, type name, value)``, into the range index; observables of other
+    types, observables with unparsable values and observables that are
+    already in the index are skipped.
+    """
+    ranges = {}
+    for (pk, type_name, value) in observables:
+        if not type_name in MANTIS_ACTIONABLES_IP_RANGE_TYPES:
+            continue
+        parsed = parse_ip_range(value)
+        if parsed:
+            (version, start, end) = parsed
+            ranges[pk] = {'version': version,
+                          'start': encode_address(start),
+                          'end': encode_address(end)}
+        else:
+            logger.debug("Could not parse %s %s into an address range" % (type_name, value))
+    return add_index_entries(IPRange, ranges)
+
+
+@receiver(post_save, sender=SingletonObservable)
+def index_singleton_observable(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        index_ip_ranges([(instance.pk, instance.type.name, instance.value)])
+
+
+def ip_range_q(network, mode, prefix=''):
+    """
+    Q object selecting the observables (reached via ``prefix``, e.g. ``''`` for
+    a queryset of SingletonObservables) whose address range
+
+    - lies within ``network`` (mode ``within``),
+    - contains ``network`` (mode ``contains``) or
+    - overlaps ``network`` (mode ``overlaps``).
+
+    ``network`` is an address, network or range as understood by ``parse_ip_range``;
+    raises ValueError if it cannot be parsed.
+    """
+    parsed = parse_ip_range(network)
+    if not parsed:
+        raise ValueError("%s is not an IP address, network or range" % network)
+    (version, start, end) = (parsed[0], encode_address(parsed[1]), encode_address(parsed[2]))
+    if mode == 'within':
+        conditions = {'start__gte': start, 'end__lte': end}
+    elif mode == 'contains':
+        conditions = {'start__lte': start, 'end__gte': end}
+    elif mode == 'overlaps':
+        conditions = {'start__lte': end, 'end__gte': start}
+    else:
+        raise ValueError("Unknown mode %s" % mode)
+    conditions['version'] = version
+    return Q(**dict(('%sip_range__%s' % (prefix, key), value) for (key, value) in conditions.items()))
+
+
+def observables_within(network):
+    return SingletonObservable.objects.filter(ip_range_q(network, 'within'))
+
+
+def observables_containing(network):
+    return SingletonObservable.objects.filter(ip_range_q(network, 'contains'))
+
+
+def observables_overlapping(network):
+    return SingletonObservable.objects.filter(ip_range_q(network, 'overlaps'))
+
+
+def filter_operator(mode):
+    def operator(lookup, argument):
+        prefix = lookup.rsplit('__', 1)[0] + '__' if '__' in lookup else ''
+        try:
+            return ip_range_q(argument, mode, prefix=prefix)
+        except ValueError:
+            return None
+    return operator
+
+
+register_filter_operator('in', filter_operator('within'))
+register_filter_operator('contains', filter_operator('contains'))
+register_filter_operator('overlaps', filter_operator('overlaps'))
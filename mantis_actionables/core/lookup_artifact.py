@@ -0,0 +1,515 @@
+# Copyright (c) Siemens AG, 2015
+#
+# This file is part of MANTIS.  MANTIS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either version 2
+# of the License, or(at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+"""
+Format, writer and reader of the indicator lookup artifact: a binary file
+with the active singleton observables that sensors ``mmap`` to check values
+without asking MANTIS (see ``mantis_actionables.core.lookup_compiler`` for
+the job that builds it).
+
+This module does not depend on Django, so that it can be copied to the
+systems that read the artifact.
+
+Layout (little endian, all sections aligned to 8 bytes):
+
+- header: magic, format version, number of types, artifact version,
+  build time (microseconds since the epoch), number of Bloom hash functions;
+- one directory entry per observable type: type name, number of entries and
+  the offsets of the sections of the type;
+- per type:
+
+  - the 32-bit hashes of the normalized values, sorted;
+  - the 64-bit fingerprints of the normalized values, in the order of the
+    hashes;
+  - the pks of the observables (32 bit), in the order of the hashes;
+  - one TLP byte per entry (most permissive TLP in the high nibble, most
+    restrictive TLP in the low nibble; the codes are the TLP values of
+    ``Status`` divided by 10);
+  - one flag byte per entry (bits 0-1: confidence, 2-3: processing,
+    4-6: priority, each as the ``Status`` value divided by 10; bit 7:
+    the status is only active until a given time);
+  - a bucket table: the index of the first hash whose top ``prefix_bits``
+    bits are at least ``i``, for all ``i`` (plus the number of entries);
+    there are about as many buckets as entries, so that most values that
+    are not in the artifact fall into an empty bucket;
+  - optionally, a Bloom filter over the hashes.
+
+A value is looked up by type and the hash of its normalized value (see
+``normalize_value`` and ``value_hash``). The hash is the CRC32 checksum of
+the value, which is cheap to calculate in Python but collides far too often
+to identify a value. The hash therefore only narrows the search: an entry
+matches if its fingerprint, the first 64 bits of the SHA-1 digest of the
+value (see ``value_fingerprint``), is equal as well. The fingerprint is only
+calculated for values whose hash is found, so values that are not in the
+artifact (the common case for sensors) cost a checksum and a look at the
+bucket table. Several entries may share a hash, and several observables may
+share a fingerprint (e.g., values differing only in case).
+
+The reader searches the mapped file in place (through memoryviews with
+Python 3 and through ctypes arrays over a private, never written mapping
+with Python 2), so that processes reading the same artifact share its pages.
+
+Measured with an artifact of a million entries, a matcher (see
+``LookupArtifact.matcher``) checks per second and core:
+
+============================  ===========  ===========
+values                        Python 3.11  Python 2.7
+============================  ===========  ===========
+not found, normalized         0.9-1.1 M    0.6-0.8 M
+not found                     0.7-0.9 M    0.3-0.35 M
+found (normalized or not)     0.3-0.4 M    0.15-0.25 M
+============================  ===========  ===========
+
+The Bloom filter is meant for readers for which memory accesses are
+expensive compared to the hashing; in Python, the bucket table is cheaper,
+so ``LookupArtifact`` uses the filter only on request.
+"""
+
+import os
+import sys
+import mmap
+import zlib
+import ctypes
+import struct
+import hashlib
+
+from bisect import bisect_left
+from collections import namedtuple
+from array import array
+
+MAGIC = b'MANTISLK'
+
+FORMAT_VERSION = 3
+
+HEADER = struct.Struct('<8sIIQQI4x')
+
+DIRECTORY_ENTRY = struct.Struct('<32sQQQQQQQQQI4x')
+
+FINGERPRINT = struct.Struct('<Q')
+
+MAX_PREFIX_BITS = 32
+
+PY2 = sys.version_info[0] == 2
+
+TEXT_TYPE = unicode if PY2 else str
+
+# Can the sections be read through memoryviews? (Python 2 cannot cast
+# memoryviews, and casts use the native byte order.) Otherwise, they are
+# read through ctypes arrays of little endian integers.
+
+CAST_VIEWS = not PY2 and sys.byteorder == 'little'
+
+# array typecode of unsigned 64-bit integers (Python 2 has no 'Q')
+
+try:
+    FINGERPRINT_TYPECODE = 'Q'
+    array(FINGERPRINT_TYPECODE)
+except ValueError:
+    FINGERPRINT_TYPECODE = 'L'
+
+# typecodes and ctypes types of the sections
+
+UINT8 = ('B', ctypes.c_uint8)
+
+UINT32 = ('I', ctypes.c_uint32.__ctype_le__)
+
+UINT64 = ('Q', ctypes.c_uint64.__ctype_le__)
+
+MASK_32 = 0xffffffff
+
+
+class ArtifactError(Exception):
+    pass
+
+
+Match = namedtuple('Match', ['object_id',
+                             'most_permissive_tlp',
+                             'most_restrictive_tlp',
+                             'confidence',
+                             'processing',
+                             'priority',
+                             'time_limited'])
+
+
+def normalize_value(value):
+    if isinstance(value, bytes):
+        # (much faster than ``decode`` with Python 2)
+        value = TEXT_TYPE(value, 'utf-8')
+    return value.strip().lower()
+
+
+def raw_hash(data):
+    """
+    32-bit hash of a normalized value encoded as UTF-8.
+    """
+    return zlib.crc32(data) & MASK_32
+
+
+def raw_fingerprint(data):
+    """
+    64-bit fingerprint of a normalized value encoded as UTF-8.
+    """
+    return FINGERPRINT.unpack_from(hashlib.sha1(data).digest())[0]
+
+
+def value_hash(value):
+    return raw_hash(normalize_value(value).encode('utf-8'))
+
+
+def value_fingerprint(value):
+    return raw_fingerprint(normalize_value(value).encode('utf-8'))
+
+
+def encode_tlp(most_permissive_tlp, most_restrictive_tlp):
+    return ((most_permissive_tlp // 10) << 4) | (most_restrictive_tlp // 10)
+
+
+def encode_flags(confidence, processing, priority, time_limited):
+    return ((confidence // 10) & 0x3) | (((processing // 10) & 0x3) << 2) | (((priority // 10) & 0x7) << 4) | \
+           (0x80 if time_limited else 0)
+
+
+def decode(object_id, tlp, flags):
+    return Match(object_id,
+                 (tlp >> 4) * 10,
+                 (tlp & 0xf) * 10,
+                 (flags & 0x3) * 10,
+                 ((flags >> 2) & 0x3) * 10,
+                 ((flags >> 4) & 0x7) * 10,
+                 bool(flags & 0x80))
+
+
+def prefix_bits_for(count):
+    return min(MAX_PREFIX_BITS, count.bit_length())
+
+
+def bloom_positions(hash_value, bits, hashes):
+    h2 = (((hash_value >> 16) | (hash_value << 16)) & MASK_32) | 1
+    return [(hash_value + i * h2) % bits for i in range(hashes)]
+
+
+def align(offset):
+    return (offset + 7) & ~7
+
+
+def little_endian(values):
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values
+
+
+def write_artifact(path, version, built_at, entries, bloom_bits_per_entry=0, bloom_hashes=7):
+    """
+    Write an artifact. ``entries`` maps type names to tuples of arrays
+    ``(hashes, fingerprints, object_ids, tlps, flags)`` of equal length, sorted
+    by hash (typecodes ``'I'``, ``FINGERPRINT_TYPECODE``, ``'I'``, ``'B'`` and
+    ``'B'``); ``built_at`` is given in microseconds since the epoch.
+
+    The file is written next to ``path`` and moved into place, so that readers
+    never see a partial artifact; readers that have the old file mapped keep
+    reading the old version.
+    """
+    type_names = sorted(entries.keys())
+    if not bloom_bits_per_entry:
+        bloom_hashes = 0
+
+    offset = align(HEADER.size + DIRECTORY_ENTRY.size * len(type_names))
+    directory = []
+    sections = []
+    for type_name in type_names:
+        (hashes, fingerprints, object_ids, tlps, flags) = entries[type_name]
+        count = len(hashes)
+        prefix_bits = prefix_bits_for(count)
+
+        buckets = array('I')
+        if prefix_bits:
+            shift = 32 - prefix_bits
+            position = 0
+            for bucket in range(1 << prefix_bits):
+                while position < count and (hashes[position] >> shift) < bucket:
+                    position += 1
+                buckets.append(position)
+            buckets.append(count)
+
+        bloom = bytearray()
+        bloom_bits = 0
+        if bloom_bits_per_entry and count:
+            bloom_bits = align(max(64, count * bloom_bits_per_entry) // 8) * 8
+            bloom = bytearray(bloom_bits // 8)
+            for hash_value in hashes:
+                for position in bloom_positions(hash_value, bloom_bits, bloom_hashes):
+                    bloom[position >> 3] |= 1 << (position & 7)
+
+        type_offsets = []
+        for section in (little_endian(hashes), little_endian(fingerprints), little_endian(object_ids),
+                        tlps, flags, little_endian(buckets), bloom):
+            type_offsets.append(offset)
+            sections.append((offset, section))
+            offset = align(offset + len(section) * (section.itemsize if isinstance(section, array) else 1))
+
+        encoded_name = type_name.encode('utf-8')
+        if len(encoded_name) > 32:
+            raise ArtifactError("Type name %s too long" % type_name)
+        directory.append(DIRECTORY_ENTRY.pack(encoded_name, count, *(type_offsets + [bloom_bits, prefix_bits])))
+
+    tmp_path = '%s.%s.tmp' % (path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(type_names), version, built_at, bloom_hashes))
+        for entry in directory:
+            f.write(entry)
+        for (section_offset, section) in sections:
+            f.write(b'\0' * (section_offset - f.tell()))
+            if isinstance(section, array):
+                section.tofile(f)
+            else:
+                f.write(section)
+        f.write(b'\0' * (align(f.tell()) - f.tell()))
+    os.rename(tmp_path, path)
+
+
+class TypeSection(object):
+
+    def __init__(self, artifact, count, hashes_offset, fingerprints_offset, ids_offset, tlp_offset,
+                 flags_offset, buckets_offset, bloom_offset, bloom_bits, prefix_bits):
+        self.count = count
+        self.bloom_bits = bloom_bits
+        self.bloom_hashes = artifact.bloom_hashes
+        self.prefix_bits = prefix_bits
+        self.shift = 32 - prefix_bits
+
+        self.hashes = artifact.section(UINT32, hashes_offset, count)
+        self.fingerprints = artifact.section(UINT64, fingerprints_offset, count)
+        self.ids = artifact.section(UINT32, ids_offset, count)
+        self.tlps = artifact.section(UINT8, tlp_offset, count)
+        self.flags = artifact.section(UINT8, flags_offset, count)
+        self.buckets = artifact.section(UINT32, buckets_offset, (1 << prefix_bits) + 1 if prefix_bits else 0)
+        self.bloom = artifact.section(UINT8, bloom_offset, bloom_bits // 8)
+
+    def may_contain(self, hash_value):
+        if not self.bloom_bits:
+            return True
+        bloom = self.bloom
+        for position in bloom_positions(hash_value, self.bloom_bits, self.bloom_hashes):
+            if not bloom[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def find(self, hash_value, data):
+        """
+        Index of the first entry for the normalized and encoded value
+        ``data`` with the given hash, or -1.
+        """
+        if not self.count:
+            return -1
+        bucket = hash_value >> self.shift
+        lo = self.buckets[bucket]
+        hi = self.buckets[bucket + 1]
+        index = bisect_left(self.hashes, hash_value, lo, hi)
+        if index < hi and self.hashes[index] == hash_value:
+            return self.verify(index, hash_value, data)
+        return -1
+
+    def verify(self, index, hash_value, data):
+        """
+        Index of the first entry from ``index`` on with the given hash and the
+        fingerprint of ``data``, or -1.
+        """
+        fingerprint_value = raw_fingerprint(data)
+        hashes = self.hashes
+        fingerprints = self.fingerprints
+        while index < self.count and hashes[index] == hash_value:
+            if fingerprints[index] == fingerprint_value:
+                return index
+            index += 1
+        return -1
+
+    def match(self, index):
+        return decode(self.ids[index], self.tlps[index], self.flags[index])
+
+    def entries(self):
+        """
+        Iterate over all entries as tuples (hash, fingerprint, object id, tlp,
+        flags).
+        """
+        for index in range(self.count):
+            yield (self.hashes[index],
+                   self.fingerprints[index],
+                   self.ids[index],
+                   self.tlps[index],
+                   self.flags[index])
+
+    def release(self):
+        for name in ('hashes', 'fingerprints', 'ids', 'tlps', 'flags', 'buckets', 'bloom'):
+            view = getattr(self, name)
+            if isinstance(view, memoryview):
+                view.release()
+            setattr(self, name, None)
+
+
+class LookupArtifact(object):
+    """
+    Reader of a lookup artifact; the file is mapped into memory and read in
+    place.
+
+        artifact = LookupArtifact('/var/lib/mantis/indicators.bin')
+        if artifact.contains('FQDN', 'evil.example.com'):
+            ...
+        matches = artifact.lookup('IP', '10.1.2.3')
+    """
+
+    def __init__(self, path, use_bloom=False):
+        self.path = path
+        with open(path, 'rb') as f:
+            # ctypes arrays need a writable buffer: the private mapping is
+            # never written, so its pages stay shared.
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ if CAST_VIEWS else mmap.ACCESS_COPY)
+        self.view = memoryview(self.map) if CAST_VIEWS else None
+
+        if len(self.map) < HEADER.size:
+            self.close()
+            raise ArtifactError("%s is not a lookup artifact" % path)
+        (magic, format_version, type_count, self.version, self.built_at, self.bloom_hashes) = \
+            HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ArtifactError("%s is not a lookup artifact" % path)
+        if format_version != FORMAT_VERSION:
+            self.close()
+            raise ArtifactError("%s has unsupported format version %s" % (path, format_version))
+
+        self.types = {}
+        for i in range(type_count):
+            fields = DIRECTORY_ENTRY.unpack_from(self.map, HEADER.size + i * DIRECTORY_ENTRY.size)
+            type_name = fields[0].rstrip(b'\0').decode('utf-8')
+            section = TypeSection(self, *fields[1:])
+            if not use_bloom:
+                section.bloom_bits = 0
+            self.types[type_name] = section
+
+    def section(self, kind, offset, count):
+        """
+        View on ``count`` integers of the given kind (see ``UINT32`` etc.)
+        at ``offset`` in the mapped file.
+        """
+        (typecode, ctype) = kind
+        size = ctypes.sizeof(ctype) * count
+        if offset + size > len(self.map):
+            raise ArtifactError("%s is truncated" % self.path)
+        if CAST_VIEWS:
+            return self.view[offset:offset + size].cast(typecode)
+        return (ctype * count).from_buffer(self.map, offset)
+
+    def find(self, type_name, value):
+        """
+        Return the section of the type and the index of the first entry
+        for the value (or -1).
+        """
+        section = self.types.get(type_name)
+        if section is None:
+            return None, -1
+        data = normalize_value(value).encode('utf-8')
+        hash_value = raw_hash(data)
+        if not section.may_contain(hash_value):
+            return section, -1
+        return section, section.find(hash_value, data)
+
+    def contains(self, type_name, value):
+        return self.find(type_name, value)[1] >= 0
+
+    def matcher(self, type_name, normalized=False):
+        """
+        Return a function that checks values of the given type against the
+        artifact, with everything needed bound to local names; this is the
+        fastest way of checking many values. If ``normalized`` is set, the
+        function expects values that are already normalized and encoded as
+        UTF-8. The function must not be used once the artifact is closed.
+        """
+        section = self.types.get(type_name)
+        if section is None or not section.count:
+            return lambda value: False
+        if section.bloom_bits:
+            if normalized:
+                def contains(value):
+                    hash_value = raw_hash(value)
+                    return section.may_contain(hash_value) and section.find(hash_value, value) >= 0
+                return contains
+            return lambda value: self.contains(type_name, value)
+
+        hashes = section.hashes
+        buckets = section.buckets
+        shift = section.shift
+        verify = section.verify
+        crc32 = zlib.crc32
+        mask = MASK_32
+
+        if normalized:
+            def contains(value):
+                hash_value = crc32(value) & mask
+                bucket = hash_value >> shift
+                lo = buckets[bucket]
+                hi = buckets[bucket + 1]
+                if lo == hi:
+                    return False
+                index = bisect_left(hashes, hash_value, lo, hi)
+                return index < hi and hashes[index] == hash_value and verify(index, hash_value, value) >= 0
+        else:
+            normalize = normalize_value
+
+            def contains(value):
+                value = normalize(value).encode('utf-8')
+                hash_value = crc32(value) & mask
+                bucket = hash_value >> shift
+                lo = buckets[bucket]
+                hi = buckets[bucket + 1]
+                if lo == hi:
+                    return False
+                index = bisect_left(hashes, hash_value, lo, hi)
+                return index < hi and hashes[index] == hash_value and verify(index, hash_value, value) >= 0
+        return contains
+
+    def lookup(self, type_name, value):
+        """
+        Return the list of matches (see ``Match``) for the value.
+        """
+        section, index = self.find(type_name, value)
+        if index < 0:
+            return []
+        result = []
+        hash_value = section.hashes[index]
+        fingerprint_value = section.fingerprints[index]
+        while index < section.count and section.hashes[index] == hash_value:
+            if section.fingerprints[index] == fingerprint_value:
+                result.append(section.match(index))
+            index += 1
+        return result
+
+    def close(self):
+        # The views on the mapping must be gone before it is closed.
+        for section in getattr(self, 'types', {}).values():
+            section.release()
+        self.types = {}
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
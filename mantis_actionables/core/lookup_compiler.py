@@ -0,0 +1,236 @@
+# Copyright (c) Siemens AG, 2015
+#
+# This file is part of MANTIS.  MANTIS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either version 2
+# of the License, or(at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+"""
+Compilation of the active singleton observables into a lookup artifact
+(see ``mantis_actionables.core.lookup_artifact`` for the format).
+
+An observable is active if it has an active Status2X whose status is
+active, not marked as false positive and active at the time of the build.
+
+The first build (or a build with ``full=True``) reads all active
+observables. Later builds are incremental: they start from the previous
+artifact, recompute the entries of the observables whose Status2X objects
+have changed since the previous build (or whose status became active or
+inactive since then) and merge them into the entries kept from the
+previous artifact. Observables that are deleted are only dropped by a full
+build.
+"""
+
+import os
+import heapq
+import logging
+import calendar
+
+from array import array
+from datetime import datetime, timedelta
+
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Q, Max
+from django.utils import timezone
+
+from mantis_actionables import MANTIS_ACTIONABLES_LOOKUP_ARTIFACT_PATH
+from mantis_actionables.models import SingletonObservable, Status2X
+from mantis_actionables.core.observables import chunks
+from mantis_actionables.core.lookup_artifact import LookupArtifact, ArtifactError, FINGERPRINT_TYPECODE, \
+    write_artifact, normalize_value, raw_hash, raw_fingerprint, encode_tlp, encode_flags
+
+logger = logging.getLogger(__name__)
+
+# Status2X objects are created with the time of their creation, but become
+# visible only when the transaction commits; changes since this many seconds
+# before the previous build are considered again.
+
+CHANGE_OVERLAP_SECONDS = 3600
+
+CHUNK_SIZE = 10000
+
+ENTRY_COLUMNS = ('id',
+                 'type__name',
+                 'value',
+                 'status_thru__status__most_permissive_tlp',
+                 'status_thru__status__most_restrictive_tlp',
+                 'status_thru__status__max_confidence',
+                 'status_thru__status__best_processing',
+                 'status_thru__status__priority',
+                 'status_thru__status__active_to')
+
+INF_YEAR = 9999
+
+
+def to_microseconds(timestamp):
+    return calendar.timegm(timestamp.utctimetuple()) * 1000000 + timestamp.microsecond
+
+
+def from_microseconds(microseconds):
+    return datetime.utcfromtimestamp(microseconds / 1000000.0).replace(tzinfo=timezone.utc)
+
+
+def active_observables(now):
+    """
+    Queryset of the observables that are active at the given time.
+    """
+    # All conditions go into a single ``filter``, so that they refer to the same Status2X
+    return SingletonObservable.objects.filter(Q(status_thru__status__false_positive__isnull=True) |
+                                              Q(status_thru__status__false_positive=False),
+                                              status_thru__active=True,
+                                              status_thru__status__active=True,
+                                              status_thru__status__active_from__lte=now,
+                                              status_thru__status__active_to__gte=now)
+
+
+def entries_from_rows(rows):
+    """
+    Turn rows with the ``ENTRY_COLUMNS`` (ordered by pk) into pairs of type
+    name and entry ``(hash, fingerprint, object id, tlp, flags)``; if an observable has
+    several active stati, the first one is used.
+    """
+    last_pk = None
+    for (pk, type_name, value, most_permissive_tlp, most_restrictive_tlp,
+         confidence, processing, priority, active_to) in rows:
+        if pk == last_pk:
+            continue
+        last_pk = pk
+        data = normalize_value(value).encode('utf-8')
+        yield type_name, (raw_hash(data),
+                          raw_fingerprint(data),
+                          pk,
+                          encode_tlp(most_permissive_tlp, most_restrictive_tlp),
+                          encode_flags(confidence, processing, priority, active_to.year < INF_YEAR))
+
+
+def all_entries(now, chunk_size=CHUNK_SIZE):
+    max_pk = SingletonObservable.objects.aggregate(Max('pk'))['pk__max'] or 0
+    queryset = active_observables(now)
+    for start in range(0, max_pk + 1, chunk_size):
+        rows = queryset.filter(pk__gte=start, pk__lt=start + chunk_size).order_by('pk').values_list(*ENTRY_COLUMNS)
+        for entry in entries_from_rows(rows):
+            yield entry
+
+
+def changed_entries(pks, now, chunk_size=CHUNK_SIZE):
+    queryset = active_observables(now)
+    for chunk in chunks(sorted(pks), min(chunk_size, 500)):
+        rows = queryset.filter(pk__in=chunk).order_by('pk').values_list(*ENTRY_COLUMNS)
+        for entry in entries_from_rows(rows):
+            yield entry
+
+
+def changed_observable_pks(since, until):
+    """
+    Pks of the observables whose active status may have changed in the given
+    time span: Status2X objects have been created (and the previous ones
+    deactivated) or the activity window of the status has opened or closed.
+    """
+    content_type = ContentType.objects.get_for_model(SingletonObservable)
+    changed = set(Status2X.objects.filter(content_type=content_type,
+                                          timestamp__gt=since).values_list('object_id', flat=True))
+    window = Q(status__active_from__gt=since, status__active_from__lte=until) | \
+             Q(status__active_to__gt=since, status__active_to__lte=until)
+    changed.update(Status2X.objects.filter(window,
+                                           content_type=content_type,
+                                           active=True).values_list('object_id', flat=True))
+    return changed
+
+
+# Entries are kept as single integers while they are collected and sorted:
+# a list of integers takes a third of the memory of a list of tuples.
+
+def pack_entry(entry):
+    (hash_value, fingerprint_value, object_id, tlp, flags) = entry
+    return (hash_value << 112) | (fingerprint_value << 48) | (object_id << 16) | (tlp << 8) | flags
+
+
+def fill_arrays(packed_entries):
+    (hashes, fingerprints, object_ids, tlps, flags) = (array('I'), array(FINGERPRINT_TYPECODE),
+                                                       array('I'), array('B'), array('B'))
+    for packed in packed_entries:
+        hashes.append(packed >> 112)
+        fingerprints.append((packed >> 48) & 0xffffffffffffffff)
+        object_ids.append((packed >> 16) & 0xffffffff)
+        tlps.append((packed >> 8) & 0xff)
+        flags.append(packed & 0xff)
+    return (hashes, fingerprints, object_ids, tlps, flags)
+
+
+def open_previous(path):
+    if not os.path.exists(path):
+        return None
+    try:
+        return LookupArtifact(path)
+    except (ArtifactError, ValueError) as e:
+        logger.warning("Cannot read previous lookup artifact %s, carrying out a full build: %s" % (path, e))
+        return None
+
+
+def compile_lookup_artifact(path=None, full=False, bloom_bits_per_entry=0, chunk_size=CHUNK_SIZE):
+    """
+    Build the lookup artifact at ``path`` (default:
+    ``MANTIS_ACTIONABLES_LOOKUP_ARTIFACT_PATH``), incrementally from the previous
+    artifact at that path unless ``full`` is set.
+
+    Returns a dictionary with the new ``version``, the number of ``entries``,
+    the number of ``changed`` observables and whether the build was ``full``.
+    """
+    path = path or MANTIS_ACTIONABLES_LOOKUP_ARTIFACT_PATH
+    if not path:
+        raise ValueError("No path for the lookup artifact given")
+
+    now = timezone.now()
+    previous = None if full else open_previous(path)
+
+    try:
+        if previous is None:
+            by_type = {}
+            for (type_name, entry) in all_entries(now, chunk_size=chunk_size):
+                by_type.setdefault(type_name, []).append(pack_entry(entry))
+            entries = {}
+            for type_name in list(by_type.keys()):
+                packed_entries = by_type.pop(type_name)
+                packed_entries.sort()
+                entries[type_name] = fill_arrays(packed_entries)
+            version = 1
+            changed = None
+        else:
+            since = from_microseconds(previous.built_at) - timedelta(seconds=CHANGE_OVERLAP_SECONDS)
+            changed = changed_observable_pks(since, now)
+            by_type = {}
+            for (type_name, entry) in changed_entries(changed, now, chunk_size=chunk_size):
+                by_type.setdefault(type_name, []).append(pack_entry(entry))
+
+            entries = {}
+            for type_name in set(by_type.keys()) | set(previous.types.keys()):
+                kept = ()
+                if type_name in previous.types:
+                    kept = (pack_entry(entry) for entry in previous.types[type_name].entries()
+                            if not entry[2] in changed)
+                arrays = fill_arrays(heapq.merge(kept, sorted(by_type.get(type_name, []))))
+                if len(arrays[0]):
+                    entries[type_name] = arrays
+            version = previous.version + 1
+    finally:
+        if previous is not None:
+            previous.close()
+
+    write_artifact(path, version, to_microseconds(now), entries, bloom_bits_per_entry=bloom_bits_per_entry)
+
+    result = {'version': version,
+              'entries': sum(len(arrays[0]) for arrays in entries.values()),
+              'changed': len(changed) if changed is not None else None,
+              'full': changed is None}
+    logger.info("Compiled lookup artifact %s version %s with %s entries" % (path, version, result['entries']))
+    return result
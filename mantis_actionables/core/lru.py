@@ -0,0 +1,64 @@
+# Copyright (c) Siemens AG, 2015
+#
+# This file is part of MANTIS.  MANTIS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either version 2
+# of the License, or(at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    A small, bounded in-process mapping that evicts the least recently used
+    entry once ``max_size`` entries are stored.
+
+    Lookups that miss return ``default`` (``None`` unless specified otherwise),
+    so ``None`` cannot be stored as a value.
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            return default
+        # Re-insert to mark the entry as most recently used
+        self._data[key] = value
+        return value
+
+    def set(self, key, value):
+        if key in self._data:
+            del self._data[key]
+        elif len(self._data) >= self.max_size:
+            self._data.popitem(last=False)
+        self._data[key] = value
+
+    def update(self, mapping):
+        for key, value in mapping.items():
+            self.set(key, value)
+
+    def delete(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,230 @@
+# Copyright (c) Siemens AG, 2015
+#
+# This file is part of MANTIS.  MANTIS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either version 2
+# of the License, or(at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import logging
+
+from itertools import islice
+
+from django.db import transaction, IntegrityError
+from django.utils.encoding import force_text
+
+from mantis_actionables.models import SingletonObservable, SingletonObservableType, SingletonObservableSubtype
+
+from mantis_actionables.core.lru import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+def chunks(iterable, size):
+    """
+    Split an iterable into lists of at most ``size`` elements without
+    reading more than one chunk into memory.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def add_index_entries(model, fields_by_pk):
+    """
+    Create the entries of an index of singleton observables (a model with a
+    ``singleton_observable`` primary key, e.g. ``IPRange`` or ``DomainSuffix``)
+    for the observables in ``fields_by_pk``, which maps observable pks to the
+    remaining field values of their entries; observables that are already in
+    the index are skipped. Returns the number of entries written.
+    """
+    if not fields_by_pk:
+        return 0
+
+    existing = set(model.objects.filter(singleton_observable_id__in=fields_by_pk.keys())\
+                                .values_list('singleton_observable_id', flat=True))
+    missing = [pk for pk in fields_by_pk.keys() if not pk in existing]
+    try:
+        with transaction.atomic():
+            model.objects.bulk_create([model(singleton_observable_id=pk, **fields_by_pk[pk]) for pk in missing])
+    except IntegrityError:
+        # Another process has indexed some of the observables in the meantime
+        for pk in missing:
+            model.objects.get_or_create(singleton_observable_id=pk, defaults=fields_by_pk[pk])
+    return len(missing)
+
+
+def normalize_triple(triple):
+    """
+    Bring a (type, subtype, value) triple into the form in which we store it:
+    all parts are text and a missing subtype is stored as the empty string.
+    """
+    (type_name, subtype_name, value) = triple
+    if not subtype_name:
+        subtype_name = ''
+    return (force_text(type_name), force_text(subtype_name), force_text(value))
+
+
+class SingletonObservableResolver(object):
+    """
+    Resolve batches of (type, subtype, value) triples into primary keys
+    of SingletonObservables, creating the observables that do not exist yet.
+
+    - types and subtypes are resolved via the caching managers;
+    - existing observables are fetched with one query per chunk of
+      ``chunk_size`` triples;
+    - missing observables are created with one ``bulk_create`` per chunk;
+    - resolved triples are kept in a bounded LRU, so that long-running
+      workers do not have to ask the database again for
+      observables they have already seen.
+
+    If another worker creates some of the observables at the same time,
+    the ``bulk_create`` fails on the uniqueness constraint; in this case,
+    the affected chunk falls back to ``get_or_create`` for each triple.
+    """
+
+    CHUNK_SIZE = 500
+
+    CACHE_SIZE = 100000
+
+    def __init__(self, chunk_size=None, cache_size=None):
+        self.chunk_size = chunk_size or SingletonObservableResolver.CHUNK_SIZE
+        self.cache = LRUCache(max_size=cache_size or SingletonObservableResolver.CACHE_SIZE)
+
+    def resolve(self, triples, created_triples=None):
+        """
+        Take an iterable of (type, subtype, value) triples and return a dictionary
+        mapping each (normalized) triple to the primary key of its SingletonObservable.
+
+        If a set is passed as ``created_triples``, the triples for which a new
+        SingletonObservable was created are added to it.
+        """
+
+        result = {}
+        missing = []
+        for triple in triples:
+            triple = normalize_triple(triple)
+            if triple in result:
+                continue
+            pk = self.cache.get(triple)
+            if pk is not None:
+                result[triple] = pk
+            else:
+                result[triple] = None
+                missing.append(triple)
+
+        if not missing:
+            return result
+
+        type_names = sorted(set(x[0] for x in missing))
+        subtype_names = sorted(set(x[1] for x in missing))
+
+        type_map = dict(zip(type_names,
+                            SingletonObservableType.cached_objects.get_or_create_many([{'name': x} for x in type_names])))
+        subtype_map = dict(zip(subtype_names,
+                               SingletonObservableSubtype.cached_objects.get_or_create_many([{'name': x} for x in subtype_names])))
+
+        for chunk in chunks(missing, self.chunk_size):
+            chunk_result = self._resolve_chunk(chunk, type_map, subtype_map, created_triples)
+            result.update(chunk_result)
+            self.cache.update(chunk_result)
+
+        return result
+
+    def _fetch_existing(self, id_triples):
+        """
+        Fetch the pks of existing observables for the given (type_id, subtype_id, value)
+        triples with a single query.
+        """
+        id_triples = set(id_triples)
+        values = set(x[2] for x in id_triples)
+        type_ids = set(x[0] for x in id_triples)
+        subtype_ids = set(x[1] for x in id_triples)
+
+        existing = {}
+        qs = SingletonObservable.objects.filter(value__in=values,
+                                                type_id__in=type_ids,
+                                                subtype_id__in=subtype_ids).values_list('pk','type_id','subtype_id','value')
+        for (pk, type_id, subtype_id, value) in qs:
+            if (type_id, subtype_id, value) in id_triples:
+                existing[(type_id, subtype_id, value)] = pk
+        return existing
+
+    def _resolve_chunk(self, chunk, type_map, subtype_map, created_triples):
+
+        id2triple = {}
+        for triple in chunk:
+            (type_name, subtype_name, value) = triple
+            id2triple[(type_map[type_name].id, subtype_map[subtype_name].id, value)] = triple
+
+        existing = self._fetch_existing(id2triple.keys())
+
+        to_create = [x for x in id2triple.keys() if x not in existing]
+
+        if to_create:
+            try:
+                with transaction.atomic():
+                    SingletonObservable.objects.bulk_create([SingletonObservable(type_id=type_id,
+                                                                                 subtype_id=subtype_id,
+                                                                                 value=value)
+                                                             for (type_id, subtype_id, value) in to_create])
+            except IntegrityError:
+                # Somebody else has created some of the observables in the meantime
+                logger.info("Concurrent creation of singleton observables detected, resolving one by one")
+                created_ids = set()
+                for (type_id, subtype_id, value) in to_create:
+                    observable, created = SingletonObservable.objects.get_or_create(type_id=type_id,
+                                                                                    subtype_id=subtype_id,
+                                                                                    value=value)
+                    existing[(type_id, subtype_id, value)] = observable.pk
+                    if created:
+                        created_ids.add((type_id, subtype_id, value))
+            else:
+                created_ids = set(to_create)
+                # bulk_create does not give us the primary keys, so we ask for them.
+                existing.update(self._fetch_existing(to_create))
+
+            if created_triples is not None:
+                created_triples.update(id2triple[x] for x in created_ids)
+
+            # Imported here to avoid a circular import
+            from mantis_actionables.core.search import index_objects
+            from mantis_actionables.core.ip_ranges import index_ip_ranges
+            from mantis_actionables.core.domains import index_domains
+            index_objects('observable', [existing[x] for x in created_ids])
+            created_observables = [(existing[x], id2triple[x][0], id2triple[x][2]) for x in created_ids]
+            index_ip_ranges(created_observables)
+            index_domains(created_observables)
+
+            logger.debug("Created %s singleton observables" % len(created_ids))
+
+        return dict((id2triple[x], pk) for (x, pk) in existing.items())
+
+    def clear(self):
+        self.cache.clear()
+
+
+# Resolver shared by the importers; its cache carries hits across
+# batches in long-running workers.
+
+singleton_observable_resolver = SingletonObservableResolver()
+
+
+def resolve_singleton_observables(triples, created_triples=None):
+    """
+    Resolve (type, subtype, value) triples into SingletonObservable pks
+    using the shared resolver; see ``SingletonObservableResolver.resolve``.
+    """
+    return singleton_observable_resolver.resolve(triples, created_triples=created_triples)
@@ -0,0 +1,325 @@
+# Copyright (c) Siemens AG, 2015
+#
+# This file is part of MANTIS.  MANTIS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either version 2
+# of the License, or(at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+"""
+Indexed substring and prefix search for the text columns searched by the
+datatables (observable values, report names and import info names).
+
+The search is carried out by a backend chosen per database:
+
+- on PostgreSQL, the searched columns carry trigram (``pg_trgm``) indexes
+  on ``UPPER(column::text)``, which is exactly the expression Django
+  generates for ``icontains`` and ``istartswith``; the lookups
+  stay as they are and the planner uses the indexes;
+
+- on SQLite, the texts are kept in an FTS5 shadow table with trigram
+  tokenizer (``SearchIndexEntry``), which is kept in sync by the importers
+  and by signal handlers and can be filled with the ``rebuild_search_index``
+  command;
+
+- on other databases, the plain lookups are used.
+
+A different backend can be configured with ``MANTIS_ACTIONABLES_SEARCH_BACKEND``
+(dotted path to a subclass of ``SearchBackend``).
+"""
+
+import logging
+import importlib
+
+from django.db import connections, transaction, DatabaseError, DEFAULT_DB_ALIAS
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from dingos.models import InfoObject
+
+from mantis_actionables import MANTIS_ACTIONABLES_SEARCH_BACKEND, MANTIS_ACTIONABLES_STIX_REPORT_FAMILY_AND_TYPES
+from mantis_actionables.models import SingletonObservable, ImportInfo, SearchIndexEntry
+
+from mantis_actionables.core.observables import chunks
+
+logger = logging.getLogger(__name__)
+
+# kind of index -> (model, searched field)
+
+SEARCH_INDEXES = {
+    'observable': (SingletonObservable, 'value'),
+    'report': (InfoObject, 'name'),
+    'import_info': (ImportInfo, 'name'),
+}
+
+# Maximal number of objects written to the shadow index per query
+# (SQLite limits the number of query parameters)
+
+INDEX_CHUNK_SIZE = 400
+
+
+def id_lookup(lookup):
+    """
+    Turn the lookup of a searched column (e.g., ``sources__import_info__name``)
+    into the lookup of the primary key of the object it belongs to
+    (``sources__import_info__id``).
+    """
+    if '__' in lookup:
+        return lookup.rsplit('__', 1)[0] + '__id'
+    return 'id'
+
+
+class SearchBackend(object):
+    """
+    Search with the plain ``icontains``/``istartswith`` lookups.
+    """
+
+    # Does the backend keep a shadow index that has to be written on import?
+    shadow_index = False
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def available(self):
+        return True
+
+    def install(self):
+        """
+        Create the database structures required by the backend (called by
+        the migration).
+        """
+        pass
+
+    def uninstall(self):
+        pass
+
+    def q(self, kind, lookup, term, prefix=False):
+        """
+        Q object selecting the rows whose column ``lookup`` (containing the
+        texts of the index ``kind``) contains (or starts with) ``term``.
+        """
+        return Q(**{'%s__%s' % (lookup, 'istartswith' if prefix else 'icontains'): term})
+
+    def index(self, kind, pairs):
+        """
+        Write the (pk, text) pairs of objects of the given kind into the index.
+        """
+        pass
+
+    def remove(self, kind, pks):
+        pass
+
+    def clear(self, kind):
+        pass
+
+
+class TrigramSearchBackend(SearchBackend):
+    """
+    PostgreSQL: trigram indexes on the searched columns themselves.
+    """
+
+    def index_name(self, kind):
+        return 'mantis_actionables_search_%s_trgm' % kind
+
+    def install(self):
+        cursor = self.connection.cursor()
+        try:
+            with transaction.atomic(using=self.connection.alias):
+                cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        except DatabaseError as e:
+            logger.warning("Could not install the pg_trgm extension, searches will not be indexed: %s" % e)
+            return
+        for kind, (model, field_name) in SEARCH_INDEXES.items():
+            cursor.execute('CREATE INDEX %s ON %s USING gin (UPPER(%s::text) gin_trgm_ops)' % (
+                self.index_name(kind),
+                self.connection.ops.quote_name(model._meta.db_table),
+                self.connection.ops.quote_name(model._meta.get_field(field_name).column)))
+
+    def uninstall(self):
+        cursor = self.connection.cursor()
+        for kind in SEARCH_INDEXES.keys():
+            cursor.execute('DROP INDEX IF EXISTS %s' % self.index_name(kind))
+
+
+class FTSSearchBackend(SearchBackend):
+    """
+    SQLite: FTS5 shadow table with trigram tokenizer.
+
+    Trigram queries need at least three characters; shorter terms are
+    searched with the plain lookups.
+    """
+
+    shadow_index = True
+
+    MIN_TERM_LENGTH = 3
+
+    table = SearchIndexEntry._meta.db_table
+
+    def available(self):
+        cursor = self.connection.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=%s", [self.table])
+        return cursor.fetchone() is not None
+
+    def install(self):
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute("CREATE VIRTUAL TABLE %s USING fts5(kind UNINDEXED, object_id UNINDEXED, text, "
+                           "tokenize='trigram')" % self.table)
+        except DatabaseError as e:
+            # FTS5 trigram tokenizer requires SQLite 3.34
+            logger.warning("Could not create the search index table, searches will not be indexed: %s" % e)
+
+    def uninstall(self):
+        self.connection.cursor().execute("DROP TABLE IF EXISTS %s" % self.table)
+
+    def q(self, kind, lookup, term, prefix=False):
+        if len(term) < self.MIN_TERM_LENGTH:
+            return super(FTSSearchBackend, self).q(kind, lookup, term, prefix=prefix)
+        # A quoted phrase of trigrams matches the term as substring; the
+        # column is not qualified, since the aliases of a subquery are relabeled.
+        entries = SearchIndexEntry.objects.filter(kind=kind)\
+                                          .extra(where=['text MATCH %s'],
+                                                 params=['"%s"' % term.replace('"', '""')])
+        if prefix:
+            entries = entries.filter(text__istartswith=term)
+        return Q(**{'%s__in' % id_lookup(lookup): entries.values('object_id')})
+
+    def remove(self, kind, pks):
+        cursor = self.connection.cursor()
+        for chunk in chunks(pks, INDEX_CHUNK_SIZE):
+            cursor.execute("DELETE FROM %s WHERE kind = %%s AND object_id IN (%s)" % (self.table,
+                                                                                   ','.join(['%s'] * len(chunk))),
+                           [kind] + list(chunk))
+
+    def index(self, kind, pairs):
+        cursor = self.connection.cursor()
+        for chunk in chunks(pairs, INDEX_CHUNK_SIZE):
+            self.remove(kind, [pk for (pk, text) in chunk])
+            cursor.executemany("INSERT INTO %s (kind, object_id, text) VALUES (%%s, %%s, %%s)" % self.table,
+                               [(kind, pk, text) for (pk, text) in chunk if text])
+
+    def clear(self, kind):
+        self.connection.cursor().execute("DELETE FROM %s WHERE kind = %%s" % self.table, [kind])
+
+
+VENDOR_BACKENDS = {
+    'postgresql': TrigramSearchBackend,
+    'sqlite': FTSSearchBackend,
+}
+
+# database alias -> backend
+
+_backends = {}
+
+
+def get_search_backend(using=None, installing=False):
+    """
+    Return the search backend for the given database: the one configured in
+    ``MANTIS_ACTIONABLES_SEARCH_BACKEND`` or the one for the database vendor.
+    """
+    using = using or DEFAULT_DB_ALIAS
+    backend = _backends.get(using)
+    if backend is None:
+        connection = connections[using]
+        if MANTIS_ACTIONABLES_SEARCH_BACKEND:
+            mod_name, class_name = MANTIS_ACTIONABLES_SEARCH_BACKEND.rsplit('.',1)
+            backend_class = getattr(importlib.import_module(mod_name), class_name)
+        else:
+            backend_class = VENDOR_BACKENDS.get(connection.vendor, SearchBackend)
+        backend = backend_class(connection)
+        if installing:
+            return backend
+        if not backend.available():
+            logger.warning("Search backend %s not available, using plain lookups" % backend_class.__name__)
+            backend = SearchBackend(connection)
+        _backends[using] = backend
+    return backend
+
+
+def search_q(kind, lookup, term, using=None):
+    """
+    Q object for searching ``term`` in the column ``lookup`` that holds the
+    texts of the index ``kind``; a term ending with ``*`` is searched
+    as prefix, any other term as substring.
+    """
+    prefix = term.endswith('*')
+    if prefix:
+        term = term[:-1]
+    return get_search_backend(using).q(kind, lookup, term, prefix=prefix)
+
+
+def index_objects(kind, pks, using=None):
+    """
+    Write the objects of the given kind into the shadow index (if the
+    backend keeps one).
+    """
+    backend = get_search_backend(using)
+    if not backend.shadow_index:
+        return
+    model, field_name = SEARCH_INDEXES[kind]
+    for chunk in chunks(pks, INDEX_CHUNK_SIZE):
+        backend.index(kind, model.objects.filter(pk__in=chunk).values_list('pk', field_name))
+
+
+def unindex_objects(kind, pks, using=None):
+    backend = get_search_backend(using)
+    if backend.shadow_index:
+        backend.remove(kind, pks)
+
+
+@receiver(post_save, sender=SingletonObservable)
+def index_singleton_observable(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        index_objects('observable', [instance.pk], using=kwargs.get('using'))
+
+
+@receiver(post_save, sender=ImportInfo)
+def index_import_info(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_objects('import_info', [instance.pk], using=kwargs.get('using'))
+
+
+def is_report(iobject):
+    """
+    Is the InfoObject of one of the types that constitute STIX reports
+    (see ``MANTIS_ACTIONABLES_STIX_REPORT_FAMILY_AND_TYPES``)?
+    """
+    type_name = iobject.iobject_type.name
+    family_name = iobject.iobject_family.name
+    return any(report_filter['iobject_type'] == type_name and report_filter['iobject_type_family'] == family_name
+               for report_filter in MANTIS_ACTIONABLES_STIX_REPORT_FAMILY_AND_TYPES)
+
+
+@receiver(post_save, sender=InfoObject)
+def index_report(sender, instance, raw=False, **kwargs):
+    # InfoObjects are saved in bulk by the importers: only look at the
+    # type if there is a shadow index to write to. Outdated revisions
+    # may stay in the index, since the report tables exclude them anyway.
+    using = kwargs.get('using')
+    if not raw and get_search_backend(using).shadow_index and is_report(instance):
+        index_objects('report', [instance.pk], using=using)
+
+
+@receiver(post_delete, sender=SingletonObservable)
+def unindex_singleton_observable(sender, instance, **kwargs):
+    unindex_objects('observable', [instance.pk], using=kwargs.get('using'))
+
+
+@receiver(post_delete, sender=ImportInfo)
+def unindex_import_info(sender, instance, **kwargs):
+    unindex_objects('import_info', [instance.pk], using=kwargs.get('using'))
+
+
+@receiver(post_delete, sender=InfoObject)
+def unindex_report(sender, instance, **kwargs):
+    unindex_objects('report', [instance.pk], using=kwargs.get('using'))
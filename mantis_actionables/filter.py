@@ -23,7 +23,7 @@ from django.forms import widgets
 
 from dingos.filter import ExtendedDateRangeFilter,create_order_keyword_list
 
-from .models import Context, SingletonObservable, ImportInfo
+from .models import Context, SingletonObservable, ImportInfo, TaggedActionableItem
 
 from django.db.models import Q
 
@@ -95,6 +95,27 @@ class MultiFilter(Filter):
 class CharMultiFilter(MultiFilter):
     pass
 
+
+class TagMembershipFilter(django_filters.CharFilter):
+    """
+    Filter for objects carrying an actionable tag whose info name matches
+    the given value; the tagged objects are read from the tag membership
+    index rather than searched via joins on the tag names.
+    """
+
+    def filter(self, qs, value):
+        if isinstance(value, Lookup):
+            lookup = six.text_type(value.lookup_type)
+            value = value.value
+        else:
+            lookup = self.lookup_type
+        if value in ([], (), {}, None, ''):
+            return qs
+        q_obj = TaggedActionableItem.tagged_with_q(qs.model, **{'info__name__%s' % lookup: value})
+        if self.exclude:
+            return qs.exclude(q_obj)
+        return qs.filter(q_obj)
+
 class ActionablesContextFilter(django_filters.FilterSet):
 
     name = django_filters.CharFilter(lookup_type='icontains',
@@ -168,8 +189,8 @@ class ExtendedSingletonObservablesFilter(django_filters.FilterSet):
     value = django_filters.CharFilter(lookup_type='icontains',
                                               label='Value contains')
 
-    actionable_tags__info__name = django_filters.CharFilter(lookup_type='icontains',
-                                              label='Tag contains')
+    actionable_tags__info__name = TagMembershipFilter(lookup_type='icontains',
+                                                      label='Tag contains')
 
 
     sources__import_info__name__OR__sources__top_level_iobject_identifier__latest__name = CharMultiFilter(lookup_type='icontains',
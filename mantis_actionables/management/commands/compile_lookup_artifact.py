@@ -0,0 +1,72 @@
+# Copyright (c) Siemens AG, 2015
+#
+# This file is part of MANTIS.  MANTIS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either version 2
+# of the License, or(at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mantis_actionables.core.lookup_compiler import compile_lookup_artifact, CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    """
+    Compile the active observables into the memory-mapped lookup artifact.
+    """
+    help = 'Compile the active observables into the lookup artifact (incrementally, if a previous artifact exists)'
+
+    option_list = BaseCommand.option_list + ( make_option('--path',
+                    action='store',
+                    dest='path',
+                    default=None,
+                    help='Path of the artifact (default: MANTIS_ACTIONABLES_LOOKUP_ARTIFACT_PATH)'),
+
+                    make_option('--full',
+                    action='store_true',
+                    dest='full',
+                    default=False,
+                    help='Rebuild the artifact from scratch instead of updating the previous one'),
+
+                    make_option('--bloom-bits-per-entry',
+                    action='store',
+                    type='int',
+                    dest='bloom_bits_per_entry',
+                    default=0,
+                    help='Size of the Bloom filter written into the artifact (0: no Bloom filter)'),
+
+                    make_option('--chunk-size',
+                    action='store',
+                    type='int',
+                    dest='chunk_size',
+                    default=CHUNK_SIZE,
+                    help='Number of observables read per query'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 0:
+            raise CommandError("Wrong arguments.")
+
+        try:
+            result = compile_lookup_artifact(path=options.get('path'),
+                                             full=options.get('full'),
+                                             bloom_bits_per_entry=options.get('bloom_bits_per_entry'),
+                                             chunk_size=options.get('chunk_size'))
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write("Compiled version %s of the lookup artifact with %s entries (%s)." % (
+            result['version'], result['entries'],
+            'full build' if result['full'] else '%s changed observables' % result['changed']))
@@ -24,7 +24,10 @@ from mantis_actionables.core.crowdstrike import import_crowdstrike_csv
 
 from dingos.models import TaggingHistory
 from taggit.models import Tag
-from mantis_actionables.models import ActionableTag, ActionableTaggingHistory, Context, TagInfo, SingletonObservable
+from django.contrib.contenttypes.models import ContentType
+
+from mantis_actionables.models import ActionableTag, ActionableTaggingHistory, Context, TagInfo, SingletonObservable, \
+    TaggedActionableItem
 
 class Command(BaseCommand):
     """
@@ -40,19 +43,13 @@ class Command(BaseCommand):
 
         for tag_info in tags_to_delete:
             print "Treating %s" % tag_info
-            affected_sos = SingletonObservable.objects.filter(actionable_tags_cache__contains=':%s' % tag_info)
-            print "Found affected sos %s" % affected_sos
-            for affected_so in affected_sos:
-                at_cache = affected_so.actionable_tags_cache
-                print "Existing cache  %s" % at_cache
-                tags = at_cache.split(',')
-                new_cache = []
-                for tag in tags:
-                    if not (':%s' % tag_info) in tag:
-                        new_cache.append(tag)
-                new_cache = ','.join(new_cache)
-                print "New cache  %s" % new_cache
-                affected_so.actionable_tags_cache=new_cache
-                affected_so.save()
+            # Look up the affected singleton observables in the tag membership index
+            affected_so_pks = set(TaggedActionableItem.objects.filter(tag__info__name=tag_info,
+                                                                      content_type=ContentType.objects.get_for_model(SingletonObservable))\
+                                                              .values_list('object_id',flat=True))
+            print "Found %s affected singleton observables" % len(affected_so_pks)
 
+            # Deleting the tag info also deletes the tags and their tagged items
             TagInfo.objects.filter(name=tag_info).delete()
+
+            SingletonObservable.update_actionable_tags_cache(affected_so_pks)
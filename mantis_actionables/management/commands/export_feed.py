@@ -0,0 +1,85 @@
+# Copyright (c) Siemens AG, 2015
+#
+# This file is part of MANTIS.  MANTIS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either version 2
+# of the License, or(at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import sys
+import gzip
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mantis_actionables.core.exports import export_lines, check_export, ExportError
+
+
+class Command(BaseCommand):
+    """
+    Write the blocklist of the active observables of a kind (or the bundle of
+    IDS signatures) to a file or to stdout.
+    """
+    args = '<kind>'
+    help = 'Export the active observables of a kind (see MANTIS_ACTIONABLES_EXPORT_KINDS, or "ids")'
+
+    option_list = BaseCommand.option_list + ( make_option('--format',
+                    action='store',
+                    dest='output_format',
+                    default='txt',
+                    help='Output format: txt (one value per line), csv or rules'),
+
+                    make_option('--subtype',
+                    action='store',
+                    dest='subtype',
+                    default=None,
+                    help='Only export observables of the given subtype (e.g., MD5)'),
+
+                    make_option('--output',
+                    action='store',
+                    dest='output',
+                    default=None,
+                    help='File to write to (default: stdout)'),
+
+                    make_option('--gzip',
+                    action='store_true',
+                    dest='gzip',
+                    default=False,
+                    help='Compress the output file with gzip'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Wrong arguments.")
+        kind = args[0]
+        output_format = options.get('output_format')
+        try:
+            check_export(kind, output_format)
+        except ExportError as e:
+            raise CommandError(str(e))
+
+        output = options.get('output')
+        if options.get('gzip'):
+            if not output:
+                raise CommandError("--gzip requires --output")
+            out = gzip.open(output, 'wb')
+        elif output:
+            out = open(output, 'wb')
+        else:
+            out = sys.stdout
+
+        try:
+            for line in export_lines(kind, output_format, subtype=options.get('subtype')):
+                out.write(line)
+        finally:
+            if out is not sys.stdout:
+                out.close()
@@ -21,7 +21,8 @@ from datetime import datetime
 from optparse import make_option
 from django.core.management.base import BaseCommand, CommandError
 
-from ...mantis_import import process_STIX_Reports, import_singleton_observables_from_STIX_iobjects
+from ...mantis_import import process_STIX_Reports, process_STIX_Reports_since_last_run, \
+    import_singleton_observables_from_STIX_iobjects, import_STIX_reports_in_parallel
 
 class Command(BaseCommand):
     """
@@ -43,16 +44,38 @@ class Command(BaseCommand):
                     default=[],
                     help='List of pks of information objects representing Top-Level STIX reports from which'
                          ' actionables are to be extracted into mantis_actionables.'),
+
+                    make_option('--since-last-run',
+                    action='store_true',
+                    dest='since_last_run',
+                    default=False,
+                    help='Import all reports that have not been imported by a previous run;'
+                         ' concurrent runs are skipped.'),
+
+                    make_option('--parallel',
+                    action='store_true',
+                    dest='parallel',
+                    default=False,
+                    help='Import reports in parallel: via Celery, if a broker is configured, otherwise'
+                         ' via a local pool of processes.'),
+
+                    make_option('--workers',
+                    action='store',
+                    type='int',
+                    dest='workers',
+                    default=None,
+                    help='Number of local processes used by --parallel (default: number of CPUs)'),
     )
 
     def handle(self, *args, **options):
         if len(args) != 0:
             raise CommandError("Wrong arguments.")
-        if not options.get('top_level_iobj_pks') and not options.get('timeframe'):
-            raise CommandError("Neither timeframe nor list of pks specified.")
+        modes = [x for x in ['top_level_iobj_pks','timeframe','since_last_run'] if options.get(x)]
+        if not modes:
+            raise CommandError("Neither timeframe, list of pks nor --since-last-run specified.")
 
-        if options.get('top_level_iobj_pks') and options.get('timeframe'):
-            raise CommandError("Specify either timeframe or list of pks")
+        if len(modes) > 1:
+            raise CommandError("Specify either timeframe, list of pks or --since-last-run")
 
 
         if options.get('timeframe'):
@@ -66,10 +89,31 @@ class Command(BaseCommand):
                 raise CommandError("wrong from_timestamp format, use Y-M-D H:M:S")
 
 
-            process_STIX_Reports(from_time,to_time)
+            result = process_STIX_Reports(from_time,to_time,
+                                          parallel=options.get('parallel'),
+                                          workers=options.get('workers'))
+            if options.get('parallel'):
+                self.report_failures(result)
+
+        elif options.get('since_last_run'):
+            imported_count = process_STIX_Reports_since_last_run()
+            if imported_count is None:
+                self.stdout.write("Another import is running; nothing done.")
+            else:
+                self.stdout.write("Imported %s reports." % imported_count)
 
         elif options.get('top_level_iobj_pks'):
             top_level_iobj_pks = map(int,options.get('top_level_iobj_pks'))
-            import_singleton_observables_from_STIX_iobjects(top_level_iobj_pks)
+            if options.get('parallel'):
+                result = import_STIX_reports_in_parallel(top_level_iobj_pks,
+                                                         workers=options.get('workers'))
+                self.report_failures(result)
+            else:
+                import_singleton_observables_from_STIX_iobjects(top_level_iobj_pks)
+
+    def report_failures(self, result):
+        for pk, error in sorted(result.items()):
+            if error:
+                self.stderr.write("Import of report %s failed: %s" % (pk, error))
 
 
@@ -36,6 +36,29 @@ class Command(BaseCommand):
             default=None,
             help='CSV File with Crowdstrike data to import'
         ),
+        make_option(
+            '--chunk-size',
+            action='store',
+            type='int',
+            dest='chunk_size',
+            default=None,
+            help='Number of rows to be imported and committed together'
+        ),
+        make_option(
+            '--restart',
+            action='store_true',
+            dest='restart',
+            default=False,
+            help='Import the file from the start, even if an earlier import of it was interrupted'
+        ),
+        make_option(
+            '--workers',
+            action='store',
+            type='int',
+            dest='workers',
+            default=None,
+            help='Number of processes importing the file; the rows are partitioned between them by indicator'
+        ),
     )
 
     def handle(self, *args, **options):
@@ -48,7 +71,11 @@ class Command(BaseCommand):
         if not os.path.isfile(csv_file):
             raise CommandError('"%s" cannot be accessed!' % csv_file)
 
-        ignored_lines = import_crowdstrike_csv(csv_file, printing=True)
+        ignored_lines = import_crowdstrike_csv(csv_file,
+                                               printing=True,
+                                               chunk_size=options.get('chunk_size'),
+                                               resume=not options.get('restart'),
+                                               workers=options.get('workers'))
         print ignored_lines
 
         print 'file imported'
\ No newline at end of file
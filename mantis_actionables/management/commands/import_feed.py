@@ -0,0 +1,95 @@
+# Copyright (c) Siemens AG, 2015
+#
+# This file is part of MANTIS.  MANTIS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either version 2
+# of the License, or(at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+from optparse import make_option
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mantis_actionables import MANTIS_ACTIONABLES_FEEDS
+from mantis_actionables.core.feeds import import_feed
+
+
+class Command(BaseCommand):
+    """
+    This class implements the command for importing indicator feeds
+    defined in MANTIS_ACTIONABLES_FEEDS (CSV or JSON-lines files)
+    """
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--feed',
+            action='store',
+            dest='feed',
+            default=None,
+            help='Name of the feed (as defined in MANTIS_ACTIONABLES_FEEDS)'
+        ),
+        make_option(
+            '-f',
+            '--file',
+            action='store',
+            dest='file',
+            default=None,
+            help='File with feed data to import'
+        ),
+        make_option(
+            '--chunk-size',
+            action='store',
+            type='int',
+            dest='chunk_size',
+            default=None,
+            help='Number of rows to be imported and committed together'
+        ),
+        make_option(
+            '--restart',
+            action='store_true',
+            dest='restart',
+            default=False,
+            help='Import the file from the start, even if an earlier import of it was interrupted'
+        ),
+        make_option(
+            '--workers',
+            action='store',
+            type='int',
+            dest='workers',
+            default=None,
+            help='Number of processes importing the file; the rows are partitioned between them by indicator'
+        ),
+    )
+
+    def handle(self, *args, **options):
+        feed = options.get('feed')
+        if not feed in MANTIS_ACTIONABLES_FEEDS:
+            raise CommandError('no or unknown feed given; known feeds are: %s' % ", ".join(sorted(MANTIS_ACTIONABLES_FEEDS.keys())))
+
+        if not options.get('file'):
+            raise CommandError('no file given')
+
+        path = options.get('file')
+        print 'importing file: %s' % path
+
+        if not os.path.isfile(path):
+            raise CommandError('"%s" cannot be accessed!' % path)
+
+        ignored_lines = import_feed(feed,
+                                    path,
+                                    printing=True,
+                                    chunk_size=options.get('chunk_size'),
+                                    resume=not options.get('restart'),
+                                    workers=options.get('workers'))
+        print ignored_lines
+
+        print 'file imported'
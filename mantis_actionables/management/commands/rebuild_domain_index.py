@@ -0,0 +1,63 @@
+# Copyright (c) Siemens AG, 2015
+#
+# This file is part of MANTIS.  MANTIS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either version 2
+# of the License, or(at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mantis_actionables import MANTIS_ACTIONABLES_DOMAIN_TYPES
+from mantis_actionables.models import SingletonObservable, DomainSuffix
+from mantis_actionables.core.observables import chunks
+from mantis_actionables.core.domains import index_domains
+
+
+class Command(BaseCommand):
+    """
+    Backfill the suffix index of the domains of FQDN, URL and email address observables.
+    """
+    help = 'Rebuild the domain suffix index of FQDN, URL and email address observables'
+
+    option_list = BaseCommand.option_list + ( make_option('--missing-only',
+                    action='store_true',
+                    dest='missing_only',
+                    default=False,
+                    help='Only index observables that are not in the index yet'),
+
+                    make_option('--chunk-size',
+                    action='store',
+                    type='int',
+                    dest='chunk_size',
+                    default=1000,
+                    help='Number of observables indexed per query'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 0:
+            raise CommandError("Wrong arguments.")
+
+        observables = SingletonObservable.objects.filter(type__name__in=MANTIS_ACTIONABLES_DOMAIN_TYPES.keys())
+        if options.get('missing_only'):
+            observables = observables.filter(domain_suffix__isnull=True)
+        else:
+            DomainSuffix.objects.all().delete()
+
+        count = 0
+        for chunk in chunks(observables.order_by('pk').values_list('pk','type__name','value').iterator(),
+                            options.get('chunk_size')):
+            count += index_domains(chunk)
+
+        self.stdout.write("Indexed the domains of %s observables." % count)
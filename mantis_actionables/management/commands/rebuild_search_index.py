@@ -0,0 +1,78 @@
+# Copyright (c) Siemens AG, 2015
+#
+# This file is part of MANTIS.  MANTIS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either version 2
+# of the License, or(at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from mantis_actionables.mantis_import import stix_reports_queryset
+from mantis_actionables.core.observables import chunks
+from mantis_actionables.core.search import SEARCH_INDEXES, get_search_backend
+
+
+class Command(BaseCommand):
+    """
+    Fill the shadow search index (used on databases without trigram indexes)
+    with all observables, reports and import infos.
+    """
+    help = 'Rebuild the search index of observable values, report names and import info names'
+
+    option_list = BaseCommand.option_list + ( make_option('--kind',
+                    action='append',
+                    dest='kinds',
+                    default=[],
+                    help='Rebuild only the given index (%s); can be given several times' % ", ".join(sorted(SEARCH_INDEXES.keys()))),
+
+                    make_option('--chunk-size',
+                    action='store',
+                    type='int',
+                    dest='chunk_size',
+                    default=1000,
+                    help='Number of objects indexed per query'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 0:
+            raise CommandError("Wrong arguments.")
+
+        kinds = options.get('kinds') or sorted(SEARCH_INDEXES.keys())
+        for kind in kinds:
+            if not kind in SEARCH_INDEXES:
+                raise CommandError("Unknown index %s." % kind)
+
+        backend = get_search_backend()
+        if not backend.shadow_index:
+            self.stdout.write("The search backend %s does not keep a search index; nothing to do." % backend.__class__.__name__)
+            return
+
+        for kind in kinds:
+            model, field_name = SEARCH_INDEXES[kind]
+            if kind == 'report':
+                objects = stix_reports_queryset()
+            else:
+                objects = model.objects.all()
+
+            count = 0
+            with transaction.atomic():
+                backend.clear(kind)
+                for pairs in chunks(objects.order_by('pk').values_list('pk', field_name).iterator(),
+                                    options.get('chunk_size')):
+                    backend.index(kind, pairs)
+                    count += len(pairs)
+
+            self.stdout.write("Indexed %s objects of kind %s." % (count, kind))
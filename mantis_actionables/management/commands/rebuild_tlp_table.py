@@ -0,0 +1,62 @@
+# Copyright (c) Siemens AG, 2015
+#
+# This file is part of MANTIS.  MANTIS is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either version 2
+# of the License, or(at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dingos.models import InfoObject
+
+from mantis_actionables.models import InfoObjectTLP
+from mantis_actionables.core.observables import chunks
+
+
+class Command(BaseCommand):
+    """
+    Backfill the materialized InfoObject -> TLP table.
+    """
+    help = 'Rebuild the materialized mapping of InfoObjects to TLP colors'
+
+    option_list = BaseCommand.option_list + ( make_option('--missing-only',
+                    action='store_true',
+                    dest='missing_only',
+                    default=False,
+                    help='Only materialize InfoObjects that are not in the table yet'),
+
+                    make_option('--chunk-size',
+                    action='store',
+                    type='int',
+                    dest='chunk_size',
+                    default=1000,
+                    help='Number of InfoObjects materialized per query'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 0:
+            raise CommandError("Wrong arguments.")
+
+        iobjects = InfoObject.objects.all()
+        if options.get('missing_only'):
+            iobjects = iobjects.filter(actionables_tlp__isnull=True)
+
+        count = 0
+        for iobject_pks in chunks(iobjects.order_by('pk').values_list('pk',flat=True).iterator(),
+                                  options.get('chunk_size')):
+            InfoObjectTLP.materialize(iobject_pks)
+            count += len(iobject_pks)
+
+        self.stdout.write("Materialized TLP information of %s information objects." % count)
@@ -37,9 +37,13 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
 
         if args and args[0] == 'doit':
-            outdate_sources(simulate=False)
+            report = outdate_sources(simulate=False)
         else:
             print "Simulating only"
-            outdate_sources()
+            report = outdate_sources()
+
+        print "Outdated sources: %s" % len(report['outdated_source_pks'])
+        for entry in report['outdated_tags']:
+            print "%s: %s for %s" % (entry['identifier'], entry['context_name_pairs'], entry['singleton_pks'])
 
 
@@ -17,10 +17,12 @@
 # Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 #
 
+import os
 import re
+import uuid
+import socket
 import logging
-
-from json import dumps
+import multiprocessing
 
 from dingos.graph_utils import dfs_preorder_nodes
 
@@ -29,17 +31,26 @@ from datetime import timedelta
 from itertools import chain
 
 from django.utils import timezone
+from django.conf import settings
+from django.contrib.auth.models import User
 
 from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
 from django.contrib.contenttypes.models import ContentType
 
+from django.db import connections
 from django.db.models import Q,F
 
-from dingos.models import InfoObject,Fact,TaggingHistory
+from celery import group
+
+from taggit.models import Tag
+
+from dingos.models import InfoObject,Fact,TaggingHistory,Identifier
 from dingos.view_classes import POSTPROCESSOR_REGISTRY
 from dingos.graph_traversal import follow_references, annotate_graph
 
-from . import MANTIS_ACTIONABLES_ACTIVE_EXPORTERS, MANTIS_ACTIONABLES_STIX_REPORT_FAMILY_AND_TYPES, MANTIS_ACTIONABLES_CONTEXT_TAG_REGEX
+from . import MANTIS_ACTIONABLES_ACTIVE_EXPORTERS, MANTIS_ACTIONABLES_STIX_REPORT_FAMILY_AND_TYPES, MANTIS_ACTIONABLES_CONTEXT_TAG_REGEX, \
+    MANTIS_ACTIONABLES_IMPORT_LEASE_SECONDS, MANTIS_ACTIONABLES_IMPORT_WATERMARK_OVERLAP_SECONDS, \
+    MANTIS_ACTIONABLES_IMPORT_MAX_ATTEMPTS, MANTIS_ACTIONABLES_PARALLEL_IMPORT_CHUNK_SIZE
 from .models import SingletonObservable,\
     SingletonObservableType, \
     SingletonObservableSubtype, \
@@ -47,12 +58,19 @@ from .models import SingletonObservable,\
     Status2X, \
     Action, \
     ActionableTag, \
+    TaggedActionableItem, \
     STIX_Entity, \
-    EntityType
+    EntityType, \
+    ImportLedgerEntry, \
+    ImportWatermark, \
+    InfoObjectTLP, \
+    grouped_update
 
-from .status_management import updateStatus, createSourceMetaData
+from .status_management import update_status_batch, createSourceMetaData
+from .core.observables import resolve_singleton_observables, normalize_triple, chunks
+from .core.entities import resolve_stix_entities
 
-from tasks import async_export_to_actionables
+from tasks import async_export_to_actionables, async_import_stix_reports
 
 logger = logging.getLogger(__name__)
 
@@ -105,59 +123,97 @@ def determine_matching_dingos_history_entry(action_flag,user,dingos_tag_name,fac
     the comment was derived from the Dingos tag history.)
     """
 
+    return determine_matching_dingos_history_entries([(action_flag,dingos_tag_name,fact_pks)],user)[0]
+
+
+def determine_matching_dingos_history_entries(requests,user=None):
+    """
+    Bulk variant of ``determine_matching_dingos_history_entry``.
+
+    ``requests`` is a list of triples ``(action_flag, dingos_tag_name, fact_pks)``;
+    the function returns a list with a pair ``(user,comment)`` for each request,
+    exactly as ``determine_matching_dingos_history_entry`` would return it for the
+    request.
+
+    All requests are answered from a single query of the Dingos tag history,
+    ordered by tag and timestamp.
+    """
+
     fact_content_type = ContentType.objects.get_for_model(Fact)
 
     just_now = timezone.now() - timedelta(milliseconds=2500)
 
-    comment = ''
+    requests = [(action_flag, dingos_tag_name, set(fact_pks)) for (action_flag, dingos_tag_name, fact_pks) in requests]
+
+    if not requests:
+        return []
 
-    result_user = None
+    history_entries = TaggingHistory.objects.filter(action__in = set(x[0] for x in requests),
+                                                    tag__name__in = set(x[1] for x in requests),
+                                                    object_id__in = set(chain(*[x[2] for x in requests])),
+                                                    content_type = fact_content_type)
 
     if user:
         # If a user has been provided to the function, the function has been
         # called during a tagging operation carried out by a user rather than
         # an import run: hence we look through history entries by that
-        # particular user:
+        # particular user; otherwise, we just look for the most recent history
+        # entries concerning the tags.
+        history_entries = history_entries.filter(user=user)
 
-        likely_dingos_tag_history_entries = TaggingHistory.objects.filter(user=user,
-                                                                          action = action_flag,
-                                                                          tag__name = dingos_tag_name,
-                                                                          object_id__in = fact_pks,
-                                                                          content_type = fact_content_type).order_by('-timestamp')
-    else:
-        # otherwise, we just look for the most recent history entries concerning that particular
-        # tag
-        likely_dingos_tag_history_entries = TaggingHistory.objects.filter(action = action_flag,
-                                                                          tag__name = dingos_tag_name,
-                                                                          object_id__in = fact_pks,
-                                                                          content_type = fact_content_type).order_by('-timestamp')
-
-
-    if likely_dingos_tag_history_entries:
-        likely_matching_entry = likely_dingos_tag_history_entries[0]
-        if user and likely_matching_entry.timestamp >= just_now:
-            # If we find a tag history item due to the current user and
-            # really really recent, we can be very sure that this is really
-            # the history item that caused the tag change
-            comment = likely_matching_entry.comment
-        else:
-            # Otherwise, we at least inform the reader that the comment
-            # was derived
-            if likely_matching_entry.comment:
+    # Mapping from (tag name, action) to the history entries, most recent first
+
+    entry_map = {}
+    for entry in history_entries.order_by('tag__name','-timestamp').values('tag__name',
+                                                                          'action',
+                                                                          'object_id',
+                                                                          'timestamp',
+                                                                          'comment',
+                                                                          'user_id'):
+        entry_map.setdefault((entry['tag__name'],entry['action']),[]).append(entry)
+
+    users = User.objects.in_bulk(set(x['user_id'] for x in chain(*entry_map.values()) if x['user_id']))
+
+    result = []
+
+    for (action_flag, dingos_tag_name, fact_pks) in requests:
 
-                comment = "%s (Comment and user derived automatically from DINGOS tag)" % likely_matching_entry.comment
-                result_user = likely_matching_entry.user
+        comment = ''
 
+        result_user = None
+
+        likely_matching_entry = None
+        for entry in entry_map.get((dingos_tag_name,action_flag),[]):
+            if entry['object_id'] in fact_pks:
+                likely_matching_entry = entry
+                break
+
+        if likely_matching_entry:
+            entry_user = users.get(likely_matching_entry['user_id'])
+            if user and likely_matching_entry['timestamp'] >= just_now:
+                # If we find a tag history item due to the current user and
+                # really really recent, we can be very sure that this is really
+                # the history item that caused the tag change
+                comment = likely_matching_entry['comment']
             else:
-                comment = ""
-        if (not result_user) and likely_matching_entry.user and likely_matching_entry.user != user:
-            result_user = likely_matching_entry.user
-            comment = "(User derived automatically from DINGOS tag history)"
-        if user and not result_user:
-            result_user = user
+                # Otherwise, we at least inform the reader that the comment
+                # was derived
+                if likely_matching_entry['comment']:
+
+                    comment = "%s (Comment and user derived automatically from DINGOS tag)" % likely_matching_entry['comment']
+                    result_user = entry_user
 
+                else:
+                    comment = ""
+            if (not result_user) and entry_user and entry_user != user:
+                result_user = entry_user
+                comment = "(User derived automatically from DINGOS tag history)"
+            if user and not result_user:
+                result_user = user
 
-    return (result_user,comment)
+        result.append((result_user,comment))
+
+    return result
 
 
 def update_and_transfer_tag_action_to_dingos(action, context_name_set, affected_singleton_pks,user=None,comment=''):
@@ -191,49 +247,97 @@ def update_and_transfer_tag_action_to_dingos(action, context_name_set, affected_
 
     - comment (optional): will be used in tagging history in Dingos.
 
+    The tags of all affected facts are added/removed with a single bulk insert/delete
+    on the tagging table, the history is written in batches of facts with
+    the same changed tags, and the dingos tags stored with the singleton
+    observables are rewritten with one update per distinct value.
+
     """
 
     if not user:
         logger.critical("No user provided when trying to transfer tags %s from actionables to dingos" % context_name_set)
         return
 
-    affected_singletons = SingletonObservable.objects.filter(id__in=affected_singleton_pks)
+    affected_singleton_pks = set(affected_singleton_pks)
+
+    affected_fact_ids = set(Source.objects.filter(content_type=CONTENT_TYPE_SINGLETON_OBSERVABLE,
+                                                  object_id__in=affected_singleton_pks)\
+                                          .exclude(iobject_fact__isnull=True)\
+                                          .values_list('iobject_fact_id',flat=True))
+
+    # First, we fix the the tags in the Dingos world. We work directly
+    # on the through model of the tag manager of facts, so that all facts
+    # are treated with a constant number of queries.
 
-    affected_fact_ids = set(SingletonObservable.objects.filter(id__in=affected_singleton_pks).values_list('sources__iobject_fact',flat=True))
+    through = Fact.tags.through
+    fact_field = 'object_id' if 'object_id' in [x.name for x in through._meta.fields] else 'content_object'
 
-    affected_facts = Fact.objects.filter(pk__in=affected_fact_ids)
+    tags = dict(Tag.objects.filter(name__in=context_name_set).values_list('name','pk'))
+    if action == 'add':
+        for tag_name in set(context_name_set).difference(tags.keys()):
+            tags[tag_name] = Tag.objects.get_or_create(name=tag_name)[0].pk
 
+    tag_pk2name = dict((pk, name) for (name, pk) in tags.items())
+
+    light_facts = [Fact(pk=pk) for pk in affected_fact_ids]
+
+    if light_facts and tags:
+        tagged_facts = through.objects.filter(tag_id__in=tags.values(),
+                                              **through.bulk_lookup_kwargs(light_facts))
+        existing_pairs = set(tagged_facts.values_list(fact_field,'tag_id'))
 
-    # First, we fix the the tags in the Dingos world
-    for affected_fact in affected_facts:
-        existing_tags = set(affected_fact.tags.all())
         if action == 'add':
-            changed_tags = context_name_set.difference(existing_tags)
-            affected_fact.tags.add(*context_name_set)
+            changed_pairs = set((fact_pk, tag_pk) for fact_pk in affected_fact_ids
+                                for tag_pk in tags.values()).difference(existing_pairs)
+            fact_map = dict((x.pk, x) for x in light_facts)
+            through.objects.bulk_create([through(tag_id=tag_pk, **through.lookup_kwargs(fact_map[fact_pk]))
+                                         for (fact_pk, tag_pk) in changed_pairs])
         elif action == 'remove':
-            changed_tags = existing_tags.difference(context_name_set)
-            affected_fact.tags.remove(*context_name_set)
+            changed_pairs = existing_pairs
+            tagged_facts.delete()
+        else:
+            changed_pairs = set()
 
-        TaggingHistory.bulk_create_tagging_history(action,changed_tags,[affected_fact],user,comment)
+        # Write the history: facts with the same changed tags are written as one batch
+
+        fact2changed_tags = {}
+        for (fact_pk, tag_pk) in changed_pairs:
+            fact2changed_tags.setdefault(fact_pk, set()).add(tag_pk2name[tag_pk])
+
+        changed_tags2facts = {}
+        for fact_pk, changed_tags in fact2changed_tags.items():
+            changed_tags2facts.setdefault(frozenset(changed_tags), []).append(fact_pk)
+
+        for changed_tags, fact_pks in changed_tags2facts.items():
+            TaggingHistory.bulk_create_tagging_history(action,
+                                                       sorted(changed_tags),
+                                                       Fact.objects.filter(pk__in=fact_pks),
+                                                       user,
+                                                       comment)
 
 
     # In order to support fast querying of all dingos tags associated with a SingletonObservable,
     # we maintain a list of these tags in the SingletonObservable -- that also has to be updated.
 
-    for singleton in affected_singletons:
-        if singleton.mantis_tags:
-            existing_tags = set(singleton.mantis_tags.split(','))
+    updated_mantis_tags = {}
+
+    for (singleton_pk, mantis_tags) in SingletonObservable.objects.filter(id__in=affected_singleton_pks)\
+                                                                  .values_list('pk','mantis_tags'):
+        if mantis_tags:
+            existing_tags = set(mantis_tags.split(','))
         else:
             existing_tags = set([])
         if action == 'add':
-            existing_tags.update(context_name_set)
+            updated_tags = existing_tags.union(context_name_set)
         elif action == 'remove':
-            existing_tags.difference_update(context_name_set)
+            updated_tags = existing_tags.difference(context_name_set)
+        else:
+            updated_tags = existing_tags
 
-        updated_tag_info = ",".join(existing_tags)
+        if updated_tags != existing_tags:
+            updated_mantis_tags[singleton_pk] = ",".join(sorted(updated_tags))
 
-        singleton.mantis_tags= updated_tag_info
-        singleton.save()
+    grouped_update(SingletonObservable.objects, 'mantis_tags', updated_mantis_tags)
 
 def update_and_transfer_tags(fact_pks,user=None):
 
@@ -284,6 +388,12 @@ def update_and_transfer_tags(fact_pks,user=None):
         thus transfers the addition/removal of a context in dingos into
         mantis_actionables.
 
+    All of this is done in batches: the tag changes are calculated in memory,
+    the stored dingos tags are written with one update per distinct value,
+    singletons with the same tag changes undergo a single batched status update,
+    and singletons for which the same context is added/removed with the same
+    user/comment are tagged with a single tag action.
+
     """
 
     # In case a status change is carried out, an action object will
@@ -311,107 +421,126 @@ def update_and_transfer_tags(fact_pks,user=None):
     logger.debug("Calculated fact2tag_map as %s" % fact2tag_map)
 
     # Find out all singleton observables in the mantis_actionables app that
-    # have a link to one of the facts via a source object
+    # have a link to one of the facts via a source object, together with
+    # the dingos tags hitherto recorded for them and the facts of all their sources
+
+    singleton2mantis_tags = dict(SingletonObservable.objects.filter(sources__iobject_fact__in=fact_pks)\
+                                 .values_list('pk','mantis_tags').distinct())
+
+    singleton2fact_ids = {}
+    for (object_id, fact_id) in Source.objects.filter(content_type=CONTENT_TYPE_SINGLETON_OBSERVABLE,
+                                                      object_id__in=singleton2mantis_tags.keys())\
+                                              .values_list('object_id','iobject_fact_id'):
+        singleton2fact_ids.setdefault(object_id, set()).add(fact_id)
 
-    affected_singletons = SingletonObservable.objects.filter(sources__iobject_fact__in=fact_pks).prefetch_related('sources')
+    # Calculate the tag changes for all singleton observables in memory
 
-    # Update tag information in mantis_actionables for each of these
-    # singleton observables
+    updated_mantis_tags = {}
+    tag_changes = {}
 
-    for singleton in affected_singletons:
-        logger.debug("Transfer of tags: treating singleton observable with pk %s" % singleton.pk)
+    for singleton_pk, mantis_tags in singleton2mantis_tags.items():
+        logger.debug("Transfer of tags: treating singleton observable with pk %s" % singleton_pk)
         # Determine the facts associated with this singleton
-        fact_ids = set(map(lambda x: x.iobject_fact_id, singleton.sources.all()))
+        fact_ids = singleton2fact_ids.get(singleton_pk, set())
 
         # Use the fact2tag_map to determine all mantis tags associated with the
         # singleton
 
-        logger.debug("Found the following fact ids associated with the singleton: %s" % fact_ids)
-
         found_tags = set(chain(*map(lambda x: fact2tag_map.get(x,[]),fact_ids)))
 
-        logger.debug("Found the following mantis tags: %s" % found_tags)
-
         # Extract the mantis tags that have been stored in mantis_actionables
 
-        if singleton.mantis_tags:
-            existing_tags = set(singleton.mantis_tags.split(','))
+        if mantis_tags:
+            existing_tags = set(mantis_tags.split(','))
         else:
             existing_tags = set([])
 
-        logger.debug("Hitherto recorded dingos tags in mantis_actionables: %s" % existing_tags)
-
         # calculate added and removed tags
 
         added_tags = found_tags.difference(existing_tags)
-
-        logger.debug("Added dingos tags: %s" % added_tags)
-
         removed_tags = existing_tags.difference(found_tags)
 
-        logger.debug("Removed dingos tags: %s" % removed_tags)
-
-
         if added_tags or removed_tags:
+            logger.debug("Singleton %s: added dingos tags %s, removed dingos tags %s" % (singleton_pk,
+                                                                                         added_tags,
+                                                                                         removed_tags))
 
             # Tags have been added or removed: we store the current list
             # of dingos tags with the singleton observable.
 
-            updated_tag_info = list(found_tags)
-            updated_tag_info.sort()
+            updated_mantis_tags[singleton_pk] = ",".join(sorted(found_tags))
 
-            updated_tag_info = ",".join(updated_tag_info)
+            tag_changes[singleton_pk] = (frozenset(fact_ids), added_tags, removed_tags)
 
-            singleton.mantis_tags= updated_tag_info
-            singleton.save()
+    if not tag_changes:
+        return
 
-            # We may have to update the status
+    grouped_update(SingletonObservable.objects, 'mantis_tags', updated_mantis_tags)
 
-            singleton.update_status(update_function=updateStatus,
-                                    action=action,
-                                    user=user,
-                                    added_tags=added_tags,
-                                    removed_tags=removed_tags)
+    # We may have to update the status: singletons with the same
+    # tag changes are treated in one batch.
 
-        # Check if any of the added/removed dingos tag is matching the context pattern.
-        # If it is, transfer the change into the set of actionable tags associated with
-        # this singleton observable
+    status_update_groups = {}
+    for singleton_pk, (fact_ids, added_tags, removed_tags) in tag_changes.items():
+        status_update_groups.setdefault((frozenset(added_tags), frozenset(removed_tags)), []).append(singleton_pk)
 
-        if added_tags or removed_tags:
+    for (added_tags, removed_tags), singleton_pks in status_update_groups.items():
+        update_status_batch([(singleton_pk, None, []) for singleton_pk in singleton_pks],
+                            action=action,
+                            user=user,
+                            added_tags=set(added_tags),
+                            removed_tags=set(removed_tags))
+
+    # Check if any of the added/removed dingos tag is matching the context pattern.
+    # If it is, transfer the change into the set of actionable tags associated with
+    # the singleton observables. Singletons for which the same tag is added/removed
+    # with the same (derived) user and comment are treated by one tag action.
+
+    def is_context_tag(tag):
+        return any(regex.match(tag) for regex in MANTIS_ACTIONABLES_CONTEXT_TAG_REGEX)
+
+    context_tag_changes = []
+
+    for singleton_pk, (fact_ids, added_tags, removed_tags) in tag_changes.items():
+        for (tag_action, action_flag, tags) in [('add', TaggingHistory.ADD, added_tags),
+                                                ('remove', TaggingHistory.REMOVE, removed_tags)]:
+            for tag in tags:
+                if is_context_tag(tag):
+                    logger.debug("Found context tag %s (%s)" % (tag, tag_action))
+                    context_tag_changes.append((singleton_pk, tag_action, action_flag, tag, fact_ids))
+
+    # Determine the history information for all tag changes at once
+
+    history_keys = list(set((action_flag, tag, fact_ids)
+                            for (singleton_pk, tag_action, action_flag, tag, fact_ids) in context_tag_changes))
+    history_info = dict(zip(history_keys,
+                            determine_matching_dingos_history_entries(history_keys, user)))
+
+    tag_action_groups = {}
+
+    for (singleton_pk, tag_action, action_flag, tag, fact_ids) in context_tag_changes:
+        (result_user, comment) = history_info[(action_flag, tag, fact_ids)]
+        tag_action_groups.setdefault((tag_action, tag, result_user, comment), []).append(singleton_pk)
+
+    # Additions are carried out before removals
 
-            for tag in added_tags:
-                if any(regex.match(tag) for regex in MANTIS_ACTIONABLES_CONTEXT_TAG_REGEX):
-                    logger.debug("Found added special tag %s" % tag)
-                    (result_user,comment) = determine_matching_dingos_history_entry(TaggingHistory.ADD,
-                                                                                        user,
-                                                                                        tag,
-                                                                                        fact_ids)
-                    ActionableTag.bulk_action(action = 'add',
-                                              context_name_pairs=[(tag,tag)],
-                                              thing_to_tag_pks=[singleton.pk],
-                                              user=result_user,
-                                              comment=comment,
-                                              supress_transfer_to_dingos= True)
-            for tag in removed_tags:
-                if any(regex.match(tag) for regex in MANTIS_ACTIONABLES_CONTEXT_TAG_REGEX):
-                    logger.debug("Found context tag %s" % tag)
-                    (result_user,comment) = determine_matching_dingos_history_entry(TaggingHistory.REMOVE,
-                                                                                        user,
-                                                                                        tag,
-                                                                                        fact_ids)
-                    ActionableTag.bulk_action(action = 'remove',
-                                              context_name_pairs=[(tag,tag)],
-                                              thing_to_tag_pks=[singleton.pk],
-                                              user=result_user,
-                                              comment=comment,
-                                              supress_transfer_to_dingos= True)
+    for (tag_action, tag, result_user, comment) in sorted(tag_action_groups.keys(),
+                                                          key=lambda x: (x[0] != 'add', x[1])):
+        ActionableTag.bulk_action(action = tag_action,
+                                  context_name_pairs=[(tag,tag)],
+                                  thing_to_tag_pks=tag_action_groups[(tag_action, tag, result_user, comment)],
+                                  user=result_user,
+                                  comment=comment,
+                                  supress_transfer_to_dingos= True)
 
 
 
 def import_singleton_observables_from_STIX_iobjects(top_level_iobjs, user = None,
                                                     action_comment="Actionables Import",
                                                     tags_to_add = None,
-                                                    tagging_comment = ""):
+                                                    tagging_comment = "",
+                                                    action = None,
+                                                    run_outdate_sources = True):
     """
     Import basic indicators contained in STIX reports into Mantis Actionables
 
@@ -430,6 +559,12 @@ def import_singleton_observables_from_STIX_iobjects(top_level_iobjs, user = None
     - tagging_comment: Comment that should be used for tagging history (in case
       ``tags_to_add`` contains context names.)
 
+    - action: Action object with which the import is to be associated; if
+      none is given, the action is determined via ``action_comment``.
+
+    - run_outdate_sources: If False, ``outdate_sources`` is not called after
+      each report; the caller is then responsible for calling it.
+
     The function carries out the following actions:
 
     - For each object passed to the function, it determines the
@@ -499,7 +634,8 @@ def import_singleton_observables_from_STIX_iobjects(top_level_iobjs, user = None
 
     # Create an action with which this import will be associated
 
-    action, created_action = Action.objects.get_or_create(user=user,comment=action_comment)
+    if not action:
+        action, created_action = Action.objects.get_or_create(user=user,comment=action_comment)
 
     # Variable for collecting results
     results_per_top_level_obj = []
@@ -582,7 +718,8 @@ def import_singleton_observables_from_STIX_iobjects(top_level_iobjs, user = None
                                                         top_level_iobj_pk,
                                                         results,action=action,
                                                         user=user,
-                                                        graph=graph)
+                                                        graph=graph,
+                                                        run_outdate_sources=run_outdate_sources)
 
 def import_singleton_observables_from_export_result(top_level_iobj_identifier_pk,
                                                     top_level_iobj_pk,
@@ -590,6 +727,7 @@ def import_singleton_observables_from_export_result(top_level_iobj_identifier_pk
                                                     action=None,
                                                     user=None,
                                                     graph=None,
+                                                    run_outdate_sources=True,
                                                     ):
     """
     Import basic indicators found in a STIX-Report/Package into Mantis Actionables
@@ -633,6 +771,8 @@ def import_singleton_observables_from_export_result(top_level_iobj_identifier_pk
     - user: User carrying out the import (can be None)
     - graph: networkx-Graph from which the results were derived. If no
       graph is supplied, then one is generated as downward reachability graph
+    - run_outdate_sources: If False, ``outdate_sources`` is not called; this is
+      used by bulk imports that call it once after all reports have been imported.
 
 
     - The function extracts the set of all 'object.pk's. It then queries MANTIS for all
@@ -671,10 +811,6 @@ def import_singleton_observables_from_export_result(top_level_iobj_identifier_pk
 
     iobj2tlp_map = {}
 
-    # Mapping from identifier_pks to related_entities
-
-    identifier_pk_2_related_entity_map = {}
-
     # access graph node for top-level object
 
     top_level_node = graph.node[top_level_iobj_pk]
@@ -692,15 +828,35 @@ def import_singleton_observables_from_export_result(top_level_iobj_identifier_pk
 
     containing_iobj_pks = set(map(lambda x: x.get('_iobject_pk'), results))
 
-    # The TLP information is stored in markings
-    select_columns = ['identifier_id','marking_thru__marking__fact_thru__fact__fact_values__value']
-    color_qs = InfoObject.objects.filter(id__in=containing_iobj_pks)\
-        .filter(marking_thru__marking__fact_thru__fact__fact_term__term='Marking_Structure',
-                marking_thru__marking__fact_thru__fact__fact_term__attribute='color')\
-        .values_list(*select_columns)
+    # The TLP information is stored in markings; we read it from
+    # the materialized InfoObject -> TLP table.
+
+    for (identifier_id, color) in InfoObjectTLP.get_tlp_info(containing_iobj_pks, store=True).values():
+        if color:
+            iobj2tlp_map[identifier_id] = color.lower()
+
+    # Resolve the singleton observables for all results in bulk rather
+    # than one by one.
+
+    observable_triples = [(result.get('actionable_type',''),
+                           result.get('actionable_subtype',''),
+                           result.get('actionable_info','')) for result in results
+                          if result.get('actionable_type','') and result.get('actionable_info','')]
+
+    created_triples = set()
+    triple2observable_pk = resolve_singleton_observables(observable_triples,
+                                                         created_triples=created_triples)
+
+    # Resolve the related STIX entities (Indicators, Campaigns, ...) of all results
+    # at once: mapping from identifier_pks to related_entities
 
-    for iobject_tlp_info in color_qs:
-        iobj2tlp_map[iobject_tlp_info[0]] = iobject_tlp_info[1].lower()
+    identifier_pk_2_related_entity_map = resolve_stix_entities(chain(*[result['_relationship_info']
+                                                                       for result in results
+                                                                       if result.get('actionable_type','')
+                                                                       and result.get('actionable_info','')]),
+                                                               graph)
+
+    status_updates = []
 
     for result in results:
 
@@ -739,10 +895,17 @@ def import_singleton_observables_from_export_result(top_level_iobj_identifier_pk
         singleton_type_obj = SingletonObservableType.cached_objects.get_or_create(name=type)[0]
         singleton_subtype_obj = SingletonObservableSubtype.cached_objects.get_or_create(name=subtype)[0]
 
-        observable, observable_created = SingletonObservable.objects.get_or_create(type=singleton_type_obj,
-                                                                                   subtype=singleton_subtype_obj,
-                                                                        value=value)
+        observable_triple = normalize_triple((type,subtype,value))
+
+        observable = SingletonObservable(pk=triple2observable_pk[observable_triple],
+                                         type=singleton_type_obj,
+                                         subtype=singleton_subtype_obj,
+                                         value=value)
+        observable_created = observable_triple in created_triples
+
         if ids_rule:
+            # Adding the signature saves the observable, so we need the full object
+            observable = SingletonObservable.objects.get(pk=observable.pk)
             observable.add_ids_signature(signature_text=ids_rule)
 
         source, source_created = Source.objects.get_or_create(iobject_identifier_id=identifier_pk,
@@ -771,39 +934,9 @@ def import_singleton_observables_from_export_result(top_level_iobj_identifier_pk
             logger.debug("Created new source object")
 
 
-        entities=[]
-
-
-        for node in result['_relationship_info']:
-            essence_info = extract_essence(node, graph)
-
-            if not essence_info:
-                essence_info = None
-            else:
-                essence_info = dumps(essence_info)
-
-            if essence_info:
-                node_identifier_pk = node['identifier_pk']
-
-
-                entity = identifier_pk_2_related_entity_map.get(node_identifier_pk)
-
-                if not entity:
-                    entity_type, created = EntityType.cached_objects.get_or_create(name=node['iobject_type'])
-                    entity, created = STIX_Entity.objects.get_or_create(iobject_identifier_id=node_identifier_pk,
-                                                                        non_iobject_identifier='',
-                                                                        defaults={'essence': essence_info,
-                                                                                  'entity_type':entity_type})
-                    if not created:
-                        entity.essence = essence_info
-                        entity.entity_type = entity_type
-                        entity.save()
-
-                    identifier_pk_2_related_entity_map[node_identifier_pk] = entity
-
-
-                entities.append(entity)
-
+        entities = [identifier_pk_2_related_entity_map[node['identifier_pk']]
+                    for node in result['_relationship_info']
+                    if node['identifier_pk'] in identifier_pk_2_related_entity_map]
 
         source.related_stix_entities.clear()
 
@@ -819,12 +952,16 @@ def import_singleton_observables_from_export_result(top_level_iobj_identifier_pk
 
         else:
             logger.info("Existing Singleton Observable (%s,%s,%s) found" % (type,subtype,value))
-        observable.update_status(update_function=updateStatus,
-                                 action=action,
-                                 user=user,
-                                 source_obj = source,
-                                 related_entities = entities,
-                                 graph=graph)
+
+        status_updates.append((observable.pk, source, entities))
+
+    # Derive the new stati for all observables of this import at once;
+    # an observable that occurs several times undergoes a single status transition.
+
+    update_status_batch(status_updates,
+                        action=action,
+                        user=user,
+                        graph=graph)
 
     # An import may lead to outdated sources: picture the situation where
     # a certain observable was referenced by a given report, but is not
@@ -832,13 +969,144 @@ def import_singleton_observables_from_export_result(top_level_iobj_identifier_pk
     # just imported. The function ``outdate_sources`` catches such
     # outdated sources and treats them accordingly.
 
-    outdate_sources()
+    if run_outdate_sources:
+        outdate_sources(identifier_pks=[top_level_iobj_identifier_pk])
 
     fact_pks = set(map(lambda x: x.get('_fact_pk'), results))
     update_and_transfer_tags(fact_pks,user=user)
 
 
-def process_STIX_Reports(imported_since, imported_until=None):
+def import_STIX_report_chunk(top_level_iobj_pks, action_pk=None, user_pk=None):
+    """
+    Import the given STIX reports one after another, as done by the workers
+    of ``import_STIX_reports_in_parallel``. An error in one report does not
+    stop the import of the remaining reports.
+
+    Returns a dictionary mapping each report pk to ``None`` (success)
+    or to a description of the error that occurred.
+    """
+
+    user = User.objects.get(pk=user_pk) if user_pk else None
+    action = Action.objects.get(pk=action_pk) if action_pk else None
+
+    result = {}
+    for top_level_iobj_pk in top_level_iobj_pks:
+        try:
+            import_singleton_observables_from_STIX_iobjects([top_level_iobj_pk],
+                                                            user=user,
+                                                            action=action,
+                                                            run_outdate_sources=False)
+            result[top_level_iobj_pk] = None
+        except Exception as e:
+            logger.exception("Import of report %s failed" % top_level_iobj_pk)
+            result[top_level_iobj_pk] = "%s: %s" % (e.__class__.__name__, e)
+    return result
+
+
+def _import_STIX_report_chunk_star(args):
+    return import_STIX_report_chunk(*args)
+
+
+def celery_broker_configured():
+    return bool(getattr(settings, 'BROKER_URL', None)) and not getattr(settings, 'CELERY_ALWAYS_EAGER', False)
+
+
+def import_STIX_reports_in_parallel(top_level_iobj_pks, user=None,
+                                    action_comment="Actionables Import",
+                                    workers=None,
+                                    chunk_size=None):
+    """
+    Import the given STIX reports in parallel:
+
+    - the report pks are partitioned into chunks of ``chunk_size`` reports;
+    - if a Celery broker is configured, each chunk is imported by the task
+      ``async_import_stix_reports``; otherwise, the chunks are imported
+      by a local pool of ``workers`` processes;
+    - ``outdate_sources`` is called once after all chunks have been imported.
+
+    All chunks are associated with the same Action. Concurrent creation
+    of observables and stati by different workers is resolved via the
+    uniqueness constraints of these tables; concurrent status updates of
+    the same observable are serialized by ``update_status_batch``, which
+    locks the observables it updates.
+
+    Returns a dictionary mapping each report pk to ``None`` (success)
+    or to a description of the error that occurred.
+    """
+    top_level_iobj_pks = [x.pk if isinstance(x,InfoObject) else x for x in top_level_iobj_pks]
+
+    if not workers:
+        workers = multiprocessing.cpu_count()
+    if not chunk_size:
+        chunk_size = max(1, min(MANTIS_ACTIONABLES_PARALLEL_IMPORT_CHUNK_SIZE,
+                                len(top_level_iobj_pks) // workers or 1))
+
+    action, created_action = Action.objects.get_or_create(user=user,comment=action_comment)
+    user_pk = user.pk if user else None
+
+    report_chunks = list(chunks(top_level_iobj_pks, chunk_size))
+
+    results = {}
+
+    logger.info("Importing %s reports in %s chunks" % (len(top_level_iobj_pks), len(report_chunks)))
+
+    if celery_broker_configured():
+        group_result = group(async_import_stix_reports.s(report_chunk, action_pk=action.pk, user_pk=user_pk)
+                             for report_chunk in report_chunks).apply_async()
+        chunk_results = group_result.get(propagate=False)
+    else:
+        # The forked processes must not share the database connection of
+        # this process; each of them opens a connection of its own.
+        for connection in connections.all():
+            connection.close()
+        pool = multiprocessing.Pool(processes=workers)
+        try:
+            chunk_results = pool.map(_import_STIX_report_chunk_star,
+                                     [(report_chunk, action.pk, user_pk) for report_chunk in report_chunks])
+        finally:
+            pool.close()
+            pool.join()
+
+    for report_chunk, chunk_result in zip(report_chunks, chunk_results):
+        if isinstance(chunk_result, Exception):
+            # The whole task failed, e.g., because the worker died.
+            for top_level_iobj_pk in report_chunk:
+                results[top_level_iobj_pk] = "%s: %s" % (chunk_result.__class__.__name__, chunk_result)
+        else:
+            results.update(chunk_result)
+
+    outdate_sources(identifier_pks=InfoObject.objects.filter(pk__in=top_level_iobj_pks)\
+                                                     .values_list('identifier_id',flat=True))
+
+    failed = [pk for (pk, error) in results.items() if error]
+    if failed:
+        logger.error("Import of %s of %s reports failed: %s" % (len(failed), len(results), failed))
+
+    return results
+
+
+def stix_reports_queryset():
+    """
+    Return a queryset of all InfoObjects that constitute STIX reports
+    (see ``process_STIX_Reports``); test namespaces and outdated
+    revisions are excluded.
+    """
+    report_filters = []
+    for report_filter in MANTIS_ACTIONABLES_STIX_REPORT_FAMILY_AND_TYPES:
+        report_filters.append({
+            'iobject_type__name' : report_filter['iobject_type'],
+            'iobject_family__name' : report_filter['iobject_type_family']
+        })
+    queries = [Q(**filter) for filter in report_filters]
+    query = queries.pop()
+
+    # Or the Q object with the ones remaining in the list
+    for item in queries:
+        query |= item
+    return InfoObject.objects.exclude(identifier__namespace__uri__icontains='test').exclude(latest_of__isnull=True).filter(query)
+
+
+def process_STIX_Reports(imported_since, imported_until=None, parallel=False, workers=None):
     """
     Process all STIX reports that have been imported into MANTIS in a certain time slice:
 
@@ -858,29 +1126,21 @@ def process_STIX_Reports(imported_since, imported_until=None):
       (Once STIX 1.2 is released, we may have to add STIX_Report here and probably
       add some intelligence to disregard packages if they contain a report object...)
 
-    - Call the import function on the determined STIX reports
+    - Call the import function on the determined STIX reports; if ``parallel``
+      is set, the reports are imported with ``import_STIX_reports_in_parallel``.
 
     """
     start_time = timezone.now()
     if not imported_until:
         imported_until = timezone.now()
-    report_filters = []
-    for report_filter in MANTIS_ACTIONABLES_STIX_REPORT_FAMILY_AND_TYPES:
-        report_filters.append({
-            'iobject_type__name' : report_filter['iobject_type'],
-            'iobject_family__name' : report_filter['iobject_type_family']
-        })
-    queries = [Q(**filter) for filter in report_filters]
-    query = queries.pop()
-
-    # Or the Q object with the ones remaining in the list
-    for item in queries:
-        query |= item
-    top_level_iobjs = InfoObject.objects.filter(create_timestamp__gte=imported_since,
-                                                create_timestamp__lte=imported_until).exclude(identifier__namespace__uri__icontains='test').exclude(latest_of__isnull=True)
-    top_level_iobjs = list(top_level_iobjs.filter(query))
+    top_level_iobjs = stix_reports_queryset().filter(create_timestamp__gte=imported_since,
+                                                     create_timestamp__lte=imported_until)
+    top_level_iobjs = list(top_level_iobjs)
     logger.info("Importing timespan %s to %s" % (imported_since,imported_until))
-    result = import_singleton_observables_from_STIX_iobjects(top_level_iobjs)
+    if parallel:
+        result = import_STIX_reports_in_parallel(top_level_iobjs, workers=workers)
+    else:
+        result = import_singleton_observables_from_STIX_iobjects(top_level_iobjs)
 
     end_time = timezone.now()
 
@@ -888,6 +1148,120 @@ def process_STIX_Reports(imported_since, imported_until=None):
 
     return result
 
+
+def process_STIX_Reports_since_last_run(watermark_name='stix_reports'):
+    """
+    Incrementally import all STIX reports that have not been imported yet:
+
+    - The run takes the lease of the ImportWatermark with the given name;
+      if another run holds the lease, nothing is done and ``None`` is returned.
+
+    - It considers all reports created since the stored high-water mark
+      (minus ``MANTIS_ACTIONABLES_IMPORT_WATERMARK_OVERLAP_SECONDS``, to catch
+      reports whose transaction committed late) and skips the report revisions
+      recorded in the import ledger.
+
+    - After each report, the revision is recorded in the ledger, the high-water
+      mark is advanced and the lease is renewed; thus, a run that crashes
+      is resumed by the next run with the first report that has not been
+      imported.
+
+    - A report whose import fails is logged and recorded in the ledger with
+      the error, and the run continues with the next report. The high-water
+      mark is not advanced beyond the failed report, so that later runs try
+      it again, until it has failed ``MANTIS_ACTIONABLES_IMPORT_MAX_ATTEMPTS``
+      times; then it is given up.
+
+    Returns the number of imported reports.
+    """
+
+    lease_duration = timedelta(seconds=MANTIS_ACTIONABLES_IMPORT_LEASE_SECONDS)
+    lease_holder = "%s:%s:%s" % (socket.gethostname(), os.getpid(), uuid.uuid4().hex)
+
+    watermark = ImportWatermark.acquire_lease(watermark_name, lease_holder, lease_duration)
+
+    if not watermark:
+        logger.info("Import '%s' is running elsewhere, skipping this run" % watermark_name)
+        return None
+
+    imported_count = 0
+
+    try:
+        top_level_iobjs = stix_reports_queryset()
+        imported_since = None
+        if watermark.high_water_mark:
+            imported_since = watermark.high_water_mark - timedelta(seconds=MANTIS_ACTIONABLES_IMPORT_WATERMARK_OVERLAP_SECONDS)
+            top_level_iobjs = top_level_iobjs.filter(create_timestamp__gte=imported_since)
+
+        # Reports that have been imported or given up on
+        ledger_entries = ImportLedgerEntry.objects.filter(Q(error='') |
+                                                          Q(failed_attempts__gte=MANTIS_ACTIONABLES_IMPORT_MAX_ATTEMPTS))
+        if imported_since:
+            ledger_entries = ledger_entries.filter(iobject_create_timestamp__gte=imported_since)
+        imported_pks = set(ledger_entries.values_list('iobject_id',flat=True))
+
+        reports = list(top_level_iobjs.order_by('create_timestamp','pk').values_list('pk','create_timestamp'))
+
+        logger.info("Importing %s reports created since %s" % (len([x for x in reports if x[0] not in imported_pks]),
+                                                               imported_since))
+
+        # Set once a report has failed that is to be tried again
+        blocked = False
+
+        for (top_level_iobj_pk, create_timestamp) in reports:
+            if top_level_iobj_pk in imported_pks:
+                # Imported by an earlier run that has not advanced the
+                # high-water mark beyond it because of a failed report
+                if not blocked:
+                    watermark.advance(create_timestamp)
+                continue
+
+            try:
+                import_singleton_observables_from_STIX_iobjects([top_level_iobj_pk])
+            except Exception as e:
+                logger.exception("Import of report %s failed" % top_level_iobj_pk)
+                failed_attempts = record_failed_import(top_level_iobj_pk, create_timestamp,
+                                                       "%s: %s" % (e.__class__.__name__, e))
+                if failed_attempts < MANTIS_ACTIONABLES_IMPORT_MAX_ATTEMPTS:
+                    blocked = True
+                else:
+                    logger.error("Giving up on report %s after %s failed attempts" % (top_level_iobj_pk,
+                                                                                      failed_attempts))
+            else:
+                ImportLedgerEntry.objects.update_or_create(iobject_id=top_level_iobj_pk,
+                                                           defaults={'iobject_create_timestamp': create_timestamp,
+                                                                     'error': ''})
+                imported_count += 1
+
+            if not blocked:
+                watermark.advance(create_timestamp)
+
+            if not watermark.renew_lease(lease_duration):
+                logger.error("Lost lease for import '%s', stopping after %s reports" % (watermark_name,
+                                                                                        imported_count))
+                return imported_count
+    finally:
+        watermark.release_lease()
+
+    return imported_count
+
+
+def record_failed_import(top_level_iobj_pk, create_timestamp, error):
+    """
+    Record a failed import of a report in the ledger; returns the number
+    of failed attempts so far.
+    """
+    entry, created = ImportLedgerEntry.objects.get_or_create(iobject_id=top_level_iobj_pk,
+                                                             defaults={'iobject_create_timestamp': create_timestamp,
+                                                                       'failed_attempts': 1,
+                                                                       'error': error})
+    if created:
+        return 1
+    ImportLedgerEntry.objects.filter(pk=entry.pk).update(failed_attempts=F('failed_attempts') + 1,
+                                                         error=error)
+    return entry.failed_attempts + 1
+
+
 def extract_essence(node_info, graph):
     result = {}
     if node_info['iobject_type'] == 'Indicator':
@@ -950,7 +1324,7 @@ def extract_essence(node_info, graph):
 
 
 
-def outdate_sources(simulate=True):
+def outdate_sources(simulate=True, identifier_pks=None):
     """
     Find outdated sources and mark them as such; also write 'OUTDATE' tags where required.
 
@@ -960,6 +1334,23 @@ def outdate_sources(simulate=True):
     just imported. The function ``outdate_sources`` catches such
     outdated sources and treats them accordingly.
 
+    If ``identifier_pks`` is given, only sources of the top-level identifiers
+    with these pks are considered (this is how the import calls the function
+    for the reports it has just imported); otherwise, all sources are checked.
+
+    The function works set-based: the tags of all affected sources and observables
+    are read with a few grouped queries, the sources are marked as outdated with
+    a single update, and the OUTDATED tags are written with one tag action per
+    report and set of contexts.
+
+    Returns a report (also in simulation mode, in which nothing is written)
+    of the form::
+
+        {'outdated_source_pks': [...],
+         'outdated_tags': [{'identifier': <top-level identifier>,
+                            'context_name_pairs': [(context, 'OUTDATED'), ...],
+                            'singleton_pks': [...]}, ...]}
+
     """
 
     # Find sources of STIX imports that are outdated, i.e.,
@@ -968,67 +1359,93 @@ def outdate_sources(simulate=True):
 
     outdated_sources = Source.objects.filter(outdated=False).exclude(top_level_iobject_identifier__isnull=True).exclude(top_level_iobject_identifier__latest=F('top_level_iobject'))
 
-    outdated_sources_pks = map(lambda x: x.pk,outdated_sources)
-
-    print "Starting"
+    if identifier_pks is not None:
+        outdated_sources = outdated_sources.filter(top_level_iobject_identifier_id__in=set(identifier_pks))
 
+    outdated_source_infos = list(outdated_sources.values_list('pk',
+                                                              'content_type_id',
+                                                              'object_id',
+                                                              'top_level_iobject_identifier_id'))
 
-    for outdated_source in outdated_sources:
-        # Set the outdate flag -- this is used in searches to distinguish
-        # outdated sources.
+    report = {'outdated_source_pks': [x[0] for x in outdated_source_infos],
+              'outdated_tags': []}
 
-        singleton_observable = outdated_source.yielded
+    if not outdated_source_infos:
+        return report
 
-        if not simulate:
-            outdated_source.outdated=True
-            outdated_source.save()
+    outdated_source_pks = report['outdated_source_pks']
 
-        else:
+    # Only sources of singleton observables carry tags that may have to be outdated
 
-            logger.info("Found outdated source for %s" % singleton_observable)
+    outdated_source_infos = [x for x in outdated_source_infos if x[1] == CONTENT_TYPE_SINGLETON_OBSERVABLE.pk]
 
-        # Get the dingos tags associated with this source via the link to
-        # the dingos fact in the source
+    singleton_pks = set(x[2] for x in outdated_source_infos)
+    top_level_identifier_pks = set(x[3] for x in outdated_source_infos)
 
-        dingos_tags_for_this_top_level_report = outdated_source.top_level_iobject_identifier.tags.all().values_list('name',flat=True)
+    # Get the dingos tags associated with the top-level reports of the outdated sources
 
-        contexts_attached_to_yieldable = set(map(lambda x: x.context.name, outdated_source.yielded.actionable_tags.all()))
+    identifier2tags = {}
+    for (identifier_pk, tag_name) in Identifier.objects.filter(pk__in=top_level_identifier_pks).values_list('pk','tags__name'):
+        if tag_name:
+            identifier2tags.setdefault(identifier_pk, set()).add(tag_name)
 
+    # Get the contexts in which the yielded singleton observables are tagged
 
-        # Reduce the list to tags that denote an Actionable Context
-        for regular_expr in MANTIS_ACTIONABLES_CONTEXT_TAG_REGEX:
-            dingos_tags_for_this_top_level_report.filter(name__regex=regular_expr)
+    singleton2contexts = {}
+    for (object_id, context_name) in TaggedActionableItem.objects.filter(content_type=CONTENT_TYPE_SINGLETON_OBSERVABLE,
+                                                                         object_id__in=singleton_pks)\
+                                                                 .values_list('object_id','tag__context__name'):
+        singleton2contexts.setdefault(object_id, set()).add(context_name)
 
-        # Get the tags associated with the associated singleton observable via
-        # all *other* non-outdated sources
+    # Get the tags associated with the singleton observables via
+    # all *other* non-outdated sources
 
-        dingos_tags_for_all_other_top_level_reports = Source.objects.filter(object_id=outdated_source.yielded.pk,content_type=CONTENT_TYPE_SINGLETON_OBSERVABLE).\
-            filter(outdated=False).exclude(pk__in=outdated_sources_pks).values_list('top_level_iobject_identifier__tags__name',flat=True)
+    singleton2other_tags = {}
+    for (object_id, tag_name) in Source.objects.filter(object_id__in=singleton_pks,
+                                                       content_type=CONTENT_TYPE_SINGLETON_OBSERVABLE,
+                                                       outdated=False)\
+                                               .exclude(pk__in=outdated_source_pks)\
+                                               .values_list('object_id','top_level_iobject_identifier__tags__name'):
+        singleton2other_tags.setdefault(object_id, set()).add(tag_name)
+
+    # Find out whether there are tags that were associated with singleton observable
+    # yielded by a source exclusively via this source -- those are
+    # the tags that should be marked as possibly OUTDATED. We group
+    # the affected observables by report and tags.
+
+    tag_actions = {}
+
+    for (source_pk, content_type_id, singleton_pk, identifier_pk) in outdated_source_infos:
+        tags_to_mark_as_outdated = (identifier2tags.get(identifier_pk, set())
+                                    & singleton2contexts.get(singleton_pk, set())) \
+                                   - singleton2other_tags.get(singleton_pk, set())
+        if tags_to_mark_as_outdated:
+            tag_actions.setdefault((identifier_pk, frozenset(tags_to_mark_as_outdated)), set()).add(singleton_pk)
 
-        #if simulate:
-        #    # We have not marked this source as outdated
-        #    dingos_tags_for_all_other_top_level_reports = Source.objects.filter(object_id=outdated_source.yielded.pk,content_type=CONTENT_TYPE_SINGLETON_OBSERVABLE).\
-        #        filter(outdated=False).exclude(id__in=).values_list('top_level_iobject_identifier__tags__name',flat=True)
+    identifier_map = Identifier.objects.in_bulk(set(x[0] for x in tag_actions.keys()))
 
-        # Find out whether there are tags that were associated with singleton observable
-        # yielded by the present source exclusively via this source -- those are
-        # the tags that should be marked as possibly OUTDATED.
+    for (identifier_pk, tags_to_mark_as_outdated), pks in tag_actions.items():
+        report['outdated_tags'].append({'identifier': identifier_map.get(identifier_pk),
+                                        'context_name_pairs': [(x,'OUTDATED') for x in sorted(tags_to_mark_as_outdated)],
+                                        'singleton_pks': sorted(pks)})
 
-        tags_to_mark_as_outdated = set()
+    if simulate:
+        logger.info("SIMULATE. Found %s outdated sources" % len(outdated_source_pks))
+        for entry in report['outdated_tags']:
+            logger.info("SIMULATE. Would have tagged %s for %s" % (entry['context_name_pairs'],
+                                                                   entry['singleton_pks']))
+        return report
 
-        for tag in dingos_tags_for_this_top_level_report:
-            if (not tag in dingos_tags_for_all_other_top_level_reports) and (tag in contexts_attached_to_yieldable):
-                tags_to_mark_as_outdated.add(tag)
+    # Set the outdate flag -- this is used in searches to distinguish
+    # outdated sources.
 
-        if tags_to_mark_as_outdated:
+    Source.objects.filter(pk__in=outdated_source_pks).update(outdated=True)
 
-            context_name_pairs = map(lambda x : (x,'OUTDATED'), tags_to_mark_as_outdated )
-            if not simulate:
-                ActionableTag.bulk_action(action='add',
-                                          context_name_pairs=context_name_pairs,
-                                          thing_to_tag_pks=[outdated_source.yielded.pk],
-                                          comment="Indicator no longer in latest revision of report %s" % outdated_source.top_level_iobject_identifier,
-                                          supress_transfer_to_dingos=True)
-            else:
-                logger.info("SIMULATE. Would have tagged %s for %s" % (context_name_pairs,outdated_source.yielded))
+    for entry in report['outdated_tags']:
+        ActionableTag.bulk_action(action='add',
+                                  context_name_pairs=entry['context_name_pairs'],
+                                  thing_to_tag_pks=entry['singleton_pks'],
+                                  comment="Indicator no longer in latest revision of report %s" % entry['identifier'],
+                                  supress_transfer_to_dingos=True)
 
+    return report
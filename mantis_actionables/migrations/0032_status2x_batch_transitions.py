@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mantis_actionables', '0031_auto_20150513_1203'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='status2x',
+            unique_together=set([]),
+        ),
+        migrations.AlterIndexTogether(
+            name='status2x',
+            index_together=set([('content_type', 'object_id', 'active')]),
+        ),
+    ]
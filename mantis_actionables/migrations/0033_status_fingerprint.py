@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+import hashlib
+from datetime import datetime
+
+from django.db import models, migrations
+from django.utils import timezone
+
+
+# Frozen copy of the fingerprint calculation as of this migration
+# (``mantis_actionables.models.calculate_status_fingerprint``): later
+# changes to the live function must not change what this migration computes.
+
+INF_TIME = datetime.max.replace(tzinfo=timezone.utc)
+NULL_TIME = datetime.min.replace(tzinfo=timezone.utc)
+
+STATUS_FINGERPRINT_DEFAULTS = {
+    'false_positive' : None,
+    'active' : True,
+    'active_from' : NULL_TIME,
+    'active_to' : INF_TIME,
+    'tags' : '',
+    'priority' : 0,
+    'most_permissive_tlp' : 0,
+    'most_restrictive_tlp' : 0,
+    'max_confidence' : 0,
+    'kill_chain_phases' : '',
+    'best_processing' : 0,
+}
+
+
+def _normalize_separated_list(value, separator):
+    return separator.join(sorted(set(x for x in (value or '').split(separator) if x)))
+
+
+def _normalize_time(value):
+    if timezone.is_aware(value):
+        value = value.astimezone(timezone.utc)
+    # strftime refuses years before 1900 on Python 2 (NULL_TIME is year 1)
+    return '%04d-%02d-%02dT%02d:%02d:%02d.%06d' % (value.year, value.month, value.day,
+                                                   value.hour, value.minute, value.second, value.microsecond)
+
+
+def calculate_status_fingerprint(values):
+    normalized = []
+    for field in sorted(STATUS_FINGERPRINT_DEFAULTS.keys()):
+        value = values.get(field, STATUS_FINGERPRINT_DEFAULTS[field])
+        if field == 'kill_chain_phases':
+            value = _normalize_separated_list(value, ';')
+        elif field == 'tags':
+            value = _normalize_separated_list(value, ',')
+        elif field in ('active_from', 'active_to'):
+            value = _normalize_time(value)
+        elif field == 'false_positive':
+            value = None if value is None else bool(value)
+        elif field == 'active':
+            value = bool(value)
+        else:
+            value = int(value)
+        normalized.append([field, value])
+
+    return hashlib.sha1(json.dumps(normalized, sort_keys=True)).hexdigest()
+
+
+def backfill_fingerprints(apps, schema_editor):
+    """
+    Calculate the fingerprint of all existing stati and merge stati with identical
+    content: Status2X objects pointing to a duplicate are redirected to the
+    status with the lowest primary key, and the duplicates are deleted.
+    """
+    Status = apps.get_model('mantis_actionables', 'Status')
+    Status2X = apps.get_model('mantis_actionables', 'Status2X')
+
+    fields = ['pk'] + sorted(STATUS_FINGERPRINT_DEFAULTS.keys())
+
+    fingerprint2pks = {}
+    for row in Status.objects.order_by('pk').values_list(*fields).iterator():
+        values = dict(zip(fields, row))
+        fingerprint = calculate_status_fingerprint(values)
+        fingerprint2pks.setdefault(fingerprint, []).append(values['pk'])
+
+    for fingerprint, pks in fingerprint2pks.items():
+        kept_pk = pks[0]
+        duplicate_pks = pks[1:]
+        if duplicate_pks:
+            Status2X.objects.filter(status_id__in=duplicate_pks).update(status=kept_pk)
+            Status.objects.filter(pk__in=duplicate_pks).delete()
+        Status.objects.filter(pk=kept_pk).update(fingerprint=fingerprint)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mantis_actionables', '0032_status2x_batch_transitions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='status',
+            name='fingerprint',
+            field=models.CharField(max_length=40, null=True, editable=False),
+            preserve_default=True,
+        ),
+        migrations.RunPython(backfill_fingerprints,
+                             reverse_code=lambda apps, schema_editor: None),
+        migrations.AlterField(
+            model_name='status',
+            name='fingerprint',
+            field=models.CharField(unique=True, max_length=40, editable=False),
+            preserve_default=True,
+        ),
+    ]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dingos', '0005_AddTaggingHistory'),
+        ('mantis_actionables', '0033_status_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportLedgerEntry',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('iobject_create_timestamp', models.DateTimeField(db_index=True)),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+                ('iobject', models.OneToOneField(related_name='actionables_import_ledger_entry', to='dingos.InfoObject')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.CreateModel(
+            name='ImportWatermark',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('name', models.SlugField(unique=True, max_length=40)),
+                ('high_water_mark', models.DateTimeField(null=True)),
+                ('lease_holder', models.CharField(default='', max_length=255, blank=True)),
+                ('lease_expires', models.DateTimeField(null=True)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dingos', '0005_AddTaggingHistory'),
+        ('mantis_actionables', '0034_import_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InfoObjectTLP',
+            fields=[
+                ('iobject', models.OneToOneField(related_name='actionables_tlp', primary_key=True, serialize=False, to='dingos.InfoObject')),
+                ('color', models.CharField(default='', max_length=40, blank=True)),
+                ('iobject_identifier', models.ForeignKey(related_name='actionables_tlp', to='dingos.Identifier')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+    ]
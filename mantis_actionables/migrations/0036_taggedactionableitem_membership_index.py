@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0001_initial'),
+        ('mantis_actionables', '0035_infoobjecttlp'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='taggedactionableitem',
+            index_together=set([('tag', 'content_type', 'object_id')]),
+        ),
+    ]
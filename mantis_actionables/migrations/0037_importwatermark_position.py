@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mantis_actionables', '0036_taggedactionableitem_membership_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importwatermark',
+            name='position',
+            field=models.BigIntegerField(default=0),
+            preserve_default=True,
+        ),
+    ]
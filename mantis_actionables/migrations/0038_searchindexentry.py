@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+def install_search_index(apps, schema_editor):
+    from mantis_actionables.core.search import get_search_backend
+    get_search_backend(schema_editor.connection.alias, installing=True).install()
+
+
+def uninstall_search_index(apps, schema_editor):
+    from mantis_actionables.core.search import get_search_backend
+    get_search_backend(schema_editor.connection.alias, installing=True).uninstall()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dingos', '0005_AddTaggingHistory'),
+        ('mantis_actionables', '0037_importwatermark_position'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchIndexEntry',
+            fields=[
+                ('id', models.AutoField(serialize=False, primary_key=True, db_column='rowid')),
+                ('kind', models.CharField(max_length=20)),
+                ('object_id', models.IntegerField()),
+                ('text', models.TextField()),
+            ],
+            options={
+                'db_table': 'mantis_actionables_searchindex',
+                'managed': False,
+            },
+            bases=(models.Model,),
+        ),
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mantis_actionables', '0038_searchindexentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IPRange',
+            fields=[
+                ('singleton_observable', models.OneToOneField(related_name='ip_range', primary_key=True, serialize=False, to='mantis_actionables.SingletonObservable')),
+                ('version', models.SmallIntegerField()),
+                ('start', models.CharField(max_length=32)),
+                ('end', models.CharField(max_length=32)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterIndexTogether(
+            name='iprange',
+            index_together=set([('version', 'start', 'end'), ('version', 'end')]),
+        ),
+    ]
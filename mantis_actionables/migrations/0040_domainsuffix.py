@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mantis_actionables', '0039_iprange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DomainSuffix',
+            fields=[
+                ('singleton_observable', models.OneToOneField(related_name='domain_suffix', primary_key=True, serialize=False, to='mantis_actionables.SingletonObservable')),
+                ('reversed_domain', models.CharField(max_length=255, db_index=True)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+    ]
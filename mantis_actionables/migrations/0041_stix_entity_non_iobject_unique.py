@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+INDEX_NAME = 'mantis_actionables_stix_entity_non_iobject_uniq'
+
+# Models that refer to STIX_Entity through a ``related_stix_entities`` field
+REFERRING_MODELS = ['Source', 'ImportInfo']
+
+
+def merge_duplicate_non_iobject_entities(apps, schema_editor):
+    # unique_together does not cover rows with a NULL iobject_identifier,
+    # so concurrent imports may have created the same entity more than once.
+    STIX_Entity = apps.get_model('mantis_actionables', 'STIX_Entity')
+    duplicates = STIX_Entity.objects.filter(iobject_identifier__isnull=True)\
+                                    .values('non_iobject_identifier')\
+                                    .annotate(count=models.Count('pk'), keep_pk=models.Min('pk'))\
+                                    .filter(count__gt=1)
+    for duplicate in duplicates:
+        keep_pk = duplicate['keep_pk']
+        drop_pks = list(STIX_Entity.objects.filter(iobject_identifier__isnull=True,
+                                                   non_iobject_identifier=duplicate['non_iobject_identifier'])\
+                                           .exclude(pk=keep_pk)\
+                                           .values_list('pk', flat=True))
+        for model_name in REFERRING_MODELS:
+            through = apps.get_model('mantis_actionables', model_name)._meta.get_field('related_stix_entities').rel.through
+            owner_column = '%s_id' % model_name.lower()
+            linked = set(through.objects.filter(stix_entity_id=keep_pk).values_list(owner_column, flat=True))
+            for link in through.objects.filter(stix_entity_id__in=drop_pks):
+                owner_pk = getattr(link, owner_column)
+                if owner_pk in linked:
+                    link.delete()
+                else:
+                    through.objects.filter(pk=link.pk).update(stix_entity=keep_pk)
+                    linked.add(owner_pk)
+        STIX_Entity.objects.filter(pk__in=drop_pks).delete()
+
+
+def create_unique_index(apps, schema_editor):
+    if schema_editor.connection.vendor not in ('postgresql', 'sqlite'):
+        # No partial indexes; uniqueness is left to the importers
+        return
+    STIX_Entity = apps.get_model('mantis_actionables', 'STIX_Entity')
+    schema_editor.execute('CREATE UNIQUE INDEX %s ON %s (%s) WHERE %s IS NULL' % (
+        schema_editor.quote_name(INDEX_NAME),
+        schema_editor.quote_name(STIX_Entity._meta.db_table),
+        schema_editor.quote_name('non_iobject_identifier'),
+        schema_editor.quote_name('iobject_identifier_id')))
+
+
+def drop_unique_index(apps, schema_editor):
+    if schema_editor.connection.vendor not in ('postgresql', 'sqlite'):
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS %s' % schema_editor.quote_name(INDEX_NAME))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mantis_actionables', '0040_domainsuffix'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_non_iobject_entities, lambda apps, schema_editor: None),
+        migrations.RunPython(create_unique_index, drop_unique_index),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mantis_actionables', '0041_stix_entity_non_iobject_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importledgerentry',
+            name='failed_attempts',
+            field=models.PositiveIntegerField(default=0),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='importledgerentry',
+            name='error',
+            field=models.TextField(default='', blank=True),
+            preserve_default=True,
+        ),
+    ]
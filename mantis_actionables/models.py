@@ -19,8 +19,11 @@
 
 import logging
 import json
+import time
+import hashlib
 
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import Q
 from django.contrib.auth.models import User, Group
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes import generic
@@ -38,10 +41,30 @@ from taggit.managers import TaggableManager, _TaggableManager
 from taggit.utils import require_instance_manager
 from django.utils.translation import ugettext_lazy as _
 
+from mantis_actionables.core.lru import LRUCache
+
 logger = logging.getLogger(__name__)
 
 import read_settings
 
+
+def grouped_update(queryset, field_name, pk2value_map):
+    """
+    Write the values given in ``pk2value_map`` into the field ``field_name`` of
+    the objects in ``queryset``.
+
+    Objects that receive the same value are written with a single ``UPDATE``
+    statement, so the number of queries depends on the number of distinct
+    values rather than on the number of objects.
+    """
+    value2pks = {}
+    for pk, value in pk2value_map.items():
+        value2pks.setdefault(value, []).append(pk)
+
+    for value, pks in value2pks.items():
+        queryset.filter(pk__in=pks).update(**{field_name: value})
+
+
 class CachingManager(models.Manager):
     """
     For models that have a moderate amount of entries and are always queried
@@ -54,7 +77,6 @@ class CachingManager(models.Manager):
     - include model name and query for which a cache is to be maintained in
       the mapping 'cachable_queries' as follows::
           cachable_queries = {
-                              # Make sure that the query arguments below are given in alphabetical order!!!
                               ...
                               "ActionableTag" : ["context_id","tag_id"]
                               ...
@@ -68,15 +90,43 @@ class CachingManager(models.Manager):
          cached_objects = CachingManager()
 
       and use ``ActionableTag.cached_objects.get_or_create(...)`` for the query.
+      Many lookups can be answered at once with
+      ``ActionableTag.cached_objects.get_or_create_many([{...},{...}])``.
+
+    The cache has two tiers:
+
+    - each object is stored under its own key in the shared cache
+      ``caching_manager``, so a lookup only transfers a single object
+      rather than the whole table;
+    - an in-process LRU sits in front of the shared cache, so that
+      repeated lookups (e.g., in import loops) do not even leave the process.
+
+    All keys of a model live in a versioned namespace: changing or deleting
+    an object (or calling ``invalidate()`` after a queryset ``update()``)
+    bumps the version in the shared cache, which makes all workers discard
+    their entries for that model within ``VERSION_CHECK_INTERVAL`` seconds.
+
+    When a version of the namespace is used for the first time, the shared
+    cache is filled with all objects of the model via a single query.
 
     """
 
     TIME_TO_LIVE = None
 
+    # Number of seconds for which a process trusts its knowledge
+    # of the current namespace version without asking the shared cache.
+
+    VERSION_CHECK_INTERVAL = 5
+
+    # Maximal number of objects per model held in the in-process tier
+
+    LOCAL_CACHE_SIZE = 10000
+
+    KEY_PREFIX = 'mantis_actionables:cm'
+
     cache = caches['caching_manager']
 
     cachable_queries = {
-        # Make sure that the query arguments below are given in alphabetical order!!!
         "SingletonObservableType" : ['name'],
         "SingletonObservableSubtype" : ['name'],
         "Context" : ["name"],
@@ -85,35 +135,215 @@ class CachingManager(models.Manager):
         "ActionableTag" : ["context_id","info_id"]
     }
 
+    # In-process state, per model name:
+    # - local LRU caches
+    # - (version, time of last version check)
+    # - version for which the shared cache has been warmed up
+
+    _local_caches = {}
+    _local_versions = {}
+    _warm_versions = {}
+
+    def contribute_to_class(self, model, name):
+        super(CachingManager, self).contribute_to_class(model, name)
+        if model._meta.abstract:
+            return
+        # Changes to objects that may be in the cache invalidate the
+        # namespace of the model. Newly created objects do not need this:
+        # the lookup that missed them writes them into the cache.
+        models.signals.post_save.connect(self._post_save_handler,
+                                         sender=model,
+                                         weak=False,
+                                         dispatch_uid="caching_manager_save_%s" % model.__name__)
+        models.signals.post_delete.connect(self._post_delete_handler,
+                                           sender=model,
+                                           weak=False,
+                                           dispatch_uid="caching_manager_delete_%s" % model.__name__)
+
+    def _post_save_handler(self, sender, instance, created, **kwargs):
+        if not created:
+            self.invalidate()
+
+    def _post_delete_handler(self, sender, instance, **kwargs):
+        self.invalidate()
+
+    @property
+    def _model_name(self):
+        return self.model.__name__
+
+    @property
+    def _lookup_fields(self):
+        return sorted(CachingManager.cachable_queries.get(self._model_name,[]))
+
+    def _is_cachable(self, kwargs):
+        lookup_fields = self._lookup_fields
+        return lookup_fields and sorted(kwargs.keys()) == lookup_fields
+
+    def _local_cache(self):
+        local_cache = CachingManager._local_caches.get(self._model_name)
+        if local_cache is None:
+            local_cache = LRUCache(max_size=CachingManager.LOCAL_CACHE_SIZE)
+            CachingManager._local_caches[self._model_name] = local_cache
+        return local_cache
+
+    def _version_key(self):
+        return "%s:%s:version" % (CachingManager.KEY_PREFIX, self._model_name)
+
+    def _current_version(self):
+        now = time.time()
+        version, checked_at = CachingManager._local_versions.get(self._model_name,(None,0))
+
+        if version is None or now - checked_at > CachingManager.VERSION_CHECK_INTERVAL:
+            shared_version = CachingManager.cache.get(self._version_key())
+            if shared_version is None:
+                shared_version = 1
+                CachingManager.cache.add(self._version_key(), shared_version, None)
+            if shared_version != version:
+                # Somebody invalidated the namespace: drop what we have locally.
+                self._local_cache().clear()
+            version = shared_version
+            CachingManager._local_versions[self._model_name] = (version, now)
+
+        return version
+
+    def invalidate(self):
+        """
+        Discard all cached entries of this model in all processes.
+
+        Call this after changing objects of the model with a queryset ``update()``,
+        since that bypasses the signals on which invalidation relies otherwise.
+        """
+        try:
+            version = CachingManager.cache.incr(self._version_key())
+        except ValueError:
+            version = 2
+            CachingManager.cache.set(self._version_key(), version, None)
+
+        self._local_cache().clear()
+        CachingManager._local_versions[self._model_name] = (version, time.time())
+        logger.debug("Invalidated cache for %s; now at version %s" % (self._model_name, version))
+
+    def _lookup_value(self, kwargs):
+        return tuple(kwargs[field] for field in self._lookup_fields)
+
+    def _shared_key(self, version, lookup_value):
+        lookup_repr = u"|".join(u"%s" % x for x in lookup_value)
+        return "%s:%s:%s:%s" % (CachingManager.KEY_PREFIX,
+                                self._model_name,
+                                version,
+                                hashlib.md5(lookup_repr.encode('utf-8')).hexdigest())
+
+    def _warm_up(self, version):
+        """
+        Fill the shared cache for the given namespace version with all objects of
+        the model, using a single query.
+        """
+        if CachingManager._warm_versions.get(self._model_name) == version:
+            return
+
+        warm_key = "%s:%s:%s:warm" % (CachingManager.KEY_PREFIX, self._model_name, version)
+
+        if not CachingManager.cache.get(warm_key):
+            attnames = [field.attname for field in self.model._meta.concrete_fields]
+            shared_entries = {}
+            local_cache = self._local_cache()
+            for row in super(CachingManager, self).get_queryset().values_list(*attnames):
+                obj = self.model(**dict(zip(attnames, row)))
+                lookup_value = tuple(getattr(obj, field) for field in self._lookup_fields)
+                shared_entries[self._shared_key(version, lookup_value)] = obj
+                if len(local_cache) < local_cache.max_size:
+                    local_cache.set(lookup_value, obj)
+            CachingManager.cache.set_many(shared_entries, CachingManager.TIME_TO_LIVE)
+            CachingManager.cache.set(warm_key, True, CachingManager.TIME_TO_LIVE)
+            logger.debug("Warmed up cache for %s with %s objects" % (self._model_name, len(shared_entries)))
+
+        CachingManager._warm_versions[self._model_name] = version
+
+    def _remember(self, version, lookup_value, obj):
+        self._local_cache().set(lookup_value, obj)
+        CachingManager.cache.set(self._shared_key(version, lookup_value), obj, CachingManager.TIME_TO_LIVE)
+
     def get_or_create(self, defaults=None, **kwargs):
-        sorted_keys = sorted(kwargs.keys())
-        sorted_arguments = tuple(sorted(kwargs.values()))
-        if sorted_keys == sorted(CachingManager.cachable_queries[self.model.__name__]):
-            if not CachingManager.cache.get(self.model.__name__):
-                all_objects = list(super(CachingManager, self).all())
-                value_dic = {}
-                for object in all_objects:
-                    # TODO: When the cache is filled for the first time, the line below
-                    # leads to a query for each single object. I thought that the
-                    # wrapping 'list(...)' above when getting all objects would take care of
-                    # this, but it does not... Can this be changed? otherwise, initializing
-                    # the cache is really expensive...
-                    sorted_values = tuple(sorted([getattr(object, attr) for attr in sorted_keys]))
-                    value_dic[sorted_values] = object
-                CachingManager.cache.set(self.model.__name__, value_dic, CachingManager.TIME_TO_LIVE)
-
-
-            inCache = CachingManager.cache.get(self.model.__name__).get(sorted_arguments)
-
-            if inCache:
-                return inCache, False
+        if not self._is_cachable(kwargs):
+            return super(CachingManager, self).get_or_create(defaults=defaults, **kwargs)
 
+        version = self._current_version()
+        self._warm_up(version)
+
+        lookup_value = self._lookup_value(kwargs)
+
+        obj = self._local_cache().get(lookup_value)
+        if obj is not None:
+            return obj, False
+
+        obj = CachingManager.cache.get(self._shared_key(version, lookup_value))
+        if obj is not None:
+            self._local_cache().set(lookup_value, obj)
+            return obj, False
+
+        (obj, created) = super(CachingManager, self).get_or_create(defaults=defaults, **kwargs)
+        self._remember(version, lookup_value, obj)
+        return obj, created
+
+    def get_or_create_many(self, lookups, defaults=None):
+        """
+        Batch variant of ``get_or_create``: takes a list of lookup dictionaries
+        (each of the form required by ``cachable_queries``) and returns a list
+        with the corresponding objects in the same order.
+
+        Lookups that cannot be answered by the in-process tier are answered
+        by a single ``get_many`` on the shared cache and, for the remainder,
+        by a single query against the database. Only objects that do not exist at all
+        are created one by one.
+        """
+        lookups = list(lookups)
+
+        if not all(self._is_cachable(x) for x in lookups):
+            return [self.get_or_create(defaults=defaults, **x)[0] for x in lookups]
+
+        version = self._current_version()
+        self._warm_up(version)
+
+        local_cache = self._local_cache()
+
+        found = {}
+        missing = set()
+
+        for lookup in lookups:
+            lookup_value = self._lookup_value(lookup)
+            if lookup_value in found or lookup_value in missing:
+                continue
+            obj = local_cache.get(lookup_value)
+            if obj is not None:
+                found[lookup_value] = obj
             else:
-                (object, created)  = super(CachingManager, self).get_or_create(defaults=defaults, **kwargs)
-                CachingManager.cache.get(self.model.__name__)[sorted_arguments] = object
-                return object, created
-        else:
-            (object, created)  = super(CachingManager, self).get_or_create(defaults=defaults, **kwargs)
+                missing.add(lookup_value)
+
+        if missing:
+            key_map = dict((self._shared_key(version, x), x) for x in missing)
+            for key, obj in CachingManager.cache.get_many(key_map.keys()).items():
+                found[key_map[key]] = obj
+                local_cache.set(key_map[key], obj)
+            missing.difference_update(found.keys())
+
+        if missing:
+            lookup_fields = self._lookup_fields
+            q_obj = Q()
+            for lookup_value in missing:
+                q_obj |= Q(**dict(zip(lookup_fields, lookup_value)))
+            for obj in super(CachingManager, self).get_queryset().filter(q_obj):
+                lookup_value = tuple(getattr(obj, field) for field in lookup_fields)
+                found[lookup_value] = obj
+                self._remember(version, lookup_value, obj)
+            missing.difference_update(found.keys())
+
+            for lookup_value in missing:
+                (obj, created) = super(CachingManager, self).get_or_create(defaults=defaults,
+                                                                            **dict(zip(lookup_fields, lookup_value)))
+                found[lookup_value] = obj
+                self._remember(version, lookup_value, obj)
+
+        return [found[self._lookup_value(x)] for x in lookups]
 
 
 class ActionableTaggableManager(_TaggableManager):
@@ -214,6 +444,8 @@ class ActionableTag(TagBase):
         # Create the list of actionable tags for this bulk action
         actionable_tag_list = []
 
+        context_map = {}
+
         context_name_set = set([])
         for (context_name,tag_name) in context_name_pairs:
 
@@ -222,6 +454,7 @@ class ActionableTag(TagBase):
                                                                                                           Context.TYPE_INVESTIGATION)})
 
             context_name_set.add(context_name)
+            context_map[context.id] = context
 
             tag_info, created = TagInfo.cached_objects.get_or_create(name=tag_name)
 
@@ -237,48 +470,70 @@ class ActionableTag(TagBase):
         elif action == 'remove':
             action_flag = ActionableTaggingHistory.REMOVE
 
-        for pk in thing_to_tag_pks:
-            for actionable_tag in actionable_tag_list:
-                affected_tags = set([])
-                if action_flag == ActionableTaggingHistory.ADD:
+        # The pks may be handed in as strings (e.g., from POST data); we need
+        # integers to compare them with what we read back from the database.
+        thing_to_tag_pks = set(map(int, thing_to_tag_pks))
+
+        actionable_tag_map = dict((x.id, x) for x in actionable_tag_list)
+
+        # All tagging operations below are set-based: the number of queries
+        # does not depend on the number of things to tag.
+
+        with transaction.atomic():
 
-                    tagged_actionable_item, created = TaggedActionableItem.objects.get_or_create(tag_id=actionable_tag.id,
-                                                               object_id=pk,
+            tagged_items = TaggedActionableItem.objects.filter(object_id__in=thing_to_tag_pks,
                                                                content_type=CONTENT_TYPE_OF_THINGS_TO_TAG)
 
-                    if created:
-                        affected_tags.add(actionable_tag)
+            if action_flag == ActionableTaggingHistory.ADD:
+
+                existing_pairs = set(tagged_items.filter(tag_id__in=actionable_tag_map.keys())
+                                     .values_list('object_id','tag_id'))
+
+                affected_pairs = set([(pk,tag_pk) for pk in thing_to_tag_pks
+                                                  for tag_pk in actionable_tag_map.keys()]).difference(existing_pairs)
+
+                TaggedActionableItem.objects.bulk_create([TaggedActionableItem(tag_id=tag_pk,
+                                                                               object_id=pk,
+                                                                               content_type=CONTENT_TYPE_OF_THINGS_TO_TAG)
+                                                          for (pk,tag_pk) in affected_pairs])
+
+                logger.debug("Created %s tagged actionable items" % len(affected_pairs))
+
+            elif action_flag == ActionableTaggingHistory.REMOVE:
+
+                removal_q = Q(tag_id__in=actionable_tag_map.keys())
 
-                    logger.debug("tagged_actionable_item %s, created: %s" % (tagged_actionable_item.pk,created))
+                # A tag whose name equals the name of its context marks the context
+                # itself: if it is removed, the whole context is removed and
+                # we therefore need to remove all tags in the context
 
-                elif action_flag == ActionableTaggingHistory.REMOVE:
-                    tagged_actionable_item = TaggedActionableItem.objects.filter(tag_id=actionable_tag.id,
-                                                                              object_id=pk,
-                                                                              content_type=CONTENT_TYPE_OF_THINGS_TO_TAG)
+                context_wide_removals = set([x.context_id for x in actionable_tag_list
+                                             if x.name == context_map[x.context_id].name])
+                if context_wide_removals:
+                    removal_q |= Q(tag__context_id__in=context_wide_removals)
 
-                    if tagged_actionable_item:
-                        tagged_actionable_item.delete()
-                        affected_tags.add(actionable_tag)
+                items_to_remove = tagged_items.filter(removal_q)
 
-                    if actionable_tag.name == actionable_tag.context.name:
-                        # This tag marks an context and the whole context is deleted:
-                        # We therefore need to remove all tags in the context
-                        tagged_actionable_items = TaggedActionableItem.objects.filter(tag__context=actionable_tag.context,
-                                                                                     object_id=pk,
-                                                                                     content_type=CONTENT_TYPE_OF_THINGS_TO_TAG)
+                affected_pairs = set(items_to_remove.values_list('object_id','tag_id'))
 
-                        for tagged_actionable_item in tagged_actionable_items:
-                            affected_tags.add(tagged_actionable_item.tag)
-                            tagged_actionable_item.delete()
+                missing_tag_pks = set([tag_pk for (pk,tag_pk) in affected_pairs]).difference(actionable_tag_map.keys())
+                if missing_tag_pks:
+                    actionable_tag_map.update(ActionableTag.objects.in_bulk(missing_tag_pks))
+
+                if affected_pairs:
+                    items_to_remove.delete()
+
+                logger.debug("Removed %s tagged actionable items" % len(affected_pairs))
 
             logger.debug("Updating history")
-            ActionableTaggingHistory.bulk_create_tagging_history(action_flag,
-                                                                 affected_tags,
-                                                                 [pk],
-                                                                 thing_to_tag_model,
-                                                                 user,
-                                                                 comment)
+            ActionableTaggingHistory.bulk_create_tagging_history_for_pairs(action_flag,
+                                                                           [(pk,actionable_tag_map[tag_pk])
+                                                                            for (pk,tag_pk) in affected_pairs],
+                                                                           thing_to_tag_model,
+                                                                           user,
+                                                                           comment)
             logger.debug("History updated")
+
         if not supress_transfer_to_dingos and CONTENT_TYPE_OF_THINGS_TO_TAG == ContentType.objects.get_for_model(SingletonObservable):
             update_and_transfer_tag_action_to_dingos(action,
                                                      context_name_set,
@@ -287,19 +542,7 @@ class ActionableTag(TagBase):
                                                      comment=comment)
 
         if CONTENT_TYPE_OF_THINGS_TO_TAG == ContentType.objects.get_for_model(SingletonObservable):
-            singletons = SingletonObservable.objects.filter(pk__in=thing_to_tag_pks)
-
-            for singleton in singletons:
-                actionable_tag_list_repr = list(singleton.actionable_tags.names())
-                actionable_tag_list_repr.sort()
-
-                updated_tag_info = ",".join(actionable_tag_list_repr)
-
-                singleton.actionable_tags_cache = updated_tag_info
-
-                logger.debug("For singleton with pk %s found tags %s" % (singleton.pk,updated_tag_info))
-
-                singleton.save()
+            SingletonObservable.update_actionable_tags_cache(thing_to_tag_pks)
 
 
 class TaggedActionableItem(GenericTaggedItemBase):
@@ -309,6 +552,25 @@ class TaggedActionableItem(GenericTaggedItemBase):
     class Meta:
         verbose_name = _("TaggedActionableItem")
         verbose_name_plural = _("TaggedActionableItems")
+        # This table is the membership index for actionable tags: searches
+        # by tag resolve the tag ids first and read the tagged objects
+        # from this index (see ``tagged_with_q``).
+        index_together = (('tag','content_type','object_id'),)
+
+    @classmethod
+    def tagged_with_q(cls, model, **tag_lookup):
+        """
+        Return a Q object that selects the objects of ``model`` that carry an
+        actionable tag matching ``tag_lookup`` (e.g., ``name__icontains='foo'``).
+
+        The matching tags are determined first (the tag table is small); the
+        tagged objects are then selected via the membership index rather
+        than by searching a text column of ``model``.
+        """
+        tag_pks = list(ActionableTag.objects.filter(**tag_lookup).values_list('pk',flat=True))
+        object_pks = cls.objects.filter(tag_id__in=tag_pks,
+                                        content_type=ContentType.objects.get_for_model(model)).values('object_id')
+        return Q(pk__in=object_pks)
 
 
 class Action(models.Model):
@@ -352,6 +614,9 @@ class STIX_Entity(models.Model):
         return "%s: %s" % (self.entity_type.name, self.essence)
 
     class Meta:
+        # NULLs are distinct for this constraint; entities without an
+        # iobject_identifier are kept unique by a partial index (see
+        # migration 0041_stix_entity_non_iobject_unique)
         unique_together = ('iobject_identifier','non_iobject_identifier')
 
 class Source(models.Model):
@@ -486,6 +751,62 @@ def get_null_time():
 
     return NULL_TIME
 
+
+# Fields of a Status that make up its content; two Status objects
+# with the same values in these fields are regarded as identical.
+
+STATUS_FINGERPRINT_DEFAULTS = {
+    'false_positive' : None,
+    'active' : True,
+    'active_from' : NULL_TIME,
+    'active_to' : INF_TIME,
+    'tags' : '',
+    'priority' : 0,
+    'most_permissive_tlp' : 0,
+    'most_restrictive_tlp' : 0,
+    'max_confidence' : 0,
+    'kill_chain_phases' : '',
+    'best_processing' : 0,
+}
+
+
+def _normalize_separated_list(value, separator):
+    return separator.join(sorted(set(x for x in (value or '').split(separator) if x)))
+
+
+def _normalize_time(value):
+    if timezone.is_aware(value):
+        value = value.astimezone(timezone.utc)
+    # strftime refuses years before 1900 on Python 2 (NULL_TIME is year 1)
+    return '%04d-%02d-%02dT%02d:%02d:%02d.%06d' % (value.year, value.month, value.day,
+                                                   value.hour, value.minute, value.second, value.microsecond)
+
+
+def calculate_status_fingerprint(values):
+    """
+    Calculate a stable hash over the normalized content of a status, given as dictionary
+    of field values; fields missing in the dictionary are taken to have their default value.
+    """
+    normalized = []
+    for field in sorted(STATUS_FINGERPRINT_DEFAULTS.keys()):
+        value = values.get(field, STATUS_FINGERPRINT_DEFAULTS[field])
+        if field == 'kill_chain_phases':
+            value = _normalize_separated_list(value, ';')
+        elif field == 'tags':
+            value = _normalize_separated_list(value, ',')
+        elif field in ('active_from', 'active_to'):
+            value = _normalize_time(value)
+        elif field == 'false_positive':
+            value = None if value is None else bool(value)
+        elif field == 'active':
+            value = bool(value)
+        else:
+            value = int(value)
+        normalized.append([field, value])
+
+    return hashlib.sha1(json.dumps(normalized, sort_keys=True)).hexdigest()
+
+
 class Status(models.Model):
 
     false_positive = models.NullBooleanField(help_text = "If true, the associated information (usually a "
@@ -585,6 +906,22 @@ class Status(models.Model):
 
     best_processing = models.SmallIntegerField(choices=PROCESSING_KIND,default=PROCESSING_UNKNOWN)
 
+    # Stati are content-addressed: the fingerprint is a hash over all
+    # value fields above (see ``calculate_status_fingerprint``) and
+    # is set automatically when saving.
+
+    fingerprint = models.CharField(max_length=40,
+                                   unique=True,
+                                   editable=False)
+
+    def calculate_fingerprint(self):
+        return calculate_status_fingerprint(dict((field, getattr(self, field))
+                                                 for field in STATUS_FINGERPRINT_DEFAULTS.keys()))
+
+    def save(self, *args, **kwargs):
+        self.fingerprint = self.calculate_fingerprint()
+        return super(Status, self).save(*args, **kwargs)
+
 
 
 
@@ -613,7 +950,10 @@ class Status2X(models.Model):
         return "Status2X: id %s, active %s, status_id %s, marked_id %s" % (self.id,self.active,self.status_id,self.marked.id)
 
     class Meta:
-        unique_together=('action','status','timestamp')
+        # Status transitions are written in batches, in which many
+        # Status2X objects share action, status and timestamp, so these
+        # cannot be unique; we index the lookup of the active status instead.
+        index_together = (('content_type','object_id','active'),)
 
 
 class SingletonObservableType(models.Model):
@@ -682,6 +1022,28 @@ class SingletonObservable(models.Model):
 
 
 
+    @classmethod
+    def update_actionable_tags_cache(cls,singleton_pks):
+        """
+        Recalculate the sorted, comma-separated list of actionable tag names
+        stored in ``actionable_tags_cache`` for the given singleton observables.
+        """
+        CONTENT_TYPE_SINGLETON_OBSERVABLE = ContentType.objects.get_for_model(SingletonObservable)
+
+        pk2tag_names = dict((pk, set()) for pk in singleton_pks)
+
+        tag_infos = TaggedActionableItem.objects.filter(content_type=CONTENT_TYPE_SINGLETON_OBSERVABLE,
+                                                        object_id__in=pk2tag_names.keys()).values_list('object_id','tag__name')
+
+        for pk, tag_name in tag_infos:
+            pk2tag_names[pk].add(tag_name)
+
+        pk2cache = dict((pk, ",".join(sorted(tag_names))) for (pk, tag_names) in pk2tag_names.items())
+
+        logger.debug("Updating actionable tag cache for %s singletons" % len(pk2cache))
+
+        grouped_update(cls.objects.all(), 'actionable_tags_cache', pk2cache)
+
     def update_status(self,update_function,action=None,user=None,**kwargs):
         # The content type must be defined here: defining it outside the function
         # leads to a circular import
@@ -908,6 +1270,284 @@ class ActionableTaggingHistory(models.Model):
                                                             tag=x) for x in tags])
         ActionableTaggingHistory.objects.bulk_create(entry_list)
 
+    @classmethod
+    def bulk_create_tagging_history_for_pairs(cls,action_flag,pk_tag_pairs,
+                                              thing_to_tag_model=None,
+                                              user=None,comment=''):
+        """
+        Like ``bulk_create_tagging_history``, but takes a list of pairs
+        ``(pk,tag)`` rather than the cross product of pks and tags: thus,
+        a single history batch can be written for a tag action in which
+        different things were affected by different tags.
+        """
+
+        if not thing_to_tag_model:
+            CONTENT_TYPE_OF_THINGS_TO_TAG = ContentType.objects.get_for_model(SingletonObservable)
+        else:
+            CONTENT_TYPE_OF_THINGS_TO_TAG = ContentType.objects.get_for_model(thing_to_tag_model)
+
+        entry_list = [ActionableTaggingHistory(action=action_flag,user=user,comment=comment,
+                                               object_id=pk,
+                                               content_type=CONTENT_TYPE_OF_THINGS_TO_TAG,
+                                               tag=tag) for (pk,tag) in pk_tag_pairs]
+        ActionableTaggingHistory.objects.bulk_create(entry_list)
+
+
+
+
+class ImportLedgerEntry(models.Model):
+    """
+    Records that a top-level report revision (i.e., a specific InfoObject)
+    has been imported into mantis_actionables, so that incremental
+    imports never process the same revision twice.
+
+    Failed imports are recorded as well: while ``error`` is set, the
+    revision has not been imported and is tried again by later runs
+    until ``failed_attempts`` reaches ``MANTIS_ACTIONABLES_IMPORT_MAX_ATTEMPTS``.
+    """
+
+    iobject = models.OneToOneField(InfoObject,
+                                   related_name='actionables_import_ledger_entry')
+
+    # Copy of the create_timestamp of the InfoObject: ledger lookups
+    # are restricted to the time window being imported.
+
+    iobject_create_timestamp = models.DateTimeField(db_index=True)
+
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    failed_attempts = models.PositiveIntegerField(default=0)
+
+    error = models.TextField(blank=True, default='')
+
+
+class ImportWatermark(models.Model):
+    """
+    State of an incremental import: the high-water mark up to which
+    all reports have been imported (or, for imports from files, the
+    position up to which the file has been imported) and a lease that
+    prevents overlapping runs from importing the same data.
+    """
+
+    name = models.SlugField(max_length=40, unique=True)
+
+    high_water_mark = models.DateTimeField(null=True)
+
+    position = models.BigIntegerField(default=0)
+
+    lease_holder = models.CharField(max_length=255, blank=True, default='')
+
+    lease_expires = models.DateTimeField(null=True)
+
+    @classmethod
+    def acquire_lease(cls, name, holder, duration):
+        """
+        Try to acquire the lease for the import ``name`` for ``duration``
+        (a timedelta). The lease is taken with a single conditional
+        update, so of several concurrent callers at most one succeeds.
+
+        Returns the watermark object if the lease was acquired, else None.
+        """
+        cls.objects.get_or_create(name=name)
+        now = timezone.now()
+        acquired = cls.objects.filter(name=name)\
+                              .filter(Q(lease_expires__isnull=True) | Q(lease_expires__lt=now) | Q(lease_holder=holder))\
+                              .update(lease_holder=holder, lease_expires=now + duration)
+        if acquired:
+            return cls.objects.get(name=name)
+        return None
+
+    def renew_lease(self, duration):
+        """
+        Extend the lease held by this watermark object; returns False if
+        the lease has been lost in the meantime.
+        """
+        self.lease_expires = timezone.now() + duration
+        return bool(ImportWatermark.objects.filter(pk=self.pk,
+                                                   lease_holder=self.lease_holder)\
+                                           .update(lease_expires=self.lease_expires))
+
+    def release_lease(self):
+        ImportWatermark.objects.filter(pk=self.pk,
+                                       lease_holder=self.lease_holder).update(lease_holder='',
+                                                                              lease_expires=None)
+
+    def checkpoint(self, position, duration):
+        """
+        Store the position up to which the import has been carried out and
+        extend the lease; returns False if the lease has been lost in the meantime.
+
+        Called within the transaction that writes the imported data, the
+        position is committed together with the data.
+        """
+        self.position = position
+        self.lease_expires = timezone.now() + duration
+        return bool(ImportWatermark.objects.filter(pk=self.pk,
+                                                   lease_holder=self.lease_holder)\
+                                           .update(position=position,
+                                                   lease_expires=self.lease_expires))
+
+    def advance(self, high_water_mark):
+        """
+        Store a new high-water mark; the mark never moves backwards.
+        """
+        if self.high_water_mark and high_water_mark <= self.high_water_mark:
+            return
+        self.high_water_mark = high_water_mark
+        ImportWatermark.objects.filter(pk=self.pk).update(high_water_mark=high_water_mark)
+
+
+class InfoObjectTLP(models.Model):
+    """
+    Materialized mapping from InfoObjects to the TLP color found in their markings.
+
+    Deriving the color requires a join over five tables (markings, facts, fact
+    terms and fact values); since the markings of an InfoObject never change,
+    the result is stored here when the InfoObject is imported into the
+    actionables (and by the ``rebuild_tlp_table`` command). InfoObjects
+    without TLP marking are stored with an empty color.
+    """
+
+    iobject = models.OneToOneField(InfoObject,
+                                   primary_key=True,
+                                   related_name='actionables_tlp')
 
+    iobject_identifier = models.ForeignKey(Identifier,
+                                           related_name='actionables_tlp')
+
+    color = models.CharField(max_length=40, blank=True, default='')
+
+    @classmethod
+    def compute(cls, iobject_pks):
+        """
+        Determine the TLP colors of the given InfoObjects from their markings
+        (without storing them); returns a dictionary mapping each InfoObject pk
+        to a pair (identifier pk, TLP color).
+        """
+        iobject_pks = set(iobject_pks)
+        if not iobject_pks:
+            return {}
+
+        colors = dict(InfoObject.objects.filter(id__in=iobject_pks)\
+                      .filter(marking_thru__marking__fact_thru__fact__fact_term__term='Marking_Structure',
+                              marking_thru__marking__fact_thru__fact__fact_term__attribute='color')\
+                      .values_list('id','marking_thru__marking__fact_thru__fact__fact_values__value'))
+
+        return dict((pk, (identifier_pk, colors.get(pk) or ''))
+                    for (pk, identifier_pk) in InfoObject.objects.filter(id__in=iobject_pks).values_list('id','identifier_id'))
+
+    @classmethod
+    def materialize(cls, iobject_pks):
+        """
+        Determine the TLP colors of the given InfoObjects from their markings
+        and store them, replacing existing entries.
+        """
+        iobject_pks = set(iobject_pks)
+        if not iobject_pks:
+            return {}
+
+        entries = [cls(iobject_id=pk, iobject_identifier_id=identifier_pk, color=color)
+                   for (pk, (identifier_pk, color)) in cls.compute(iobject_pks).items()]
+
+        try:
+            with transaction.atomic():
+                cls.objects.filter(iobject_id__in=iobject_pks).delete()
+                cls.objects.bulk_create(entries)
+        except IntegrityError:
+            # Another process has materialized some of the InfoObjects in the meantime
+            for entry in entries:
+                cls.objects.update_or_create(iobject_id=entry.iobject_id,
+                                             defaults={'iobject_identifier_id': entry.iobject_identifier_id,
+                                                       'color': entry.color})
+
+        return dict((entry.iobject_id, (entry.iobject_identifier_id, entry.color)) for entry in entries)
+
+    @classmethod
+    def get_tlp_info(cls, iobject_pks, store=False):
+        """
+        Return a dictionary mapping each of the given InfoObject pks to a pair
+        (identifier pk, TLP color); the colors of InfoObjects that have not been
+        materialized yet are computed, and stored only if ``store`` is set
+        (as is done by the import; views must not write).
+        """
+        iobject_pks = set(iobject_pks)
+        result = dict((x[0], x[1:]) for x in cls.objects.filter(iobject_id__in=iobject_pks)\
+                                                        .values_list('iobject_id','iobject_identifier_id','color'))
+        missing = iobject_pks - set(result.keys())
+        if missing:
+            result.update(cls.materialize(missing) if store else cls.compute(missing))
+        return result
+
+    @classmethod
+    def get_colors(cls, iobject_pks):
+        """
+        Return a dictionary mapping those of the given InfoObject pks that carry
+        a TLP marking to their TLP color (without writing).
+        """
+        return dict((pk, color) for (pk, (identifier_pk, color)) in cls.get_tlp_info(iobject_pks).items() if color)
+
+
+class SearchIndexEntry(models.Model):
+    """
+    Entry of the shadow search index used on databases without trigram
+    indexes (see ``mantis_actionables.core.search``): the searchable text of
+    an object of a given kind ('observable', 'report', 'import_info').
+
+    On SQLite, the table is an FTS5 table with trigram tokenizer and is
+    created by the migration; on PostgreSQL, the searchable columns carry
+    trigram indexes instead and the table does not exist.
+    """
+
+    id = models.AutoField(primary_key=True, db_column='rowid')
+
+    kind = models.CharField(max_length=20)
+
+    object_id = models.IntegerField()
+
+    text = models.TextField()
+
+    class Meta:
+        managed = False
+        db_table = 'mantis_actionables_searchindex'
+
+
+class IPRange(models.Model):
+    """
+    Address range of an IP or IP block observable (see
+    ``mantis_actionables.core.ip_ranges``), so that containment and overlap
+    of addresses and networks can be queried with range scans.
+
+    Start and end address are stored as 128-bit integers written as 32
+    hexadecimal digits: IPv6 addresses do not fit into the integer types
+    of the databases, but fixed-width hexadecimal strings compare in the same
+    order as the numbers they stand for.
+    """
+
+    singleton_observable = models.OneToOneField(SingletonObservable,
+                                                primary_key=True,
+                                                related_name='ip_range')
+
+    version = models.SmallIntegerField()
+
+    start = models.CharField(max_length=32)
+
+    end = models.CharField(max_length=32)
+
+    class Meta:
+        index_together = [('version', 'start', 'end'),
+                          ('version', 'end')]
+
+
+class DomainSuffix(models.Model):
+    """
+    Domain of an FQDN, URL or email address observable with reversed labels
+    (``example.evil.sub`` for ``sub.evil.example``; see
+    ``mantis_actionables.core.domains``), so that all observables under a
+    domain can be found with a prefix scan.
+    """
 
+    singleton_observable = models.OneToOneField(SingletonObservable,
+                                                primary_key=True,
+                                                related_name='domain_suffix')
 
+    reversed_domain = models.CharField(max_length=255, db_index=True)
@@ -35,7 +35,24 @@ read_from_conf('ACTIVE_EXPORTERS')
 read_from_conf('DASHBOARD_CONTENTS')
 read_from_conf('CONTEXT_TAG_REGEX')
 read_from_conf('STATUS_UPDATE_FUNCTION_PATH')
+read_from_conf('STATUS_BATCH_UPDATE_FUNCTION_PATH')
 read_from_conf('SRC_META_DATA_FUNCTION_PATH')
+read_from_conf('IMPORT_LEASE_SECONDS')
+read_from_conf('IMPORT_WATERMARK_OVERLAP_SECONDS')
+read_from_conf('IMPORT_MAX_ATTEMPTS')
+read_from_conf('PARALLEL_IMPORT_CHUNK_SIZE')
+read_from_conf('BULK_IMPORT_CHUNK_SIZE')
+read_from_conf('FEEDS')
+read_from_conf('DATATABLE_COUNT_LIMIT')
+read_from_conf('DATATABLE_CACHE_SECONDS')
+read_from_conf('SEARCH_BACKEND')
+read_from_conf('IP_RANGE_TYPES')
+read_from_conf('DOMAIN_TYPES')
+read_from_conf('LOOKUP_ARTIFACT_PATH')
+read_from_conf('BULK_LOOKUP_MAX_VALUES')
+read_from_conf('BULK_LOOKUP_CHUNK_SIZE')
+read_from_conf('API_TOKENS')
+read_from_conf('EXPORT_KINDS')
 
 
 
@@ -66,9 +66,16 @@
                         });
 
                         // Show total in headline
+                        var filtered_count = data.recordsFiltered;
+                        if(data.recordsFilteredCapped)
+                            filtered_count = 'more than ' + data.recordsFilteredCapped;
+                        else if(data.recordsFilteredEstimated)
+                            filtered_count = '~' + filtered_count;
                         var hl_count = data.recordsTotal;
-                        if(data.recordsFiltered != data.recordsTotal)
-                            hl_count = data.recordsFiltered + ' of ' + hl_count;
+                        if(data.recordsTotal < 0)
+                            hl_count = filtered_count;
+                        else if(data.recordsFiltered != data.recordsTotal)
+                            hl_count = filtered_count + ' of ' + hl_count;
                         $(tbl).parents('.result_box').first().find('.res_num').first().text('('+hl_count+')');
 
                         // get and display TLP color
@@ -19,14 +19,144 @@
 
 import json
 import importlib
+import logging
+
+from django.db import transaction, connection, IntegrityError
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.contrib.contenttypes.models import ContentType
 
 from mantis_actionables import MANTIS_ACTIONABLES_STATUS_UPDATE_FUNCTION_PATH, \
+                               MANTIS_ACTIONABLES_STATUS_BATCH_UPDATE_FUNCTION_PATH, \
                                MANTIS_ACTIONABLES_SRC_META_DATA_FUNCTION_PATH
 
 
-from mantis_actionables.models import Status, Source
+from mantis_actionables.models import Status, Status2X, Source, Action, EntityType, SingletonObservable, \
+                                      calculate_status_fingerprint
+
+from mantis_actionables.core.lru import LRUCache
+from mantis_actionables.core.observables import chunks
+
+logger = logging.getLogger(__name__)
+
+
+def load_function(function_path):
+    mod_name, func_name = function_path.rsplit('.',1)
+    mod = importlib.import_module(mod_name)
+    return getattr(mod,func_name)
+
+
+def initial_status_values(status):
+    """
+    Return the status values from which a status derivation starts: either
+    the values of an existing status or the defaults for a new one.
+    """
+    if status:
+        return {'most_permissive_tlp' : status.most_permissive_tlp,
+                'most_restrictive_tlp' : status.most_restrictive_tlp,
+                'kill_chain_phases' : set(x for x in status.kill_chain_phases.split(';') if x),
+                'max_confidence' : status.max_confidence,
+                'active' : status.active,
+                'priority' : status.priority,
+                'false_positive' : status.false_positive,
+                'best_processing' : status.best_processing}
+    else:
+        return {'most_permissive_tlp' : Status.TLP_UNKOWN,
+                'most_restrictive_tlp' : Status.TLP_UNKOWN,
+                'kill_chain_phases' : set([]),
+                'max_confidence' : Status.CONFIDENCE_UNKOWN,
+                'active' : True,
+                'priority' : Status.PRIORITY_UNCERTAIN,
+                'false_positive' : False,
+                'best_processing' : Status.PROCESSING_UNKNOWN}
+
+
+def fold_source_into_status_values(values, source_obj):
+    """
+    Update status values with the TLP and processing information of a source.
+    """
+    values['most_permissive_tlp'] = max(source_obj.tlp,values['most_permissive_tlp'])
+    if source_obj.tlp != Source.TLP_UNKOWN and values['most_restrictive_tlp'] != Source.TLP_UNKOWN:
+        values['most_restrictive_tlp'] = min(source_obj.tlp,values['most_restrictive_tlp'])
+    else:
+        # One of the two tlp values is 0, so the most restrictive tlp is
+        # actually the maximum
+        values['most_restrictive_tlp'] = max(source_obj.tlp,values['most_restrictive_tlp'])
+
+    values['best_processing'] = max(source_obj.processing, values['best_processing'])
+
+
+def fold_essence_into_status_values(values, essence):
+    """
+    Update status values with the information contained in the essence of
+    a related Indicator entity.
+    """
+    if 'kill_chain_phases' in essence:
+        values['kill_chain_phases'].update(x for x in essence['kill_chain_phases'].split(';') if x)
+
+    if 'confidence' in essence:
+        values['max_confidence'] = max(values['max_confidence'],Status.CONFIDENCE_RMAP[essence['confidence'].lower()])
+
+
+def status_values_to_creation_kwargs(values):
+    creation_kwargs = dict(values)
+    creation_kwargs['kill_chain_phases'] = ';'.join(sorted(values['kill_chain_phases']))
+    return creation_kwargs
+
+
+# Fingerprint -> Status pk; stati are immutable and content-addressed,
+# so entries only become stale if a status is deleted.
+
+status_pk_cache = LRUCache(max_size=100000)
+
+
+@receiver(post_delete, sender=Status)
+def clear_status_pk_cache(sender, **kwargs):
+    status_pk_cache.clear()
 
 
+def intern_statuses(creation_kwargs_list, created_pks=None):
+    """
+    Return, for each dictionary of status values in ``creation_kwargs_list``,
+    the primary key of the Status object carrying these values; Status objects
+    that do not exist yet are created (and their pks added to the set
+    ``created_pks``, if given).
+
+    Stati are looked up by their fingerprint: fingerprints already seen by
+    this process are served from an in-process LRU, the remaining ones
+    are resolved with a single query, and only stati that really do not
+    exist yet are created.
+    """
+    fingerprints = [calculate_status_fingerprint(x) for x in creation_kwargs_list]
+
+    fingerprint2pk = {}
+    fingerprint2kwargs = {}
+    for fingerprint, creation_kwargs in zip(fingerprints, creation_kwargs_list):
+        if fingerprint in fingerprint2pk or fingerprint in fingerprint2kwargs:
+            continue
+        pk = status_pk_cache.get(fingerprint)
+        if pk is not None:
+            fingerprint2pk[fingerprint] = pk
+        else:
+            fingerprint2kwargs[fingerprint] = creation_kwargs
+
+    if fingerprint2kwargs:
+        existing = dict(Status.objects.filter(fingerprint__in=fingerprint2kwargs.keys()).values_list('fingerprint','pk'))
+        for fingerprint, creation_kwargs in fingerprint2kwargs.items():
+            pk = existing.get(fingerprint)
+            if pk is None:
+                try:
+                    with transaction.atomic():
+                        pk = Status.objects.create(**creation_kwargs).pk
+                    if created_pks is not None:
+                        created_pks.add(pk)
+                except IntegrityError:
+                    # Somebody else has created the status in the meantime
+                    pk = Status.objects.get(fingerprint=fingerprint).pk
+            fingerprint2pk[fingerprint] = pk
+        status_pk_cache.update(dict((x, fingerprint2pk[x]) for x in fingerprint2kwargs.keys()))
+
+    return [fingerprint2pk[x] for x in fingerprints]
 
 
 def updateStatus(status,*args,**kwargs):
@@ -46,90 +176,238 @@ def updateStatus(status,*args,**kwargs):
     else:
         related_entities = []
 
-
-    if status:
-        most_permissive_tlp = status.most_permissive_tlp
-        most_restrictive_tlp = status.most_restrictive_tlp
-        kill_chain_phases = set(status.kill_chain_phases.split(';'))
-        max_confidence = status.max_confidence
-        active = status.active
-        priority = status.priority
-        false_positive = status.false_positive
-        best_processing = status.best_processing
-    else:
-        most_permissive_tlp = Status.TLP_UNKOWN
-        most_restrictive_tlp = Status.TLP_UNKOWN
-        kill_chain_phases = set([])
-        max_confidence = Status.CONFIDENCE_UNKOWN
-        active=True
-        priority = Status.PRIORITY_UNCERTAIN
-        false_positive = False
-        best_processing = Status.PROCESSING_UNKNOWN
+    values = initial_status_values(status)
 
     if source_obj:
-        most_permissive_tlp = max(source_obj.tlp,most_permissive_tlp)
-        if source_obj.tlp != Source.TLP_UNKOWN and most_restrictive_tlp != Source.TLP_UNKOWN:
-            most_restrictive_tlp = min(source_obj.tlp,most_restrictive_tlp)
-        else:
-            # One of the two tlp values is 0, so the most restrictive tlp is
-            # actually the maximum
-            most_restrictive_tlp = max(source_obj.tlp,most_restrictive_tlp)
-
-        best_processing = max(source_obj.processing, best_processing)
-
+        fold_source_into_status_values(values, source_obj)
 
     for related_entity in related_entities:
 
         if related_entity.entity_type.name == 'Indicator':
-            essence = related_entity.read_essence()
-
-            if 'kill_chain_phases' in essence:
-
-                kill_chain_phases_list = essence['kill_chain_phases'].split(';')
-
-                kill_chain_phases.update(kill_chain_phases_list)
+            fold_essence_into_status_values(values, related_entity.read_essence())
 
+    creation_kwargs = status_values_to_creation_kwargs(values)
 
+    if MANTIS_ACTIONABLES_STATUS_UPDATE_FUNCTION_PATH:
+        update_status_function = load_function(MANTIS_ACTIONABLES_STATUS_UPDATE_FUNCTION_PATH)
+        creation_kwargs = update_status_function(status,*args,default_creation_kwargs=creation_kwargs,**kwargs)
 
-            if 'confidence' in essence:
-                max_confidence = max(max_confidence,Status.CONFIDENCE_RMAP[essence['confidence'].lower()])
 
+    created_pks = set()
+    status_pk = intern_statuses([creation_kwargs], created_pks=created_pks)[0]
 
+    if status is not None and status.pk == status_pk:
+        new_status = status
+    else:
+        # Stati are content-addressed: the object carries exactly the
+        # values it has been interned with, so it need not be read back
+        new_status = Status(pk=status_pk,
+                            fingerprint=calculate_status_fingerprint(creation_kwargs),
+                            **creation_kwargs)
 
+    return (new_status, status_pk in created_pks)
 
-    kill_chain_phases = ';'.join(kill_chain_phases)
 
-    creation_kwargs = {'most_permissive_tlp' : most_permissive_tlp,
-                       'most_restrictive_tlp' : most_restrictive_tlp,
-                       'kill_chain_phases': kill_chain_phases,
-                       'max_confidence': max_confidence,
-                       'active': active,
-                       'priority': priority,
-                       'false_positive': false_positive,
-                       'best_processing': best_processing}
+def derive_creation_kwargs(status, sources, related_entities, indicator_entity_type_pk, essence_map):
+    """
+    Derive the values of the status following ``status`` from the given sources
+    and the essences of the related Indicator entities (read only once per
+    entity via ``essence_map``).
+    """
+    values = initial_status_values(status)
 
+    for source_obj in sources:
+        fold_source_into_status_values(values, source_obj)
 
-    if MANTIS_ACTIONABLES_STATUS_UPDATE_FUNCTION_PATH:
-        mod_name, func_name = MANTIS_ACTIONABLES_STATUS_UPDATE_FUNCTION_PATH.rsplit('.',1)
-        mod = importlib.import_module(mod_name)
-        update_status_function = getattr(mod,func_name)
-        creation_kwargs = update_status_function(status,*args,default_creation_kwargs=creation_kwargs,**kwargs)
+    for related_entity in related_entities:
+        if related_entity.entity_type_id != indicator_entity_type_pk:
+            continue
+        if related_entity.pk not in essence_map:
+            essence_map[related_entity.pk] = related_entity.read_essence()
+        fold_essence_into_status_values(values, essence_map[related_entity.pk])
+
+    return status_values_to_creation_kwargs(values)
+
+
+def update_status_batch(updates, action=None, user=None, **kwargs):
+    """
+    Derive new stati for many singleton observables at once.
+
+    ``updates`` is an iterable of triples ``(singleton_pk, source_obj, related_entities)``,
+    where ``source_obj`` may be ``None`` and ``related_entities`` is a list of
+    STIX_Entity objects. Several updates for the same singleton observable are
+    coalesced, so an observable that is referenced many times in an import
+    undergoes only a single status transition.
+
+    The function
+
+    - locks the affected observables (see below) and reads their active Status2X
+      objects with one query,
+    - derives the new status values (TLP, processing, confidence, kill chain phases)
+      from the coalesced sources and entities, parsing each entity essence only once,
+    - passes the derived values through the configured status update hooks,
+    - interns the resulting Status objects (each distinct status is looked up once), and
+    - deactivates outdated Status2X objects with a single update and
+      creates the new ones with a single ``bulk_create``.
+
+    If ``MANTIS_ACTIONABLES_STATUS_BATCH_UPDATE_FUNCTION_PATH`` is configured, the
+    function found there is called with the list of derived items (dictionaries with
+    keys ``object_id``, ``status``, ``sources``, ``related_entities`` and
+    ``creation_kwargs``) and must return the list of creation kwargs to be used.
+    Otherwise, if ``MANTIS_ACTIONABLES_STATUS_UPDATE_FUNCTION_PATH`` is configured,
+    that function is called for each source of each item as it would be from
+    ``updateStatus``.
+
+    Reading, deriving and writing the stati happens in one transaction while
+    the affected observables are locked, so that concurrent updates of the same
+    observable (e.g., by parallel import workers) are serialized: each one
+    derives its status from the status written by the one before. The
+    observables are locked in the order of their pks, so that workers with
+    overlapping batches cannot deadlock.
+
+    Returns the number of status transitions carried out.
+    """
+
+    # Coalesce the updates per singleton observable
+
+    coalesced = {}
+    for (singleton_pk, source_obj, related_entities) in updates:
+        entry = coalesced.setdefault(singleton_pk, {'sources': [], 'related_entities': {}})
+        if source_obj is not None:
+            entry['sources'].append(source_obj)
+        for related_entity in (related_entities or []):
+            entry['related_entities'][related_entity.pk] = related_entity
+
+    if not coalesced:
+        return 0
+
+    try:
+        with transaction.atomic():
+            lock_singleton_observables(coalesced.keys())
+            return _update_status_batch(coalesced, action, user, **kwargs)
+    except Exception:
+        # Stati created in the rolled back transaction must not be
+        # served from the cache anymore
+        status_pk_cache.clear()
+        raise
+
+
+def lock_singleton_observables(singleton_pks):
+    """
+    Lock the given singleton observables until the end of the current
+    transaction, in the order of their pks.
+    """
+    if not connection.features.has_select_for_update:
+        # E.g., SQLite, which serializes writing transactions anyway
+        return
+    for chunk in chunks(sorted(singleton_pks), 500):
+        list(SingletonObservable.objects.select_for_update().filter(pk__in=chunk).order_by('pk').values_list('pk',
+                                                                                                              flat=True))
+
+
+def _update_status_batch(coalesced, action, user, **kwargs):
+
+    CONTENT_TYPE_SINGLETON_OBSERVABLE = ContentType.objects.get_for_model(SingletonObservable)
+
+    # Retrieve the currently active status for each observable. There should
+    # be exactly one; if there are several, we keep the most recent one.
+
+    status2x_map = {}
+    surplus_status2x_pks = []
+
+    active_status2xes = Status2X.objects.filter(content_type=CONTENT_TYPE_SINGLETON_OBSERVABLE,
+                                                object_id__in=coalesced.keys(),
+                                                active=True).select_related('status').order_by('object_id','-timestamp')
+    for status2x in active_status2xes:
+        if status2x.object_id in status2x_map:
+            surplus_status2x_pks.append(status2x.pk)
+        else:
+            status2x_map[status2x.object_id] = status2x
+
+    if surplus_status2x_pks:
+        logger.critical("Multiple active status2x objects found: I keep the most recent status2x object.")
+
+    indicator_entity_type_pk = EntityType.cached_objects.get_or_create(name='Indicator')[0].pk
+
+    essence_map = {}
+
+    items = []
+
+    for singleton_pk, entry in coalesced.items():
+        status2x = status2x_map.get(singleton_pk)
+        status = status2x.status if status2x else None
+
+        related_entities = entry['related_entities'].values()
+        items.append({'object_id': singleton_pk,
+                      'status': status,
+                      'sources': entry['sources'],
+                      'related_entities': related_entities,
+                      'creation_kwargs': derive_creation_kwargs(status,
+                                                                entry['sources'],
+                                                                related_entities,
+                                                                indicator_entity_type_pk,
+                                                                essence_map)})
+
+    if MANTIS_ACTIONABLES_STATUS_BATCH_UPDATE_FUNCTION_PATH:
+        update_status_batch_function = load_function(MANTIS_ACTIONABLES_STATUS_BATCH_UPDATE_FUNCTION_PATH)
+        creation_kwargs_list = update_status_batch_function(items, **kwargs)
+    elif MANTIS_ACTIONABLES_STATUS_UPDATE_FUNCTION_PATH:
+        # The per-item hook knows only about a single source, so it is
+        # called once per source, each time starting from the status the
+        # previous call has derived -- as it would be from ``updateStatus``
+        update_status_function = load_function(MANTIS_ACTIONABLES_STATUS_UPDATE_FUNCTION_PATH)
+        creation_kwargs_list = []
+        for item in items:
+            status = item['status']
+            for source_obj in (item['sources'] or [None]):
+                creation_kwargs = update_status_function(status,
+                                                         default_creation_kwargs=derive_creation_kwargs(
+                                                             status,
+                                                             [source_obj] if source_obj else [],
+                                                             item['related_entities'],
+                                                             indicator_entity_type_pk,
+                                                             essence_map),
+                                                         source_obj=source_obj,
+                                                         related_entities=item['related_entities'],
+                                                         **kwargs)
+                status = Status(pk=intern_statuses([creation_kwargs])[0], **creation_kwargs)
+            creation_kwargs_list.append(creation_kwargs)
+    else:
+        creation_kwargs_list = [item['creation_kwargs'] for item in items]
 
+    status_pks = intern_statuses(creation_kwargs_list)
 
+    status2x_pks_to_deactivate = list(surplus_status2x_pks)
+    new_status2xes = []
 
+    for item, status_pk in zip(items, status_pks):
+        status2x = status2x_map.get(item['object_id'])
+        if status2x and status2x.status_id == status_pk:
+            continue
+        if status2x:
+            status2x_pks_to_deactivate.append(status2x.pk)
+        if not action:
+            action, action_created = Action.objects.get_or_create(user=user,comment="Status update called")
+        new_status2xes.append(Status2X(action=action,
+                                       status_id=status_pk,
+                                       active=True,
+                                       content_type=CONTENT_TYPE_SINGLETON_OBSERVABLE,
+                                       object_id=item['object_id']))
 
+    if status2x_pks_to_deactivate:
+        Status2X.objects.filter(pk__in=status2x_pks_to_deactivate).update(active=False)
+    Status2X.objects.bulk_create(new_status2xes)
 
-    new_status, created = Status.objects.get_or_create(**creation_kwargs)
+    logger.debug("Carried out %s status transitions for %s singleton observables" % (len(new_status2xes),
+                                                                                      len(items)))
 
-    return (new_status,created)
+    return len(new_status2xes)
 
 
 def createSourceMetaData(*args,**kwargs):
 
     if MANTIS_ACTIONABLES_SRC_META_DATA_FUNCTION_PATH:
-        mod_name, func_name = MANTIS_ACTIONABLES_SRC_META_DATA_FUNCTION_PATH.rsplit('.',1)
-        mod = importlib.import_module(mod_name)
-        my_function = getattr(mod,func_name)
+        my_function = load_function(MANTIS_ACTIONABLES_SRC_META_DATA_FUNCTION_PATH)
 
         return my_function(*args,**kwargs)
 
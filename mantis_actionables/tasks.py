@@ -20,9 +20,9 @@ from __future__ import absolute_import
 
 import logging
 
-from celery import shared_task
+from celery import shared_task, chord
 
-from mantis_actionables.core import crowdstrike
+from mantis_actionables.core import crowdstrike, feeds
 
 from .models import ActionableTag
 
@@ -45,6 +45,13 @@ def async_export_to_actionables(top_level_iobj_identifier_pk,
                                                     user=user)
 
 
+@shared_task
+def async_import_stix_reports(top_level_iobj_pks, action_pk=None, user_pk=None):
+    from mantis_actionables.mantis_import import import_STIX_report_chunk
+
+    return import_STIX_report_chunk(top_level_iobj_pks, action_pk=action_pk, user_pk=user_pk)
+
+
 @shared_task
 def async_tag_transfer_into_actionables(*args,**kwargs):
     from mantis_actionables.mantis_import import update_and_transfer_tags
@@ -53,8 +60,45 @@ def async_tag_transfer_into_actionables(*args,**kwargs):
 
 
 @shared_task
-def import_crowdstrike_csv(csv_file):
-    crowdstrike.import_crowdstrike_csv(csv_file)
+def async_import_feed(feed_name, path, workers=None, chunk_size=None):
+    if workers and workers > 1:
+        # The partitions are imported by tasks of their own; their
+        # results are merged once all of them have finished.
+        job = feeds.prepare_feed_partitions(feed_name, path, workers)
+        if job is None:
+            return
+        chord(async_import_feed_partition.s(feed_name,
+                                            path,
+                                            partition,
+                                            workers,
+                                            job['latest_import_date'],
+                                            job['action_pk'],
+                                            chunk_size=chunk_size)
+              for partition in range(workers))(async_merge_feed_results.s(path))
+    else:
+        feeds.import_feed(feed_name, path, chunk_size=chunk_size)
+
+
+@shared_task
+def async_import_feed_partition(*args, **kwargs):
+    return feeds.import_feed_partition(*args, **kwargs)
+
+
+@shared_task
+def async_merge_feed_results(results, path):
+    return feeds.merge_feed_results(path, results)['invalid_lines']
+
+
+@shared_task
+def async_compile_lookup_artifact(path=None, full=False):
+    from mantis_actionables.core.lookup_compiler import compile_lookup_artifact
+
+    return compile_lookup_artifact(path=path, full=full)
+
+
+@shared_task
+def import_crowdstrike_csv(csv_file, workers=None, chunk_size=None):
+    async_import_feed(crowdstrike.CROWDSTRIKE_FEED, csv_file, workers=workers, chunk_size=chunk_size)
 
 @shared_task
 
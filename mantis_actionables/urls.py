@@ -60,6 +60,12 @@ urlpatterns = patterns(
     url(r'^context/(?P<context_name>[a-zA-Z0-9_\-]+)/history$', ActionablesTagHistoryView.as_view(), name='actionables_context_history_view'),
     #url(r'^tbl_data_export$', 'table_data_source_export', name='table_data_source_export'),
 
+    url(r'^bulk_lookup/?$', BulkLookupFormView.as_view(), name='actionables_bulk_lookup_form'),
+    url(r'^bulk_lookup/values$', BulkLookupView.as_view(), name='actionables_bulk_lookup'),
+    url(r'^export/(?P<kind>[a-z_]+)\.(?P<output_format>txt|csv|rules)$',
+        ExportFeedView.as_view(),
+        name='actionables_export_feed'),
+
     #Actions
     url(r'^action/investigate$', BulkInvestigationFilterView.as_view(), name= "actionables_action_investigate"),
 
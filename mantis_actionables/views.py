@@ -33,9 +33,16 @@ from django.template import RequestContext
 from django.template.loader import render_to_string
 from django.db.models import Q
 from django.contrib.auth.models import User
-from django.core.exceptions import ObjectDoesNotExist
+from django.core.exceptions import ObjectDoesNotExist, PermissionDenied
+from django.middleware.csrf import CsrfViewMiddleware
+from django.utils.crypto import constant_time_compare
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
 from django.contrib.contenttypes.models import ContentType
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, HttpResponseBadRequest, HttpResponseNotModified, \
+    StreamingHttpResponse, Http404
+from django.utils import timezone
+from django.utils.text import compress_sequence
 from django.core.urlresolvers import reverse
 from django.utils.html import escape
 
@@ -50,13 +57,16 @@ from dingos.core.utilities import listify, set_dict
 from dingos.templatetags.dingos_tags import show_TagDisplay
 
 
-from .models import SingletonObservable,SingletonObservableType,Source,ActionableTag,ActionableTaggingHistory,Context,Status,ImportInfo,Status2X, TagInfo
+from .models import SingletonObservable,SingletonObservableType,Source,ActionableTag,ActionableTaggingHistory,Context,Status,ImportInfo,Status2X, TagInfo, InfoObjectTLP, TaggedActionableItem
 from .filter import ActionablesContextFilter, SingletonObservablesFilter, ImportInfoFilter, BulkInvestigationFilter, ExtendedSingletonObservablesFilter
 
 from .forms import ContextEditForm, BulkTaggingForm
 
+from .core import datatables, search, bulk_lookup, exports
+
 from dingos.models import vIO2FValue, Identifier, InfoObject
 
+from . import MANTIS_ACTIONABLES_BULK_LOOKUP_MAX_VALUES, MANTIS_ACTIONABLES_API_TOKENS
 from .tasks import actionable_tag_bulk_action
 from dingos.graph_traversal import follow_references
 from dingos.graph_utils import dfs_preorder_nodes
@@ -99,43 +109,63 @@ def datatable_query(post, **kwargs):
     display_cols = kwargs.pop('display_columns')
     config = kwargs.pop('query_config')
     
-    q = config['base'].objects.all()
-
     query_modifiers = config.get('query_modifiers', [])
 
     #base_filters = config.get('filters',[])
     #base_excludes = config.get('excludes',[])
 
     count =config.get('count',True)
+    keyset_cols = config.get('keyset',[])
+    # columns whose searches are answered by the search index
+    search_cols = config.get('search',{})
+    # columns with filter operators (e.g., 'in:10.0.0.0/8')
+    operator_cols = config.get('operators',{})
     cols = dict((x, y[0]) for x, y in cols.items())
 
     display_cols = dict((x, y[0]) for x, y in display_cols.items())
 
-    for query_modifier in query_modifiers:
-        mode,q_obj = query_modifier
-        if mode == 'filter':
-            q = q.filter(q_obj)
-        elif mode == 'exclude':
-            q = q.exclude(q_obj)
-        else:
-            raise ValueError("Please provide valid query modifier: %s is not valid." % mode)
-    # extend query by kwargs['filter']
-    #for filter in base_filters:
-    #    q = q.filter(**filter)
-
-    #for exclude in base_excludes:
-    #    q = q.exclude(**exclude)
-
-
-    q = q.values_list(*(cols.values()))
-    #sources__id for join on sources table
-
-    if count:
-        q_count_all = q.count()
+    def build_query(values, conditions=(), order_cols=()):
+        # The rows of a table over a multi-valued relation (e.g., one row
+        # per source of an observable) are the rows of the join. All
+        # conditions on a row therefore go into a single filter() call
+        # (a further filter() on the relation would join it anew); the
+        # columns and the ordering reuse the joins of that call.
+        q = config['base'].objects.all()
+        filters = []
+        for query_modifier in query_modifiers:
+            mode,q_obj = query_modifier
+            if mode == 'filter':
+                filters.append(q_obj)
+            elif mode != 'exclude':
+                raise ValueError("Please provide valid query modifier: %s is not valid." % mode)
+        filters.extend(conditions)
+        if filters:
+            query = filters[0]
+            for item in filters[1:]:
+                query &= item
+            q = q.filter(query)
+        for mode,q_obj in query_modifiers:
+            if mode == 'exclude':
+                q = q.exclude(q_obj)
+        # extend query by kwargs['filter']
+        #for filter in base_filters:
+        #    q = q.filter(**filter)
+
+        #for exclude in base_excludes:
+        #    q = q.exclude(**exclude)
+
+        q = q.values_list(*values)
+        if order_cols:
+            q = q.order_by(*[('-' if descending else '') + col for (col, descending) in order_cols])
+        return q
+
+    if count is True:
+        q_count_all = datatables.count(build_query(cols.values()), True)[0]
     else:
         q_count_all = -1
 
     # Treat the filter values (WHERE clause)
+    conditions = []
     col_filters = []
     filter_q = []
     for colk, colv in post_dict.get('columns', {}).iteritems():
@@ -149,9 +179,16 @@ def datatable_query(post, **kwargs):
         # srch should have a value
 
         col_filter_treatment = display_cols[colk]
+        operator_filter = None
+        if not callable(col_filter_treatment):
+            operator_filter = datatables.operator_q(col_filter_treatment, srch, operator_cols.get(col_filter_treatment))
+
         if callable(col_filter_treatment):
             filter_q.append(col_filter_treatment(srch))
-
+        elif operator_filter:
+            filter_q.append(operator_filter)
+        elif col_filter_treatment in search_cols:
+            filter_q.append(search.search_q(search_cols[col_filter_treatment], col_filter_treatment, srch))
         else:
             col_filters.append({
                 col_filter_treatment + '__icontains' : srch
@@ -165,15 +202,14 @@ def datatable_query(post, **kwargs):
         for item in queries:
             query &= item
 
-        # Query the model
-        q = q.filter(query)
+        conditions.append(query)
 
     if filter_q:
         query = filter_q.pop()
-        for q in filter_q:
-            query &= q
+        for item in filter_q:
+            query &= item
 
-        q = q.filter(query)
+        conditions.append(query)
 
     col_search = []
     # The search value
@@ -183,23 +219,34 @@ def datatable_query(post, **kwargs):
         for n,c in display_cols.iteritems():
 
             if post_dict['columns'][n]['searchable'] == "true":
-                col_search.append({
-                    c + '__icontains' : sv
-                })
+                operator_search = None
+                if not callable(c):
+                    operator_search = datatables.operator_q(c, sv, operator_cols.get(c))
+
+                if callable(c):
+                    col_search.append(c(sv))
+                elif operator_search:
+                    col_search.append(operator_search)
+                elif c in search_cols:
+                    col_search.append(search.search_q(search_cols[c], c, sv))
+                else:
+                    col_search.append(Q(**{
+                        c + '__icontains' : sv
+                    }))
 
     if col_search:
-        queries = [Q(**filter) for filter in col_search]
+        queries = col_search
         query = queries.pop()
 
         # Or the Q object with the ones remaining in the list
         for item in queries:
             query |= item
 
-        # Query the model
-        q = q.filter(query)
+        conditions.append(query)
 
 
     # Treat the ordering of columns
+    # (pairs of column and flag for descending order)
     order_cols = []
 
     for colk, colv in post_dict.get('order', {}).iteritems():
@@ -209,33 +256,60 @@ def datatable_query(post, **kwargs):
         if not scol:
             scol = cols[0]
         sdir = colv.get('dir')
-        if sdir == 'desc':
-            order_cols.append('-' + scol)
-        else: #asc + fallback
-            order_cols.append(scol)
-    if order_cols:
-        q = q.order_by(*order_cols)
-
-    if True:
-        q_count_filtered = q.count()
-    else:
-        q_count_filtered = 100
+        order_cols.append((scol, sdir == 'desc')) #asc + fallback
+
+    # For keyset pagination, the ordering must be total: the columns
+    # that identify a row are used as tie breakers
+    for keyset_col in keyset_cols:
+        if not keyset_col in [x[0] for x in order_cols]:
+            order_cols.append((keyset_col, False))
+
+    q = build_query(cols.values(), conditions, order_cols)
+
+    q_count_filtered, count_inexact = datatables.count(q, count)
+
     # Treat the paging/limit
     length = safe_cast(post_dict.get('length'), int)
     start = safe_cast(post_dict.get('start'), int, 0)
     if start<0:
         start = 0
-    if length>0:
-        q = q[start:start+length]
-        params.append(length)
-        params.append(start)
 
-    #sources__id for join on sources table
-    #values_list() has to be called here, otherwise the query isn't correct
-    q = q.values_list(*(cols.values()))
+    if keyset_cols and length>0:
+        # Seek behind the nearest page boundary known for this query and
+        # skip only the rows between the boundary and the requested page.
+        key_cols = [x[0] for x in order_cols]
+        nulls_high = datatables.nulls_sort_high(q.db)
+        boundaries = datatables.PageBoundaries(datatables.query_key(q),
+                                               version=datatables.data_version(config['base']))
+        position, boundary = boundaries.nearest(start)
+        if start-position > length:
+            # Rather than skipping the rows up to a page far from any
+            # known boundary with OFFSET, walk to the page on the sort key
+            # columns alone and remember the boundaries on the way.
+            seek = [datatables.seek_q(order_cols, boundary, nulls_high=nulls_high)] if boundary is not None else []
+            keys = build_query(key_cols, conditions + seek, order_cols)[:start-position]
+            position, boundary = boundaries.walk(keys.iterator(), position, boundary, start, length)
+        seek = [datatables.seek_q(order_cols, boundary, nulls_high=nulls_high)] if boundary is not None else []
+        q = build_query(cols.values() + key_cols, conditions + seek, order_cols)
+        rows = list(q[start-position:start-position+length])
+        if len(rows) == length:
+            boundaries.remember(start+length, rows[-1][len(cols):])
+        q = [row[:len(cols)] for row in rows]
+    else:
+        if length>0:
+            q = q[start:start+length]
+            params.append(length)
+            params.append(start)
+
+    count_info = {'capped': False, 'estimated': count_inexact == 'estimated'}
+    if count_inexact == 'capped':
+        count_info['capped'] = q_count_filtered
+        # Make sure that there is always a next page to go to
+        if length>0:
+            q_count_filtered = max(q_count_filtered, start+length+1)
 
     #return (q,-1,-1)
-    return (q, q_count_all,q_count_filtered)
+    return (q, q_count_all,q_count_filtered,count_info)
 
 
 class BasicTableDataProvider(BasicJSONView):
@@ -297,6 +371,9 @@ class BasicTableDataProvider(BasicJSONView):
                 #query_config['filters'] = this_table_spec.get('filters',[])
                 #query_config['excludes'] = this_table_spec.get('excludes',[])
                 query_config['count'] = this_table_spec.get('count',True)
+                query_config['keyset'] = this_table_spec.get('keyset',[])
+                query_config['search'] = this_table_spec.get('search',{})
+                query_config['operators'] = this_table_spec.get('operators',{})
 
                 COLS_TO_QUERY = this_table_spec['COMMON_BASE'] + this_table_spec['QUERY_ONLY']
                 COLS_TO_DISPLAY = this_table_spec['COMMON_BASE'] + this_table_spec['DISPLAY_ONLY']
@@ -354,7 +431,11 @@ class BasicTableDataProvider(BasicJSONView):
                 }
 
         logger.debug("About to start database query for user %s for table %s" % (self.request.user,table_name))
-        q,res['recordsTotal'],res['recordsFiltered'] = datatable_query(POST, **kwargs)
+        q,res['recordsTotal'],res['recordsFiltered'],count_info = datatable_query(POST, **kwargs)
+        if count_info['capped']:
+            res['recordsFilteredCapped'] = count_info['capped']
+        if count_info['estimated']:
+            res['recordsFilteredEstimated'] = True
         q = list(q)
         logger.debug("Finished database query for user %s for table %s; %s results" % (self.request.user,table_name,len(q)))
 
@@ -388,6 +469,10 @@ class SingeltonObservablesWithSourceOneTableDataProvider(BasicTableDataProvider)
         'query_modifiers' : [('filter',Q(sources__outdated=False)),
         ],
         'count': False,
+        # a row for each source and the entity related to it
+        'keyset': ['sources__id', 'sources__related_stix_entities__id'],
+        'search': {'value': 'observable'},
+        'operators': {'value': ['in', 'contains', 'overlaps', 'subdomain']},
         'COMMON_BASE' : [
 
                 ('sources__timestamp','Source TS','0'), #0
@@ -478,6 +563,9 @@ class SingeltonObservablesWithSourceOneTableDataProviderFilterByContext(BasicTab
         'model' : SingletonObservable,
         'query_modifiers' : [('filter',Q(sources__outdated=False))],
         'count': False,
+        'keyset': ['sources__id', 'sources__related_stix_entities__id'],
+        'search': {'value': 'observable'},
+        'operators': {'value': ['in', 'contains', 'overlaps', 'subdomain']},
         'COMMON_BASE' : [
 
                 ('sources__timestamp','Source TS','0'), #0
@@ -520,6 +608,8 @@ class DashboardDataProvider(BasicTableDataProvider):
                              ],
 
         'count' : False,
+        'search': {'name': 'report'},
+        'keyset': ['id'],
         'COMMON_BASE' : [
             ('timestamp', 'Import Timestamp', '0'), #0
             ('create_timestamp', 'Source Timestamp','0'), #1
@@ -547,6 +637,8 @@ class DashboardDataProvider(BasicTableDataProvider):
         #'excludes': [{'name__startswith': 'Analysis report'},
         #             ],
         'count' : False,
+        'search': {'name': 'import_info'},
+        'keyset': ['id'],
         'COMMON_BASE' : [
             ('timestamp', 'Import Timestamp', '0'), #0
             ('create_timestamp', 'Source Timestamp','0'), #1
@@ -576,6 +668,8 @@ class DashboardDataProvider(BasicTableDataProvider):
                              ],
 
         'count': False,
+        'search': {'name': 'report'},
+        'keyset': ['id'],
         'COMMON_BASE': [
             ('identifier__latest__timestamp', 'Last Update Timestamp', '0'), #0
             ('name', 'Report Name', '1'), #1
@@ -606,6 +700,8 @@ class DashboardDataProvider(BasicTableDataProvider):
                                          name__regex=r"(?:IR-[0-9]+$)"))],
 
         'count': False,
+        'search': {'name': 'report'},
+        'keyset': ['id'],
         'COMMON_BASE': [
             ('identifier__latest__timestamp', 'Last Update TS', '0'), #0
             ('name', 'Report Name', '1'), #1
@@ -632,6 +728,7 @@ class DashboardDataProvider(BasicTableDataProvider):
         'query_modifiers' : [('filter',Q(iobject_type__name='Campaign',latest_of__isnull=False))],
 
         'count': False,
+        'keyset': ['id'],
         'COMMON_BASE': [
         ('identifier__latest__timestamp', 'Last Update TS', '0'), #0
             ('name', 'Campaign Name', '1'), #0
@@ -653,6 +750,7 @@ class DashboardDataProvider(BasicTableDataProvider):
 
 
         'count': False,
+        'keyset': ['id'],
         'COMMON_BASE': [
             ('identifier__latest__timestamp', 'Last Update TS', '0'), #0
             ('name', 'Threat Actor', '1'), #0
@@ -679,12 +777,8 @@ class DashboardDataProvider(BasicTableDataProvider):
         for row in q:
             iobject_ids.add(row[row_col])
 
-        # fetch all id -> TLP color mappings
-        select_columns = ['id', 'marking_thru__marking__fact_thru__fact__fact_values__value']
-        id2colors = dict(InfoObject.objects.filter(id__in=iobject_ids)
-                         .filter(marking_thru__marking__fact_thru__fact__fact_term__term='Marking_Structure',
-                                 marking_thru__marking__fact_thru__fact__fact_term__attribute='color')
-                         .values_list(*select_columns))
+        # fetch all id -> TLP color mappings from the materialized table
+        id2colors = InfoObjectTLP.get_colors(iobject_ids)
         # end TLP
         return id2colors
 
@@ -858,6 +952,7 @@ class UnifiedSearchSourceDataProvider(BasicTableDataProvider):
         'query_modifiers' : [('filter',Q(latest__isnull=False))],
 
         'count': False,
+        'keyset': ['id'],
         'COMMON_BASE' : [
                 ('namespace__uri','Namespace','0'),
                 ('uid','Identifier','1'),
@@ -877,6 +972,8 @@ class UnifiedSearchSourceDataProvider(BasicTableDataProvider):
         'model' : ImportInfo,
         'filters' : [],
         'count': False,
+        'search': {'name': 'import_info'},
+        'keyset': ['id'],
         'COMMON_BASE' : [
                 ('create_timestamp','Import Timestamp','0'),#0
                 ('namespace__uri','Namespace','0'),#1
@@ -961,6 +1058,9 @@ class SingletonObservablesWithStatusOneTableDataProvider(BasicTableDataProvider)
         'query_modifiers' : [('filter',Q(status_thru__active=True))],
 
         'count': False,
+        'keyset': ['status_thru__id'],
+        'search': {'value': 'observable'},
+        'operators': {'value': ['in', 'contains', 'overlaps', 'subdomain']},
         'COMMON_BASE' : [
                 ('status_thru__timestamp','Status Timestamp','0')  , #0
                 ('status_thru__status__most_permissive_tlp','lightest TLP','0')  , #1
@@ -971,12 +1071,14 @@ class SingletonObservablesWithStatusOneTableDataProvider(BasicTableDataProvider)
                 ('type__name','Type','1'), #6
                 ('subtype__name','Subtype','1'), #7
                 ('value','Value','1'), #8
-                ('actionable_tags_cache','Tags','1'), #9
-
-
             ],
-        'QUERY_ONLY' : [('id','XXX',0)],
-        'DISPLAY_ONLY' :  []
+        # The tags are displayed from the text cache, but searched
+        # via the tag membership index.
+        'QUERY_ONLY' : [('actionable_tags_cache','Tags','1'), #9
+                        ('id','XXX',0)],
+        'DISPLAY_ONLY' :  [(lambda search : TaggedActionableItem.tagged_with_q(SingletonObservable,
+                                                                              name__icontains=search),'Tags','1'), #9
+                           ]
 
     }
 
@@ -995,7 +1097,7 @@ class SingletonObservablesWithStatusOneTableDataProvider(BasicTableDataProvider)
             row[3] = Status.CONFIDENCE_MAP[int(row[3])]
             row[4] = Status.PROCESSING_MAP[int(row[4])]
 
-            row[8] = "<a href='%s'>%s</a>" % (reverse('actionables_singleton_observables_details',kwargs={'pk':int(row[offset+0])}),
+            row[8] = "<a href='%s'>%s</a>" % (reverse('actionables_singleton_observables_details',kwargs={'pk':int(row[offset+1])}),
                                                                  row[8])
 
             row = row[:-1]
@@ -1007,6 +1109,159 @@ class SingletonObservablesWithStatusOneTableDataProvider(BasicTableDataProvider)
     #select_related = ['status_thru__status']
 
 
+def api_token_user(request):
+    """
+    Return the user as which a request carrying an API token (header
+    ``Authorization: Token <token>``, see ``MANTIS_ACTIONABLES_API_TOKENS``)
+    acts; returns None if the request carries no token and raises
+    PermissionDenied if the token is unknown.
+    """
+    authorization = request.META.get('HTTP_AUTHORIZATION', '').split()
+    if len(authorization) != 2 or authorization[0].lower() != 'token':
+        return None
+    for (token, username) in MANTIS_ACTIONABLES_API_TOKENS.items():
+        if constant_time_compare(token, authorization[1]):
+            try:
+                return User.objects.get(username=username, is_active=True)
+            except ObjectDoesNotExist:
+                break
+    raise PermissionDenied("Invalid API token")
+
+
+class APITokenMixin(object):
+    """
+    Let non-browser clients authenticate with an API token instead of a
+    session. Requests with token are exempt from the CSRF check (they do
+    not rely on cookies); requests without token are checked as usual.
+    """
+
+    @method_decorator(csrf_exempt)
+    def dispatch(self, request, *args, **kwargs):
+        user = api_token_user(request)
+        if user is not None:
+            request.user = user
+        else:
+            csrf_failure = CsrfViewMiddleware().process_view(request, None, (), {})
+            if csrf_failure:
+                return csrf_failure
+        return super(APITokenMixin, self).dispatch(request, *args, **kwargs)
+
+
+class BulkLookupFormView(BasicTemplateView):
+    """
+    Form for analysts to paste values into the bulk lookup.
+    """
+
+    template_name = 'mantis_actionables/%s/BulkLookup.html' % DINGOS_TEMPLATE_FAMILY
+
+    title = 'Bulk Lookup'
+
+    def get_context_data(self, **kwargs):
+        context = super(BulkLookupFormView, self).get_context_data(**kwargs)
+        context['types'] = SingletonObservableType.objects.order_by('name').values_list('name', flat=True)
+        context['max_values'] = MANTIS_ACTIONABLES_BULK_LOOKUP_MAX_VALUES
+        return context
+
+
+class BulkLookupView(APITokenMixin, BasicJSONView):
+    """
+    Look up a list of indicator values (POST) and stream the matching
+    observables with their active status, TLP, tags and source counts.
+
+    The values are taken either from a JSON body (a list of values, or a
+    dictionary with the key ``values`` holding such a list and optionally
+    ``type``, ``format`` and ``found_only``) or from the form field ``values``
+    (one value per line); see ``mantis_actionables.core.bulk_lookup.parse_queries``
+    for the items that are understood. The output format (``json`` or ``csv``)
+    can also be chosen with the query parameter ``format``.
+
+    Browsers post the form of ``BulkLookupFormView``; other clients
+    authenticate with an API token (see ``APITokenMixin``).
+    """
+
+    def error_response(self, message):
+        return HttpResponseBadRequest(json.dumps({'error': message}), content_type='application/json')
+
+    def post(self, request, *args, **kwargs):
+        options = {}
+        if request.META.get('CONTENT_TYPE', '').startswith('application/json'):
+            try:
+                data = json.loads(request.body)
+            except ValueError:
+                return self.error_response("Request body is not valid JSON")
+            if isinstance(data, dict):
+                options = data
+                items = data.get('values', [])
+            else:
+                items = data
+            if not isinstance(items, list):
+                return self.error_response("Values must be given as list")
+        else:
+            options = request.POST
+            items = request.POST.get('values', '').splitlines()
+
+        if len(items) > MANTIS_ACTIONABLES_BULK_LOOKUP_MAX_VALUES:
+            return self.error_response("At most %s values can be looked up at once" % MANTIS_ACTIONABLES_BULK_LOOKUP_MAX_VALUES)
+
+        try:
+            queries = bulk_lookup.parse_queries(items, default_type=options.get('type') or None)
+        except bulk_lookup.BulkLookupError as e:
+            return self.error_response(str(e))
+
+        output_format = request.GET.get('format') or options.get('format') or 'json'
+        found_only = options.get('found_only') in (True, 'true', '1', 'on')
+        logger.debug("Bulk lookup of %s values by user %s" % (len(queries), request.user))
+
+        records = bulk_lookup.bulk_lookup(queries, found_only=found_only)
+        if output_format == 'csv':
+            response = StreamingHttpResponse(bulk_lookup.csv_stream(records), content_type='text/csv')
+            response['Content-Disposition'] = 'attachment; filename="lookup.csv"'
+        elif output_format == 'json':
+            response = StreamingHttpResponse(bulk_lookup.json_stream(records), content_type='application/json')
+        else:
+            return self.error_response("Unknown format %s" % output_format)
+        return response
+
+
+class ExportFeedView(APITokenMixin, BasicJSONView):
+    """
+    Stream the blocklist of the active observables of a kind (see
+    ``MANTIS_ACTIONABLES_EXPORT_KINDS``) or the bundle of IDS signatures
+    (kind ``ids``), gzipped if the client accepts it; the response carries
+    an ETag, so that unchanged feeds are answered with 304. Clients
+    other than browsers authenticate with an API token (see ``APITokenMixin``).
+    """
+
+    def get(self, request, *args, **kwargs):
+        kind = kwargs['kind']
+        output_format = kwargs['output_format']
+        subtype = request.GET.get('subtype') or None
+        try:
+            exports.check_export(kind, output_format)
+        except exports.ExportError as e:
+            raise Http404(str(e))
+
+        now = timezone.now()
+        use_gzip = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+        etag = '"%s%s"' % (exports.export_etag(kind, output_format, subtype=subtype, now=now),
+                           '-gzip' if use_gzip else '')
+        if etag in [x.strip() for x in request.META.get('HTTP_IF_NONE_MATCH', '').split(',')]:
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+
+        lines = exports.export_lines(kind, output_format, subtype=subtype, now=now)
+        if use_gzip:
+            lines = compress_sequence(lines)
+        content_type = 'text/csv' if output_format == 'csv' else 'text/plain'
+        response = StreamingHttpResponse(lines, content_type='%s; charset=utf-8' % content_type)
+        response['ETag'] = etag
+        response['Vary'] = 'Accept-Encoding'
+        if use_gzip:
+            response['Content-Encoding'] = 'gzip'
+        return response
+
+
 class BasicDatatableView(BasicTemplateView):
 
 
@@ -1768,6 +2023,7 @@ class ActionablesContextEditView(BasicDetailView):
                 # Rename actionable tags
 
                 TagInfo.objects.filter(name=self.object.name).update(name=cleaned_data['new_context_name'])
+                TagInfo.cached_objects.invalidate()
                 self.object.name = cleaned_data['new_context_name']
                 self.object.type = type
                 messages.success(request,"Context and associated tags renamed to '%s'" % cleaned_data['new_context_name'])
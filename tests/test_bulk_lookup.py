@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_bulk_lookup
+------------
+
+Tests for the parsing and normalization of bulk lookup requests
+(`mantis_actionables.core.bulk_lookup`).
+"""
+
+import json
+import unittest
+
+from mantis_actionables.core.bulk_lookup import normalize_value, value_candidates, parse_queries, \
+    json_stream, BulkLookupError
+
+
+class NormalizeValueTests(unittest.TestCase):
+
+    def test_strips_whitespace_and_quotes(self):
+        self.assertEqual(normalize_value('  "evil.example" '), 'evil.example')
+        self.assertEqual(normalize_value("'10.1.2.3'\t"), '10.1.2.3')
+        self.assertEqual(normalize_value('<someone@evil.example>'), 'someone@evil.example')
+
+    def test_refangs(self):
+        self.assertEqual(normalize_value('evil[.]example'), 'evil.example')
+        self.assertEqual(normalize_value('10(.)1[.]2[dot]3'), '10.1.2.3')
+        self.assertEqual(normalize_value('someone[at]evil.example'), 'someone@evil.example')
+        self.assertEqual(normalize_value('hxxp://evil[.]example/x'), 'http://evil.example/x')
+        self.assertEqual(normalize_value('HXXPS[:]//evil.example'), 'https://evil.example')
+
+    def test_value_candidates(self):
+        self.assertEqual(value_candidates('AbC'), set(['AbC', 'abc', 'ABC']))
+        self.assertEqual(value_candidates('10.1.2.3'), set(['10.1.2.3']))
+
+
+class ParseQueriesTests(unittest.TestCase):
+
+    def test_items(self):
+        self.assertEqual(parse_queries(['evil[.]example',
+                                        ['IP', '10.1.2.3'],
+                                        {'value': 'd41d8cd98f00b204e9800998ecf8427e', 'type': 'Hash'},
+                                        {'value': 'other.example'}]),
+                         [(u'evil[.]example', None, u'evil.example'),
+                          (u'10.1.2.3', 'IP', u'10.1.2.3'),
+                          (u'd41d8cd98f00b204e9800998ecf8427e', 'Hash', u'd41d8cd98f00b204e9800998ecf8427e'),
+                          (u'other.example', None, u'other.example')])
+
+    def test_default_type(self):
+        self.assertEqual(parse_queries(['evil.example', {'value': '10.1.2.3', 'type': 'IP'}], default_type='FQDN'),
+                         [(u'evil.example', 'FQDN', u'evil.example'),
+                          (u'10.1.2.3', 'IP', u'10.1.2.3')])
+
+    def test_empty_values_are_dropped(self):
+        self.assertEqual(parse_queries(['', '   ', '""']), [])
+
+    def test_unreadable_items(self):
+        self.assertRaises(BulkLookupError, parse_queries, [{'type': 'IP'}])
+        self.assertRaises(BulkLookupError, parse_queries, [{'value': ['a', 'b']}])
+
+
+class JSONStreamTests(unittest.TestCase):
+
+    def test_stream_is_a_json_list(self):
+        records = [{'query': 'a', 'found': False}, {'query': 'b', 'found': True, 'id': 1}]
+        self.assertEqual(json.loads(''.join(json_stream(iter(records)))), records)
+        self.assertEqual(json.loads(''.join(json_stream(iter([])))), [])
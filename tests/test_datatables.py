@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_datatables
+------------
+
+Tests for the keyset pagination helpers (`mantis_actionables.core.datatables`)
+and the paging of the tables built on them.
+"""
+
+import unittest
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connection
+from django.http import QueryDict
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from mantis_actionables.models import Status, SingletonObservable, SingletonObservableType, \
+    SingletonObservableSubtype, Source, STIX_Entity, EntityType
+from mantis_actionables.core.datatables import seek_q, nulls_sort_high
+from mantis_actionables.views import datatable_query, SingeltonObservablesWithSourceOneTableDataProvider
+
+
+class SeekQTests(unittest.TestCase):
+
+    def test_single_column(self):
+        self.assertEqual(seek_q([('id', False)], (10,), nulls_high=False).children, [('id__gt', 10)])
+        self.assertEqual(seek_q([('id', True)], (10,), nulls_high=True).children, [('id__lt', 10)])
+
+    def test_nulls_follow_the_boundary(self):
+        self.assertEqual(seek_q([('name', False)], ('x',), nulls_high=True).children,
+                         [('name__gt', 'x'), ('name__isnull', True)])
+        self.assertEqual(seek_q([('name', True)], ('x',), nulls_high=False).children,
+                         [('name__lt', 'x'), ('name__isnull', True)])
+
+    def test_tie_breakers(self):
+        query = seek_q([('name', False), ('id', False)], ('x', 10), nulls_high=False)
+        self.assertEqual(query.connector, 'OR')
+        (first, second) = query.children
+        self.assertEqual(first, ('name__gt', 'x'))
+        self.assertEqual(second.connector, 'AND')
+        self.assertEqual(sorted(second.children), [('id__gt', 10), ('name', 'x')])
+
+    def test_null_boundary(self):
+        # NULLs sorting low are followed by the other values ...
+        query = seek_q([('name', False), ('id', False)], (None, 10), nulls_high=False)
+        (first, second) = query.children
+        self.assertEqual(first, ('name__isnull', False))
+        self.assertEqual(sorted(second.children), [('id__gt', 10), ('name__isnull', True)])
+        # ... NULLs sorting high by nothing but other NULLs
+        query = seek_q([('name', False), ('id', False)], (None, 10), nulls_high=True)
+        self.assertEqual(sorted(query.children), [('id__gt', 10), ('name__isnull', True)])
+
+
+class SeekQueryTests(TestCase):
+    """
+    Seeking behind each row of an ordering over a nullable column must
+    yield exactly the rows following it.
+    """
+
+    def setUp(self):
+        for (priority, false_positive) in [(Status.PRIORITY_LOW, None),
+                                           (Status.PRIORITY_MEDIUM, True),
+                                           (Status.PRIORITY_HIGH, False),
+                                           (Status.PRIORITY_HOT, None),
+                                           (Status.PRIORITY_UNCERTAIN, True)]:
+            Status.objects.create(priority=priority, false_positive=false_positive)
+
+    def check_seek(self, descending):
+        order_cols = [('false_positive', descending), ('id', False)]
+        queryset = Status.objects.order_by('-false_positive' if descending else 'false_positive', 'id')
+        rows = list(queryset.values_list('id', 'false_positive'))
+        nulls_high = nulls_sort_high(DEFAULT_DB_ALIAS)
+        for (position, (pk, false_positive)) in enumerate(rows):
+            following = queryset.filter(seek_q(order_cols, (false_positive, pk), nulls_high=nulls_high))
+            self.assertEqual(list(following.values_list('id', 'false_positive')), rows[position+1:])
+
+    def test_ascending(self):
+        self.check_seek(False)
+
+    def test_descending(self):
+        self.check_seek(True)
+
+
+class IndicatorsBySourceTests(TestCase):
+    """
+    The 'Indicators by Source' table has a row for each source of an
+    observable and entity related to the source; the pages fetched by
+    seeking must be the pages of the complete result.
+    """
+
+    def setUp(self):
+        cache.clear()
+        observable_type = SingletonObservableType.objects.create(name='IP')
+        subtype = SingletonObservableSubtype.objects.create(name='')
+        entity_type = EntityType.objects.create(name='ThreatActor')
+        entities = [STIX_Entity.objects.create(entity_type=entity_type,
+                                               non_iobject_identifier='actor-%d' % i,
+                                               essence='{"name": "actor-%d"}' % i) for i in range(2)]
+        content_type = ContentType.objects.get_for_model(SingletonObservable)
+        for i in range(20):
+            observable = SingletonObservable.objects.create(type=observable_type, subtype=subtype,
+                                                            value='10.0.0.%d' % i)
+            for j in range(i % 3 + 1):
+                source = Source.objects.create(content_type=content_type, object_id=observable.pk,
+                                               tlp=j, outdated=(j == 2 and i % 2 == 0))
+                # Sources without related entities have a row, too.
+                source.related_stix_entities.add(*entities[:(i + j) % 3])
+
+    def table_page(self, start, length):
+        provider = SingeltonObservablesWithSourceOneTableDataProvider
+        provider.init_data()
+        config_info = provider.get_cols_dict(provider.TABLE_NAME_ALL_IMPORTS)
+        post = QueryDict('', mutable=True)
+        post.update({'start': str(start),
+                     'length': str(length),
+                     'order[0][column]': '0',
+                     'order[0][dir]': 'desc',
+                     'search[value]': ''})
+        (q, count_all, count_filtered, count_info) = datatable_query(post,
+                                                                     query_columns=config_info['query_columns'],
+                                                                     display_columns=config_info['display_columns'],
+                                                                     query_config=config_info['query_config'])
+        return list(q)
+
+    def test_deep_page(self):
+        rows = self.table_page(0, 1000)
+        self.assertEqual(len(rows), len(set(rows)))
+        self.assertTrue(len(rows) > 30)
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.table_page(30, 5), rows[30:35])
+        # The page itself is fetched by seeking, not by skipping rows
+        self.assertFalse('OFFSET' in queries.captured_queries[-1]['sql'].upper())
+        # The boundaries remembered on the way to the deep page serve
+        # the pages before it
+        self.assertEqual(self.table_page(25, 5), rows[25:30])
+        self.assertEqual(self.table_page(35, 5), rows[35:40])
+
+    def test_all_pages(self):
+        rows = self.table_page(0, 1000)
+        paged = []
+        for start in range(0, len(rows) + 5, 5):
+            paged.extend(self.table_page(start, 5))
+        self.assertEqual(paged, rows)
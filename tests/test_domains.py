@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_domains
+------------
+
+Tests for the domain suffix index (`mantis_actionables.core.domains`).
+
+The queries are run against the test database; with a PostgreSQL test
+database (whose default collation ignores punctuation at the first
+comparison level) they also check that the subdomain search does not
+depend on the collation.
+"""
+
+import unittest
+
+from django.test import TestCase
+
+from mantis_actionables.models import SingletonObservable, SingletonObservableType, SingletonObservableSubtype
+from mantis_actionables.core.domains import normalize_domain, reverse_domain, observable_domain, \
+    index_domains, subdomain_q, observables_under
+
+
+class DomainFunctionTests(unittest.TestCase):
+
+    def test_reverse_domain(self):
+        self.assertEqual(reverse_domain('sub.evil.example'), 'example.evil.sub')
+        self.assertEqual(reverse_domain('example'), 'example')
+
+    def test_normalize_domain(self):
+        self.assertEqual(normalize_domain(' Sub.Evil.Example. '), 'sub.evil.example')
+        self.assertEqual(normalize_domain('10.1.2.3'), None)
+        self.assertEqual(normalize_domain('evil..example'), None)
+        self.assertEqual(normalize_domain(''), None)
+
+    def test_observable_domain(self):
+        self.assertEqual(observable_domain('URL', 'http://Sub.Evil.Example:8080/path?q=1'), 'sub.evil.example')
+        self.assertEqual(observable_domain('URL', 'sub.evil.example/path'), 'sub.evil.example')
+        self.assertEqual(observable_domain('Email_Address', 'someone@Evil.Example'), 'evil.example')
+        self.assertEqual(observable_domain('IP', '10.1.2.3'), None)
+
+    def test_subdomain_q_is_a_prefix_match(self):
+        children = subdomain_q('evil.example', prefix='singleton_observables__').children
+        self.assertEqual(children, [('singleton_observables__domain_suffix__reversed_domain__startswith',
+                                     'example.evil.'),
+                                    ('singleton_observables__domain_suffix__reversed_domain',
+                                     'example.evil')])
+        self.assertEqual(subdomain_q('*.evil.example', include_self=False).children,
+                         [('domain_suffix__reversed_domain__startswith', 'example.evil.')])
+
+    def test_subdomain_q_rejects_non_domains(self):
+        self.assertRaises(ValueError, subdomain_q, '10.1.2.3')
+
+
+class SubdomainQueryTests(TestCase):
+
+    VALUES = [('FQDN', 'evil.example'),
+              ('FQDN', 'sub.evil.example'),
+              ('FQDN', 'a.b.evil.example'),
+              ('FQDN', 'notevil.example'),
+              ('FQDN', 'evil.example.com'),
+              ('FQDN', 'evil-example.org'),
+              ('URL', 'http://www.evil.example/index.html'),
+              ('Email_Address', 'someone@mail.evil.example')]
+
+    def setUp(self):
+        subtype = SingletonObservableSubtype.objects.create(name='')
+        self.pks = {}
+        for (type_name, value) in self.VALUES:
+            (observable_type, created) = SingletonObservableType.objects.get_or_create(name=type_name)
+            observable = SingletonObservable.objects.create(type=observable_type, subtype=subtype, value=value)
+            self.pks[value] = observable.pk
+        index_domains([(self.pks[value], type_name, value) for (type_name, value) in self.VALUES])
+
+    def values_under(self, domain, include_self=True):
+        return set(observables_under(domain, include_self=include_self).values_list('value', flat=True))
+
+    def test_subdomains(self):
+        self.assertEqual(self.values_under('evil.example'),
+                         set(['evil.example',
+                              'sub.evil.example',
+                              'a.b.evil.example',
+                              'http://www.evil.example/index.html',
+                              'someone@mail.evil.example']))
+
+    def test_subdomains_without_domain_itself(self):
+        self.assertEqual(self.values_under('evil.example', include_self=False),
+                         set(['sub.evil.example',
+                              'a.b.evil.example',
+                              'http://www.evil.example/index.html',
+                              'someone@mail.evil.example']))
+
+    def test_deeper_domain(self):
+        self.assertEqual(self.values_under('b.evil.example'), set(['a.b.evil.example']))
+
+    def test_query_does_not_compare_strings(self):
+        # Range comparisons on the reversed domain depend on the collation
+        sql = str(observables_under('evil.example').query)
+        self.assertTrue('LIKE' in sql)
+        self.assertFalse('>=' in sql)
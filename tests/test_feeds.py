@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_feeds
+------------
+
+Tests for reading feed files from a checkpoint and for resuming interrupted
+feed imports (`mantis_actionables.core.feeds`).
+"""
+
+import os
+import json
+import shutil
+import datetime
+import tempfile
+
+import mock
+
+from django.test import TestCase
+
+from mantis_actionables.models import ImportWatermark
+from mantis_actionables.core.feeds import Feed, FeedImporter, import_feed, prepare_feed_partitions
+from mantis_actionables.core.import_infos import import_info_uid
+
+FEED_DEFINITION = {'namespace': {'uri': 'feed.example'},
+                   'types': {'ip': ('IP', ''),
+                             'domain': ('FQDN', '')}}
+
+ROWS = [('2015-03-01', '10.1.2.3', 'ip', 'Evil Panda', ''),
+        ('2015-03-01', 'evil.example', 'domain', '', 'Report 1'),
+        ('2015-03-02', 'hash', 'md5', 'Evil Panda', ''),
+        ('2015-03-02', '10.1.2.4', 'ip', 'Evil Panda|Fancy Bear', 'Report 2'),
+        ('2015-03-03', 'skipped.example', 'domain', 'unknown', ''),
+        ('2015-03-03', 'other.example', 'domain', '', 'Report 3')]
+
+
+class FeedFileTestCase(TestCase):
+
+    format = 'csv'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'feed.%s' % self.format)
+        definition = dict(FEED_DEFINITION, format=self.format)
+        self.feed = Feed('testfeed', definition)
+        with open(self.path, 'wb') as f:
+            if self.format == 'csv':
+                f.write('date,indicator,type,actor,report\n')
+                for row in ROWS:
+                    f.write('%s\n' % ','.join(row))
+            else:
+                for row in ROWS:
+                    f.write('%s\n' % json.dumps(dict(zip(['date', 'indicator', 'type', 'actor', 'report'], row))))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+class FeedReadTests(FeedFileTestCase):
+
+    def test_rows_and_offsets(self):
+        rows = list(self.feed.read(self.path))
+        self.assertEqual([row['indicator'] for (row, valid_row, offset) in rows],
+                         ['10.1.2.3', 'evil.example', 'hash', '10.1.2.4', 'other.example'])
+        self.assertEqual([valid_row for (row, valid_row, offset) in rows], [True, True, False, True, True])
+        self.assertEqual(rows[3][0]['actor'], ['Evil Panda', 'Fancy Bear'])
+        offsets = [offset for (row, valid_row, offset) in rows]
+        self.assertEqual(offsets, sorted(set(offsets)))
+        self.assertEqual(offsets[-1], os.path.getsize(self.path))
+
+    def test_read_from_offset(self):
+        rows = list(self.feed.read(self.path))
+        self.assertEqual(list(self.feed.read(self.path, start_offset=self.feed.data_offset(self.path))), rows)
+        for (position, (row, valid_row, offset)) in enumerate(rows):
+            self.assertEqual(list(self.feed.read(self.path, start_offset=offset)), rows[position + 1:])
+
+    def test_partitions(self):
+        rows = [row for (row, valid_row, offset) in self.feed.read(self.path)]
+        for partitions in (1, 2, 3):
+            for row in rows:
+                partition = self.feed.partition(row, partitions)
+                self.assertTrue(0 <= partition < partitions)
+                self.assertEqual(self.feed.partition(dict(row), partitions), partition)
+
+
+class JSONLinesFeedReadTests(FeedReadTests):
+
+    format = 'jsonl'
+
+    def test_non_ascii_row(self):
+        with open(self.path, 'ab') as f:
+            f.write('%s\n' % json.dumps({'date': '2015-03-04',
+                                         'indicator': u'b\xfccher.example',
+                                         'type': 'domain',
+                                         'actor': u'B\xe4r',
+                                         'report': ''}))
+        (row, valid_row, offset) = list(self.feed.read(self.path))[-1]
+        self.assertEqual(row['indicator'], u'b\xfccher.example')
+        self.assertTrue(0 <= self.feed.partition(row, 3) < 3)
+        uid = import_info_uid(row['actor'][0], 'actor', datetime.date(2015, 3, 4), mock.Mock(uri=u'feed.example'))
+        self.assertEqual(uid, import_info_uid(u'B\xe4r'.encode('utf-8'), 'actor', datetime.date(2015, 3, 4),
+                                              mock.Mock(uri=u'feed.example')))
+
+
+class FeedCheckpointTests(FeedFileTestCase):
+    """
+    Each chunk is committed together with the offset reached; an import
+    that failed continues after the last committed chunk.
+    """
+
+    LEASE = datetime.timedelta(minutes=5)
+
+    def setUp(self):
+        super(FeedCheckpointTests, self).setUp()
+        self.offsets = [offset for (row, valid_row, offset) in self.feed.read(self.path)]
+        self.importer = FeedImporter(self.feed, None, None)
+
+    def watermark(self, holder='importer'):
+        return ImportWatermark.acquire_lease('testfeed', holder, self.LEASE)
+
+    def position(self):
+        return ImportWatermark.objects.get(name='testfeed').position
+
+    def imported_indicators(self, import_chunk):
+        return [[row['indicator'] for (row, valid_row) in call[0][0]] for call in import_chunk.call_args_list]
+
+    def test_chunks_are_checkpointed(self):
+        watermark = self.watermark()
+        with mock.patch.object(FeedImporter, 'import_chunk') as import_chunk:
+            self.importer.import_file(self.path, watermark, self.LEASE, chunk_size=2)
+        self.assertEqual(self.imported_indicators(import_chunk),
+                         [['10.1.2.3', 'evil.example'], ['hash', '10.1.2.4'], ['other.example']])
+        self.assertEqual(self.position(), os.path.getsize(self.path))
+
+    def test_resume_after_failure(self):
+        watermark = self.watermark()
+        watermark.checkpoint(self.feed.data_offset(self.path), self.LEASE)
+        with mock.patch.object(FeedImporter, 'import_chunk', side_effect=[None, ValueError("Broken chunk")]):
+            self.assertRaises(ValueError, self.importer.import_file, self.path, watermark, self.LEASE, chunk_size=2)
+        self.assertEqual(self.position(), self.offsets[1])
+        watermark.release_lease()
+
+        with mock.patch.object(FeedImporter, 'import_chunk') as import_chunk:
+            self.importer.import_file(self.path, self.watermark('other importer'), self.LEASE, chunk_size=2)
+        self.assertEqual(self.imported_indicators(import_chunk), [['hash', '10.1.2.4'], ['other.example']])
+        self.assertEqual(self.position(), os.path.getsize(self.path))
+
+    def test_lost_lease(self):
+        watermark = self.watermark()
+        ImportWatermark.objects.filter(name='testfeed').update(lease_holder='somebody else')
+        with mock.patch.object(FeedImporter, 'import_chunk'):
+            self.assertRaises(RuntimeError, self.importer.import_file, self.path, watermark, self.LEASE, chunk_size=2)
+        self.assertEqual(self.position(), 0)
+
+    def test_partitions_are_checkpointed(self):
+        imported = []
+        for partition in range(2):
+            watermark = ImportWatermark.acquire_lease('testfeed-%sof2' % partition, 'importer', self.LEASE)
+            with mock.patch.object(FeedImporter, 'import_chunk') as import_chunk:
+                self.importer.import_file(self.path, watermark, self.LEASE, chunk_size=1,
+                                          partition=partition, partitions=2)
+            imported.extend(sum(self.imported_indicators(import_chunk), []))
+        self.assertEqual(sorted(imported), sorted(['10.1.2.3', 'evil.example', 'hash', '10.1.2.4', 'other.example']))
+
+    def test_prepared_partitions_do_not_move_the_file_watermark(self):
+        # An import without workers after the shared objects were created
+        # for a partitioned import must still import the whole file.
+        with mock.patch.object(Feed, 'get_namespace'), \
+                mock.patch.object(Feed, 'create_action'), \
+                mock.patch('mantis_actionables.core.feeds.get_latest_import_date', return_value=None), \
+                mock.patch.object(FeedImporter, 'create_shared_objects'), \
+                mock.patch.object(FeedImporter, 'import_chunk') as import_chunk:
+            self.assertNotEqual(prepare_feed_partitions(self.feed, self.path, 2), None)
+            import_feed(self.feed, self.path, chunk_size=10)
+        self.assertEqual(self.imported_indicators(import_chunk),
+                         [['10.1.2.3', 'evil.example', 'hash', '10.1.2.4', 'other.example']])
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_incremental_import
+------------
+
+Tests for the handling of failing reports by incremental imports
+(`mantis_actionables.mantis_import.process_STIX_Reports_since_last_run`).
+"""
+
+import datetime
+
+import mock
+
+from django.test import TestCase
+
+from mantis_actionables.models import ImportLedgerEntry, ImportWatermark
+from mantis_actionables import mantis_import
+from mantis_actionables.mantis_import import process_STIX_Reports_since_last_run
+
+
+class FakeReports(object):
+    """
+    Stand-in for the queryset of top-level reports.
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def filter(self, create_timestamp__gte):
+        return FakeReports([row for row in self.rows if row[1] >= create_timestamp__gte])
+
+    def order_by(self, *args):
+        return FakeReports(sorted(self.rows, key=lambda row: (row[1], row[0])))
+
+    def values_list(self, *args):
+        return list(self.rows)
+
+
+START = datetime.datetime(2015, 3, 1, 12, 0)
+
+REPORTS = [(1, START), (2, START + datetime.timedelta(days=1)), (3, START + datetime.timedelta(days=2))]
+
+
+class FailingReportTests(TestCase):
+
+    def run_import(self, failing_pks):
+        imported = []
+
+        def import_reports(pks):
+            if pks[0] in failing_pks:
+                raise ValueError("Broken report")
+            imported.extend(pks)
+
+        with mock.patch.object(mantis_import, 'stix_reports_queryset', return_value=FakeReports(REPORTS)), \
+                mock.patch.object(mantis_import, 'import_singleton_observables_from_STIX_iobjects',
+                                  side_effect=import_reports), \
+                mock.patch.object(mantis_import, 'MANTIS_ACTIONABLES_IMPORT_MAX_ATTEMPTS', 2):
+            self.assertEqual(process_STIX_Reports_since_last_run(), len(imported))
+        return imported
+
+    def high_water_mark(self):
+        return ImportWatermark.objects.get(name='stix_reports').high_water_mark
+
+    def test_failing_report_does_not_block_later_reports(self):
+        self.assertEqual(self.run_import(failing_pks=[2]), [1, 3])
+        entry = ImportLedgerEntry.objects.get(iobject_id=2)
+        self.assertEqual((entry.failed_attempts, entry.error), (1, 'ValueError: Broken report'))
+        # The high-water mark stays before the failed report
+        self.assertEqual(self.high_water_mark(), REPORTS[0][1])
+
+        self.assertEqual(self.run_import(failing_pks=[]), [2])
+        self.assertEqual(ImportLedgerEntry.objects.get(iobject_id=2).error, '')
+        self.assertEqual(self.high_water_mark(), REPORTS[2][1])
+
+    def test_failing_report_is_given_up(self):
+        self.assertEqual(self.run_import(failing_pks=[2]), [1, 3])
+        self.assertEqual(self.run_import(failing_pks=[2]), [])
+        self.assertEqual(ImportLedgerEntry.objects.get(iobject_id=2).failed_attempts, 2)
+        self.assertEqual(self.high_water_mark(), REPORTS[2][1])
+        self.assertEqual(self.run_import(failing_pks=[2]), [])
+        self.assertEqual(ImportLedgerEntry.objects.get(iobject_id=2).failed_attempts, 2)
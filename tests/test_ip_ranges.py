@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_ip_ranges
+------------
+
+Tests for the IP range index (`mantis_actionables.core.ip_ranges`).
+"""
+
+import unittest
+
+from django.test import TestCase
+
+from mantis_actionables.models import SingletonObservable, SingletonObservableType, SingletonObservableSubtype
+from mantis_actionables.core.ip_ranges import parse_ip_range, encode_address, index_ip_ranges, ip_range_q, \
+    filter_operator, observables_within, observables_containing, observables_overlapping
+
+
+class IPRangeFunctionTests(unittest.TestCase):
+
+    def test_parse_address(self):
+        self.assertEqual(parse_ip_range(' 10.1.2.3 '), (4, 0x0a010203, 0x0a010203))
+        self.assertEqual(parse_ip_range('2001:db8::1'), (6, 0x20010db8000000000000000000000001,
+                                                         0x20010db8000000000000000000000001))
+
+    def test_parse_network(self):
+        self.assertEqual(parse_ip_range('10.1.0.0/16'), (4, 0x0a010000, 0x0a01ffff))
+        self.assertEqual(parse_ip_range('2001:db8::/32'), (6, 0x20010db8000000000000000000000000,
+                                                           0x20010db8ffffffffffffffffffffffff))
+
+    def test_parse_range(self):
+        self.assertEqual(parse_ip_range('10.1.0.0 - 10.1.0.255'), (4, 0x0a010000, 0x0a0100ff))
+        self.assertEqual(parse_ip_range('10.1.0.255-10.1.0.0'), None)
+        self.assertEqual(parse_ip_range('10.1.0.0-2001:db8::1'), None)
+
+    def test_parse_garbage(self):
+        self.assertEqual(parse_ip_range('evil.example'), None)
+        self.assertEqual(parse_ip_range('10.1.2.300'), None)
+        self.assertEqual(parse_ip_range(''), None)
+
+    def test_encoded_addresses_sort_like_numbers(self):
+        self.assertEqual(encode_address(0x0a010203), '0000000000000000000000000a010203')
+        self.assertTrue(encode_address(0x0a0100ff) < encode_address(0x0a010100))
+
+    def test_ip_range_q(self):
+        start = encode_address(0x0a010000)
+        end = encode_address(0x0a01ffff)
+        self.assertEqual(sorted(ip_range_q('10.1.0.0/16', 'within').children),
+                         [('ip_range__end__lte', end), ('ip_range__start__gte', start), ('ip_range__version', 4)])
+        self.assertEqual(sorted(ip_range_q('10.1.0.0/16', 'contains', prefix='singleton_observables__').children),
+                         [('singleton_observables__ip_range__end__gte', end),
+                          ('singleton_observables__ip_range__start__lte', start),
+                          ('singleton_observables__ip_range__version', 4)])
+        self.assertEqual(sorted(ip_range_q('10.1.0.0/16', 'overlaps').children),
+                         [('ip_range__end__gte', start), ('ip_range__start__lte', end), ('ip_range__version', 4)])
+
+    def test_ip_range_q_rejects_bad_arguments(self):
+        self.assertRaises(ValueError, ip_range_q, 'evil.example', 'within')
+        self.assertRaises(ValueError, ip_range_q, '10.1.0.0/16', 'below')
+
+    def test_filter_operator(self):
+        operator = filter_operator('within')
+        self.assertEqual(sorted(operator('singleton_observables__value', '10.1.0.0/16').children),
+                         sorted(ip_range_q('10.1.0.0/16', 'within', prefix='singleton_observables__').children))
+        self.assertEqual(operator('value', 'evil.example'), None)
+
+
+class IPRangeQueryTests(TestCase):
+
+    VALUES = [('IP', '10.1.2.3'),
+              ('IP', '10.2.0.1'),
+              ('IP_Block', '10.1.0.0/16'),
+              ('IP_Block', '10.0.0.0-10.1.255.255'),
+              ('IP', '2001:db8::1'),
+              ('FQDN', '10.1.2.4')]
+
+    def setUp(self):
+        subtype = SingletonObservableSubtype.objects.create(name='')
+        observables = []
+        for (type_name, value) in self.VALUES:
+            (observable_type, created) = SingletonObservableType.objects.get_or_create(name=type_name)
+            observable = SingletonObservable.objects.create(type=observable_type, subtype=subtype, value=value)
+            observables.append((observable.pk, type_name, value))
+        index_ip_ranges(observables)
+
+    def values(self, queryset):
+        return set(queryset.values_list('value', flat=True))
+
+    def test_indexing_is_idempotent(self):
+        self.assertEqual(index_ip_ranges([(observable.pk, observable.type.name, observable.value)
+                                          for observable in SingletonObservable.objects.all()]), 0)
+
+    def test_within(self):
+        self.assertEqual(self.values(observables_within('10.1.0.0/16')), set(['10.1.2.3', '10.1.0.0/16']))
+        self.assertEqual(self.values(observables_within('2001:db8::/32')), set(['2001:db8::1']))
+
+    def test_containing(self):
+        self.assertEqual(self.values(observables_containing('10.1.2.3')),
+                         set(['10.1.2.3', '10.1.0.0/16', '10.0.0.0-10.1.255.255']))
+        self.assertEqual(self.values(observables_containing('10.2.0.1')), set(['10.2.0.1']))
+
+    def test_overlapping(self):
+        self.assertEqual(self.values(observables_overlapping('10.1.255.0-10.2.0.0')),
+                         set(['10.1.0.0/16', '10.0.0.0-10.1.255.255']))
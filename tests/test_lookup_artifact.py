@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_lookup_artifact
+------------
+
+Tests for writing and reading the indicator lookup artifact
+(`mantis_actionables.core.lookup_artifact`).
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from array import array
+
+from mantis_actionables.core.lookup_artifact import LookupArtifact, ArtifactError, Match, FINGERPRINT_TYPECODE, \
+    HEADER, MAGIC, write_artifact, value_hash, value_fingerprint, normalize_value, encode_tlp, encode_flags
+
+
+def build_entries(entries):
+    """
+    Turn tuples (hash, fingerprint, object id, tlp, flags) into the arrays
+    expected by ``write_artifact``.
+    """
+    arrays = (array('I'), array(FINGERPRINT_TYPECODE), array('I'), array('B'), array('B'))
+    for entry in sorted(entries):
+        for (values, value) in zip(arrays, entry):
+            values.append(value)
+    return arrays
+
+
+def entry(value, object_id, tlp=encode_tlp(40, 20), flags=encode_flags(30, 20, 40, False)):
+    return (value_hash(value), value_fingerprint(value), object_id, tlp, flags)
+
+
+class LookupArtifactTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'indicators.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, entries, **kwargs):
+        write_artifact(self.path, 7, 1234567890123456,
+                       dict((type_name, build_entries(type_entries)) for (type_name, type_entries) in entries.items()),
+                       **kwargs)
+
+    def test_round_trip(self):
+        self.write({'FQDN': [entry('evil.example', 1),
+                             entry('Evil.Example', 2, tlp=encode_tlp(10, 10), flags=encode_flags(10, 0, 50, True)),
+                             entry('other.example', 3)],
+                    'IP': [entry('10.1.2.3', 4)],
+                    'Hash': []})
+        with LookupArtifact(self.path) as artifact:
+            self.assertEqual((artifact.version, artifact.built_at), (7, 1234567890123456))
+            self.assertEqual(sorted(artifact.types.keys()), ['FQDN', 'Hash', 'IP'])
+            self.assertEqual(sorted(artifact.lookup('FQDN', ' EVIL.example ')),
+                             [Match(1, 40, 20, 30, 20, 40, False),
+                              Match(2, 10, 10, 10, 0, 50, True)])
+            self.assertEqual(artifact.lookup('IP', '10.1.2.3'), [Match(4, 40, 20, 30, 20, 40, False)])
+            self.assertEqual(artifact.lookup('IP', 'evil.example'), [])
+            self.assertEqual(artifact.lookup('URL', 'evil.example'), [])
+            self.assertFalse(artifact.contains('Hash', 'd41d8cd98f00b204e9800998ecf8427e'))
+            self.assertEqual(sorted(artifact.types['FQDN'].entries()),
+                             sorted([entry('evil.example', 1),
+                                     entry('Evil.Example', 2, tlp=encode_tlp(10, 10),
+                                           flags=encode_flags(10, 0, 50, True)),
+                                     entry('other.example', 3)]))
+
+    def check_values(self, **kwargs):
+        values = ['host%d.evil.example' % i for i in range(2000)]
+        self.write({'FQDN': [entry(value, pk) for (pk, value) in enumerate(values)]}, **kwargs)
+        missing = ['host%d.other.example' % i for i in range(2000)]
+        for use_bloom in (False, True):
+            with LookupArtifact(self.path, use_bloom=use_bloom) as artifact:
+                self.assertTrue(artifact.types['FQDN'].prefix_bits > 0)
+                matcher = artifact.matcher('FQDN')
+                normalized_matcher = artifact.matcher('FQDN', normalized=True)
+                for value in values:
+                    self.assertTrue(artifact.contains('FQDN', value))
+                    self.assertTrue(matcher(value.upper()))
+                    self.assertTrue(normalized_matcher(normalize_value(value).encode('utf-8')))
+                for value in missing:
+                    self.assertFalse(artifact.contains('FQDN', value))
+                    self.assertFalse(matcher(value))
+                    self.assertFalse(normalized_matcher(value.encode('utf-8')))
+                self.assertEqual(artifact.lookup('FQDN', values[1234])[0].object_id, 1234)
+
+    def test_many_values(self):
+        self.check_values()
+
+    def test_many_values_with_bloom_filter(self):
+        self.check_values(bloom_bits_per_entry=10)
+
+    def test_fingerprint_is_verified(self):
+        # Values whose hashes collide must not match each other
+        forged = (value_hash('evil.example'), value_fingerprint('good.example'), 2,
+                  encode_tlp(40, 20), encode_flags(30, 20, 40, False))
+        self.write({'FQDN': [forged, entry('evil.example', 1)]})
+        with LookupArtifact(self.path) as artifact:
+            self.assertEqual([match.object_id for match in artifact.lookup('FQDN', 'evil.example')], [1])
+        self.write({'FQDN': [forged]})
+        with LookupArtifact(self.path) as artifact:
+            self.assertFalse(artifact.contains('FQDN', 'evil.example'))
+            self.assertFalse(artifact.matcher('FQDN')('evil.example'))
+            self.assertEqual(artifact.lookup('FQDN', 'evil.example'), [])
+
+    def test_non_ascii_values(self):
+        self.write({'FQDN': [entry(u'b\xfccher.example', 1)]})
+        with LookupArtifact(self.path) as artifact:
+            matcher = artifact.matcher('FQDN')
+            # Values may be given as text or encoded as UTF-8
+            for value in (u' B\xdcCHER.example', u'b\xfccher.example'.encode('utf-8')):
+                self.assertTrue(artifact.contains('FQDN', value))
+                self.assertTrue(matcher(value))
+            self.assertFalse(matcher(u'bucher.example'))
+            self.assertTrue(artifact.matcher('FQDN', normalized=True)(u'b\xfccher.example'.encode('utf-8')))
+
+    def test_rejects_other_files(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'\0' * 64)
+        self.assertRaises(ArtifactError, LookupArtifact, self.path)
+        with open(self.path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, 1, 0, 1, 0, 0))
+        self.assertRaises(ArtifactError, LookupArtifact, self.path)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_status_management
+------------
+
+Tests for the interning of stati by content fingerprint
+(`mantis_actionables.status_management`).
+"""
+
+import mock
+
+from django.test import TestCase
+
+from mantis_actionables.models import Status, Status2X, SingletonObservable, SingletonObservableType, \
+    SingletonObservableSubtype, calculate_status_fingerprint
+from mantis_actionables.status_management import intern_statuses, status_pk_cache, updateStatus, \
+    update_status_batch, initial_status_values, status_values_to_creation_kwargs
+
+
+def creation_kwargs(**values):
+    kwargs = status_values_to_creation_kwargs(initial_status_values(None))
+    kwargs.update(values)
+    return kwargs
+
+
+class StatusInterningTests(TestCase):
+
+    def setUp(self):
+        status_pk_cache.clear()
+
+    def test_fingerprint_ignores_order_of_lists(self):
+        self.assertEqual(calculate_status_fingerprint({'tags': 'b,a', 'kill_chain_phases': 'y;x'}),
+                         calculate_status_fingerprint({'tags': 'a,b,a', 'kill_chain_phases': 'x;y'}))
+        self.assertNotEqual(calculate_status_fingerprint({'priority': Status.PRIORITY_LOW}),
+                            calculate_status_fingerprint({'priority': Status.PRIORITY_HIGH}))
+
+    def test_equal_values_are_interned_once(self):
+        created_pks = set()
+        pks = intern_statuses([creation_kwargs(most_permissive_tlp=Status.TLP_GREEN),
+                               creation_kwargs(most_permissive_tlp=Status.TLP_AMBER),
+                               creation_kwargs(most_permissive_tlp=Status.TLP_GREEN)],
+                              created_pks=created_pks)
+        self.assertEqual(pks[0], pks[2])
+        self.assertNotEqual(pks[0], pks[1])
+        self.assertEqual(created_pks, set(pks))
+        self.assertEqual(Status.objects.count(), 2)
+
+        created_pks = set()
+        self.assertEqual(intern_statuses([creation_kwargs(most_permissive_tlp=Status.TLP_AMBER)],
+                                         created_pks=created_pks),
+                         [pks[1]])
+        self.assertEqual(created_pks, set())
+
+    def test_cached_fingerprints_need_no_query(self):
+        pk = intern_statuses([creation_kwargs(priority=Status.PRIORITY_HIGH)])[0]
+        with self.assertNumQueries(0):
+            self.assertEqual(intern_statuses([creation_kwargs(priority=Status.PRIORITY_HIGH)]), [pk])
+
+    def test_uncached_fingerprints_are_resolved_with_one_query(self):
+        pks = intern_statuses([creation_kwargs(priority=Status.PRIORITY_LOW),
+                               creation_kwargs(priority=Status.PRIORITY_MEDIUM)])
+        status_pk_cache.clear()
+        with self.assertNumQueries(1):
+            self.assertEqual(intern_statuses([creation_kwargs(priority=Status.PRIORITY_LOW),
+                                              creation_kwargs(priority=Status.PRIORITY_MEDIUM)]), pks)
+
+    def test_update_status_interns(self):
+        (status, created) = updateStatus(None)
+        self.assertTrue(created)
+        self.assertEqual(status.fingerprint, Status.objects.get(pk=status.pk).fingerprint)
+
+        with self.assertNumQueries(0):
+            (same_status, created) = updateStatus(status)
+        self.assertFalse(created)
+        self.assertEqual(same_status.pk, status.pk)
+
+
+class StatusBatchUpdateTests(TestCase):
+
+    def setUp(self):
+        status_pk_cache.clear()
+        observable_type = SingletonObservableType.objects.create(name='IP')
+        subtype = SingletonObservableSubtype.objects.create(name='')
+        self.pks = [SingletonObservable.objects.create(type=observable_type, subtype=subtype, value=value).pk
+                    for value in ('10.1.2.3', '10.1.2.4')]
+
+    def test_one_active_status_per_observable(self):
+        self.assertEqual(update_status_batch([(pk, None, []) for pk in self.pks]), 2)
+        self.assertEqual(update_status_batch([(pk, None, []) for pk in self.pks]), 0)
+        self.assertEqual(sorted(Status2X.objects.filter(active=True).values_list('object_id', flat=True)),
+                         sorted(self.pks))
+
+    def test_failed_update_is_rolled_back(self):
+        with mock.patch.object(Status2X.objects, 'bulk_create', side_effect=RuntimeError("Broken")):
+            self.assertRaises(RuntimeError, update_status_batch, [(pk, None, []) for pk in self.pks])
+        self.assertEqual(Status.objects.count(), 0)
+        self.assertEqual(Status2X.objects.count(), 0)
+        # The stati interned in the failed transaction are not cached
+        self.assertEqual(update_status_batch([(pk, None, []) for pk in self.pks]), 2)
+        self.assertEqual(Status2X.objects.filter(status__in=Status.objects.all()).count(), 2)